@@ -0,0 +1,229 @@
+"""
+Módulo de Controle de Admissão
+Recusa rápido o excesso de requisições antes que ele chegue ao pool de threads e ao banco
+
+- balde de fichas por carteira: limita as operações (POST /carteiras/{endereco}/...) de uma
+  mesma carteira, que disputam as mesmas travas de SALDO_CARTEIRA -> 429
+- balde de fichas por cliente (IP ou ADMISSAO_CLIENTE_CABECALHO): limita um integrador -> 429
+- vagas: no máximo ADMISSAO_EM_ANDAMENTO_MAX requisições executando por worker; as demais esperam
+  em uma fila de até ADMISSAO_FILA_MAX por ADMISSAO_FILA_ESPERA segundos -> 503
+
+As respostas recusadas levam Retry-After. Os limites são por worker: com N workers, o total
+aceito é N vezes o configurado. O estado vive no event loop do worker, sem travas.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from app.config import (
+    ADMISSAO_CARTEIRA_TAXA, ADMISSAO_CARTEIRA_RAJADA, ADMISSAO_CLIENTE_TAXA, ADMISSAO_CLIENTE_RAJADA,
+    ADMISSAO_CLIENTE_CABECALHO, ADMISSAO_CHAVES_MAX, ADMISSAO_EM_ANDAMENTO_MAX, ADMISSAO_FILA_MAX,
+    ADMISSAO_FILA_ESPERA
+)
+from app.metricas import registro
+
+# rotas que não passam pelo controle: monitoramento, documentação, catálogo em memória e o
+# long-poll de eventos, que espera sem ocupar thread nem conexão
+_ISENTAS = frozenset({'/', '/health', '/metrics', '/moedas', '/docs', '/docs/oauth2-redirect', '/redoc', '/openapi.json'})
+
+_rejeicoes = registro.contador(
+    'carteira_admissao_rejeicoes_total', "Requisições recusadas pelo controle de admissão por motivo", ('motivo',)
+)
+
+
+class Baldes:
+    """
+    Baldes de fichas por chave: `taxa` fichas por segundo, até `rajada` acumuladas
+
+    Guarda no máximo `maximo` chaves, descartando as usadas há mais tempo; uma chave descartada
+    volta com o balde cheio, o mesmo estado de quem ficou parado.
+    """
+
+    def __init__(self, taxa, rajada, maximo):
+        self.taxa = taxa
+        self.rajada = max(rajada, 1)
+        self.maximo = maximo
+        self._baldes = OrderedDict()  # chave -> (fichas, instante)
+
+    def consumir(self, chave, agora=None):
+        """Gasta uma ficha; retorna 0 se havia, ou os segundos até a próxima"""
+        agora = time.monotonic() if agora is None else agora
+        fichas, instante = self._baldes.pop(chave, (self.rajada, agora))
+        fichas = min(self.rajada, fichas + (agora - instante) * self.taxa)
+        if fichas >= 1:
+            fichas -= 1
+            espera = 0
+        else:
+            espera = (1 - fichas) / self.taxa
+        self._baldes[chave] = (fichas, agora)
+        if len(self._baldes) > self.maximo:
+            self._baldes.popitem(last=False)
+        return espera
+
+    def __len__(self):
+        return len(self._baldes)
+
+
+class Vagas:
+    """
+    Limite de requisições em andamento, com fila de espera limitada
+
+    A vaga de quem sai passa direto para o primeiro da fila, em ordem de chegada.
+    """
+
+    def __init__(self, maximo, fila_max, espera):
+        self.maximo = maximo
+        self.fila_max = fila_max
+        self.espera = espera
+        self.em_andamento = 0
+        self._fila = deque()
+
+    @property
+    def na_fila(self):
+        return len(self._fila)
+
+    async def entrar(self):
+        """Ocupa uma vaga; retorna None, ou o motivo da recusa ('fila_cheia', 'espera_esgotada')"""
+        if self.em_andamento < self.maximo and not self._fila:
+            self.em_andamento += 1
+            return None
+        if len(self._fila) >= self.fila_max:
+            return 'fila_cheia'
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._fila.append(futuro)
+        try:
+            await asyncio.wait_for(futuro, self.espera)
+        except asyncio.TimeoutError:
+            if futuro.done() and not futuro.cancelled():
+                return None
+            self._fila.remove(futuro)
+            return 'espera_esgotada'
+        except asyncio.CancelledError:
+            # cliente desconectou na fila; se a vaga já tinha sido passada, devolve
+            if futuro.done() and not futuro.cancelled():
+                self.sair()
+            elif futuro in self._fila:
+                self._fila.remove(futuro)
+            raise
+        return None
+
+    def sair(self):
+        while self._fila:
+            futuro = self._fila.popleft()
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self.em_andamento -= 1
+
+
+def _cabecalho(scope, nome):
+    for chave, valor in scope['headers']:
+        if chave == nome:
+            return valor.decode('latin-1')
+    return None
+
+def _cliente(scope):
+    if ADMISSAO_CLIENTE_CABECALHO:
+        valor = _cabecalho(scope, ADMISSAO_CLIENTE_CABECALHO.lower().encode('latin-1'))
+        if valor:
+            return valor
+    cliente = scope.get('client')
+    return cliente[0] if cliente else 'desconhecido'
+
+def _carteira(scope):
+    """Endereço das operações de carteira (POST /carteiras/{endereco}/...), ou None"""
+    if scope['method'] != 'POST':
+        return None
+    partes = scope['path'].strip('/').split('/')
+    if len(partes) >= 3 and partes[0] == 'carteiras':
+        return partes[1]
+    return None
+
+def _isenta(scope):
+    caminho = scope['path'].rstrip('/') or '/'
+    if caminho in _ISENTAS:
+        return True
+    partes = caminho.strip('/').split('/')
+    return len(partes) == 3 and partes[0] == 'carteiras' and partes[2] == 'eventos'
+
+
+class ControlarAdmissao:
+    """Middleware ASGI que aplica os baldes e o limite de vagas antes de executar a requisição"""
+
+    def __init__(self, app):
+        self.app = app
+        self.carteiras = Baldes(ADMISSAO_CARTEIRA_TAXA, ADMISSAO_CARTEIRA_RAJADA, ADMISSAO_CHAVES_MAX) \
+            if ADMISSAO_CARTEIRA_TAXA > 0 else None
+        self.clientes = Baldes(ADMISSAO_CLIENTE_TAXA, ADMISSAO_CLIENTE_RAJADA, ADMISSAO_CHAVES_MAX) \
+            if ADMISSAO_CLIENTE_TAXA > 0 else None
+        self.vagas = Vagas(ADMISSAO_EM_ANDAMENTO_MAX, ADMISSAO_FILA_MAX, ADMISSAO_FILA_ESPERA) \
+            if ADMISSAO_EM_ANDAMENTO_MAX > 0 else None
+        global _controle
+        _controle = self
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or _isenta(scope):
+            await self.app(scope, receive, send)
+            return
+
+        agora = time.monotonic()
+        if self.clientes is not None:
+            espera = self.clientes.consumir(_cliente(scope), agora)
+            if espera:
+                await self._recusar(send, 'cliente', 429, "Limite de requisições do cliente excedido", espera)
+                return
+        endereco = _carteira(scope) if self.carteiras is not None else None
+        if endereco is not None:
+            espera = self.carteiras.consumir(endereco, agora)
+            if espera:
+                await self._recusar(send, 'carteira', 429, "Limite de operações da carteira excedido", espera)
+                return
+
+        if self.vagas is None:
+            await self.app(scope, receive, send)
+            return
+        motivo = await self.vagas.entrar()
+        if motivo is not None:
+            await self._recusar(send, motivo, 503, "Servidor ocupado, tente novamente", self.vagas.espera)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.vagas.sair()
+
+    async def _recusar(self, send, motivo, status, mensagem, espera):
+        _rejeicoes.com(motivo).incrementar()
+        corpo = json.dumps({'detail': mensagem}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(corpo)).encode()),
+                (b'retry-after', str(max(1, math.ceil(espera))).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': corpo})
+
+
+# middleware montado pela aplicação (para as métricas)
+_controle = None
+
+@registro.coletor
+def _coletar_metricas():
+    controle = _controle
+    if controle is None:
+        return []
+    metricas = [
+        ('carteira_admissao_baldes', 'gauge', "Carteiras e clientes acompanhados pelos baldes de fichas",
+         [({'tipo': tipo}, len(baldes)) for tipo, baldes in (('carteira', controle.carteiras), ('cliente', controle.clientes))
+          if baldes is not None]),
+    ]
+    if controle.vagas is not None:
+        metricas += [
+            ('carteira_admissao_em_andamento', 'gauge', "Requisições executando", [({}, controle.vagas.em_andamento)]),
+            ('carteira_admissao_fila', 'gauge', "Requisições esperando vaga", [({}, controle.vagas.na_fila)]),
+        ]
+    return metricas
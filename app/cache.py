@@ -0,0 +1,149 @@
+"""
+Módulo de Cache
+Cache em memória com limite de tamanho (LRU) e tempo de vida (TTL), por processo
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# retorno de CacheLRU.obter quando a chave não está no cache (None é um valor válido: resultado negativo)
+AUSENTE = object()
+
+
+class CacheLRU:
+    """
+    Cache LRU com TTL e cache negativo
+
+    - `maximo` entradas; ao passar do limite remove a usada há mais tempo
+    - valores expiram após `ttl` segundos; None (ex. "carteira não existe") expira após `ttl_negativo`
+    - invalidar(chave) remove a entrada e avança a geração da chave: quem leu do banco antes da
+      invalidação e tenta guardar depois (guardar com a geração antiga) é ignorado
+    - escrita direta (write-through): marcar(chave) antes da transação e aplicar(chave, funcao, marca)
+      depois do commit; a entrada só é atualizada se foi carregada antes da marca (portanto sem a
+      escrita), senão é removida
+    """
+
+    _FAIXAS_GERACAO = 1024
+
+    def __init__(self, maximo, ttl, ttl_negativo=None):
+        self.maximo = maximo
+        self.ttl = ttl
+        self.ttl_negativo = ttl if ttl_negativo is None else ttl_negativo
+        self._entradas = OrderedDict()  # chave -> (valor, expira_em, geracao em que foi guardada)
+        self._geracoes = [0] * self._FAIXAS_GERACAO
+        self._lock = threading.Lock()
+
+        self._acertos = 0
+        self._acertos_negativos = 0
+        self._faltas = 0
+        self._expiradas = 0
+        self._removidas = 0
+        self._invalidacoes = 0
+        self._atualizacoes = 0
+        self._descartadas = 0
+
+    def _faixa(self, chave):
+        return hash(chave) % self._FAIXAS_GERACAO
+
+    def geracao(self, chave):
+        """Geração atual da chave; ler antes de ir ao banco e passar para guardar()"""
+        return self._geracoes[self._faixa(chave)]
+
+    def obter(self, chave):
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self._faltas += 1
+                return AUSENTE
+            valor, expira_em, _ = entrada
+            if expira_em <= agora:
+                del self._entradas[chave]
+                self._expiradas += 1
+                self._faltas += 1
+                return AUSENTE
+            self._entradas.move_to_end(chave)
+            if valor is None:
+                self._acertos_negativos += 1
+            else:
+                self._acertos += 1
+            return valor
+
+    def guardar(self, chave, valor, geracao=None):
+        ttl = self.ttl_negativo if valor is None else self.ttl
+        if ttl <= 0 or self.maximo <= 0:
+            return
+        expira_em = time.monotonic() + ttl
+        with self._lock:
+            atual = self._geracoes[self._faixa(chave)]
+            if geracao is not None and atual != geracao:
+                # invalidada enquanto o valor era lido do banco
+                self._descartadas += 1
+                return
+            self._entradas[chave] = (valor, expira_em, atual)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+                self._removidas += 1
+
+    def marcar(self, chave):
+        """Avança a geração da chave antes de uma escrita; retorna a marca para aplicar()"""
+        with self._lock:
+            faixa = self._faixa(chave)
+            self._geracoes[faixa] += 1
+            return self._geracoes[faixa]
+
+    def aplicar(self, chave, funcao, marca):
+        """
+        Depois do commit de uma escrita marcada: entrada = funcao(entrada)
+
+        Entradas guardadas depois da marca podem já conter a escrita e são removidas, assim
+        como as entradas para as quais `funcao` retornar AUSENTE. A geração avança de novo para
+        descartar leituras do banco feitas antes do commit e ainda não guardadas.
+        """
+        with self._lock:
+            faixa = self._faixa(chave)
+            self._geracoes[faixa] += 1
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                return
+            valor, expira_em, geracao = entrada
+            novo = funcao(valor) if geracao < marca and valor is not None else AUSENTE
+            if novo is AUSENTE:
+                del self._entradas[chave]
+                self._invalidacoes += 1
+            else:
+                self._entradas[chave] = (novo, expira_em, geracao)
+                self._atualizacoes += 1
+
+    def invalidar(self, chave):
+        with self._lock:
+            self._geracoes[self._faixa(chave)] += 1
+            if self._entradas.pop(chave, None) is not None:
+                self._invalidacoes += 1
+
+    def limpar(self):
+        with self._lock:
+            for faixa in range(self._FAIXAS_GERACAO):
+                self._geracoes[faixa] += 1
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self._acertos + self._acertos_negativos + self._faltas
+            return {
+                'tamanho': len(self._entradas),
+                'maximo': self.maximo,
+                'acertos': self._acertos,
+                'acertos_negativos': self._acertos_negativos,
+                'faltas': self._faltas,
+                'taxa_acerto': (self._acertos + self._acertos_negativos) / consultas if consultas else 0.0,
+                'expiradas': self._expiradas,
+                'removidas': self._removidas,
+                'invalidacoes': self._invalidacoes,
+                'atualizacoes': self._atualizacoes,
+                'descartadas': self._descartadas,
+            }
@@ -0,0 +1,134 @@
+"""
+Módulo de Commit Agrupado
+Junta operações de várias requisições em uma única transação (um commit, um fsync no MySQL)
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app.metricas import Contador, Histograma
+
+LIMITES_TAMANHO_LOTE = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+LIMITES_TEMPO = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+_FIM = object()
+
+
+class CommitAgrupado:
+    """
+    Fila de operações atendida por uma thread que as grava em lotes
+
+    - o lote fecha `janela` segundos depois da primeira operação ou ao chegar a `maximo` operações
+    - `processar_lote(itens)` grava o lote em uma transação e retorna um resultado por item
+      (valor ou exceção a entregar a quem enviou)
+    - se o lote inteiro falhar, cada item é refeito sozinho com `processar_um(item)`, para que
+      uma operação problemática não derrube as outras
+    - quem enviou recebe um Future, resolvido só depois do commit
+    """
+
+    def __init__(self, processar_lote, processar_um, janela, maximo, nome='commit-agrupado'):
+        self.processar_lote = processar_lote
+        self.processar_um = processar_um
+        self.janela = janela
+        self.maximo = maximo
+        self._fila = queue.Queue()
+        self._fechado = False
+        self._lock = threading.Lock()
+
+        self.tamanho_lote = Histograma(LIMITES_TAMANHO_LOTE)
+        self.espera_fila = Histograma(LIMITES_TEMPO)
+        self.duracao_lote = Histograma(LIMITES_TEMPO)
+        self.lotes = Contador()
+        self.lotes_com_falha = Contador()
+        self.operacoes_individuais = Contador()
+
+        self._thread = threading.Thread(target=self._executar, name=nome, daemon=True)
+        self._thread.start()
+
+    def enviar(self, item):
+        futuro = Future()
+        with self._lock:
+            if self._fechado:
+                raise RuntimeError("Commit agrupado encerrado")
+            self._fila.put((item, futuro, time.monotonic()))
+        return futuro
+
+    def _coletar(self, primeiro):
+        lote = [primeiro]
+        prazo = time.monotonic() + self.janela
+        while len(lote) < self.maximo:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                pedido = self._fila.get(timeout=restante)
+            except queue.Empty:
+                break
+            if pedido is _FIM:
+                # devolve o aviso de fim para depois deste lote
+                self._fila.put(_FIM)
+                break
+            lote.append(pedido)
+        return lote
+
+    def _executar(self):
+        while True:
+            pedido = self._fila.get()
+            if pedido is _FIM:
+                return
+            lote = self._coletar(pedido)
+            try:
+                self._gravar(lote)
+            except Exception as e:
+                # falha fora do esperado: ninguém pode ficar esperando para sempre
+                for _, futuro, _ in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+
+    def _gravar(self, lote):
+        inicio = time.monotonic()
+        for _, _, enviado_em in lote:
+            self.espera_fila.observar(inicio - enviado_em)
+        self.tamanho_lote.observar(len(lote))
+        self.lotes.incrementar()
+
+        itens = [item for item, _, _ in lote]
+        try:
+            resultados = self.processar_lote(itens)
+        except Exception:
+            # refaz cada operação na sua própria transação
+            self.lotes_com_falha.incrementar()
+            self.operacoes_individuais.incrementar(len(itens))
+            resultados = []
+            for item in itens:
+                try:
+                    resultados.append(self.processar_um(item))
+                except Exception as e:
+                    resultados.append(e)
+        self.duracao_lote.observar(time.monotonic() - inicio)
+
+        for (_, futuro, _), resultado in zip(lote, resultados):
+            if isinstance(resultado, BaseException):
+                futuro.set_exception(resultado)
+            else:
+                futuro.set_result(resultado)
+
+    def fechar(self):
+        """Para de aceitar operações e espera gravar as que já estão na fila"""
+        with self._lock:
+            if self._fechado:
+                return
+            self._fechado = True
+            self._fila.put(_FIM)
+        self._thread.join()
+
+    def estatisticas(self):
+        return {
+            'fila': self._fila.qsize(),
+            'lotes': self.lotes.valor,
+            'lotes_com_falha': self.lotes_com_falha.valor,
+            'operacoes_individuais': self.operacoes_individuais.valor,
+            'tamanho_lote': self.tamanho_lote.estatisticas(),
+            'espera_fila': self.espera_fila.estatisticas(),
+            'duracao_lote': self.duracao_lote.estatisticas(),
+        }
@@ -8,6 +8,13 @@ from dotenv import load_dotenv
 # Carregar variáveis do arquivo .env
 load_dotenv()
 
+# Modo de execução das operações de carteira: 'sync' (def + pymysql + requests)
+# ou 'async' (async def + aiomysql + httpx)
+API_MODO = os.getenv('API_MODO', 'sync')
+
+# Armazenamento das carteiras: 'mysql' ou 'memoria' (livro-razão em memória com log, app/livro.py)
+ARMAZENAMENTO = os.getenv('ARMAZENAMENTO', 'mysql')
+
 # Configurações do Banco de Dados
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = int(os.getenv('DB_PORT', 3306))
@@ -15,11 +22,130 @@ DB_USER = os.getenv('DB_USER', 'wallet_api_homolog')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'api123')
 DB_NAME = os.getenv('DB_NAME', 'wallet_homolog')
 
+# Configurações do Pool de Conexões
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 2))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))              # segundos esperando uma conexão livre
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)) # segundos até reciclar a conexão
+DB_POOL_VALIDAR_APOS = float(os.getenv('DB_POOL_VALIDAR_APOS', 1))    # ociosidade (s) que exige ping na retirada
+
+# Configurações das Réplicas de Leitura (saldos, carteira e extrato; escritas sempre no primário)
+DB_REPLICAS = tuple(                                                           # [usuario[:senha]@]host[:porta][/banco], separadas por vírgula
+    dsn.strip() for dsn in os.getenv('DB_REPLICAS', '').split(',') if dsn.strip()
+)
+DB_REPLICA_ATRASO_MAX = float(os.getenv('DB_REPLICA_ATRASO_MAX', 1))           # segundos de atraso de replicação aceitos
+DB_REPLICA_VERIFICACAO = float(os.getenv('DB_REPLICA_VERIFICACAO', 1))         # segundos entre pulsos e verificações das réplicas
+DB_REPLICA_JANELA_ESCRITA = float(os.getenv('DB_REPLICA_JANELA_ESCRITA', 5))   # segundos lendo do primário após escrita da carteira
+
+# Configurações de Repetição de Transações (deadlock 1213 e espera de trava esgotada 1205)
+DB_REPETICOES_MAX = int(os.getenv('DB_REPETICOES_MAX', 3))                         # novas tentativas por unidade de trabalho
+DB_REPETICAO_ESPERA_BASE_MS = float(os.getenv('DB_REPETICAO_ESPERA_BASE_MS', 5))   # teto da espera na primeira repetição
+DB_REPETICAO_ESPERA_MAX_MS = float(os.getenv('DB_REPETICAO_ESPERA_MAX_MS', 100))   # teto da espera entre tentativas
+
 # Configurações de Taxas
 TAXA_SAQUE_PERCENTUAL = float(os.getenv('TAXA_SAQUE_PERCENTUAL', 0.01))
 TAXA_CONVERSAO_PERCENTUAL = float(os.getenv('TAXA_CONVERSAO_PERCENTUAL', 0.02))
 TAXA_TRANSFERENCIA_PERCENTUAL = float(os.getenv('TAXA_TRANSFERENCIA_PERCENTUAL', 0.01))
 
+# Configurações de Cotação
+COTACAO_PROVEDOR = os.getenv('COTACAO_PROVEDOR', 'coinbase')               # 'coinbase' ou 'fixo' (testes/benchmarks)
+COTACAO_MOEDA_BASE = os.getenv('COTACAO_MOEDA_BASE', 'USD')                # moeda base da tabela usada na triangulação
+COTACAO_POOL_HTTP = int(os.getenv('COTACAO_POOL_HTTP', 10))                # conexões keep-alive com o provedor
+COTACAO_TIMEOUT = float(os.getenv('COTACAO_TIMEOUT', 10))                  # segundos por chamada ao provedor
+COTACAO_TTL = float(os.getenv('COTACAO_TTL', 5))                           # segundos servindo do cache sem atualizar
+COTACAO_JANELA_STALE = float(os.getenv('COTACAO_JANELA_STALE', 30))        # segundos após o TTL servindo a antiga enquanto atualiza
+COTACAO_IDADE_MAXIMA = float(os.getenv('COTACAO_IDADE_MAXIMA', 300))       # idade máxima da última cotação boa quando o provedor falha
+COTACAO_FALHAS_DISJUNTOR = int(os.getenv('COTACAO_FALHAS_DISJUNTOR', 5))   # falhas seguidas que abrem o disjuntor
+COTACAO_DISJUNTOR_RESET = float(os.getenv('COTACAO_DISJUNTOR_RESET', 30))  # segundos com o disjuntor aberto
+
+# Configurações das Cotações Travadas (POST /carteiras/{endereco}/conversoes/cotacao)
+COTACAO_TRAVADA_TTL = float(os.getenv('COTACAO_TRAVADA_TTL', 15))     # segundos em que a cotação emitida vale
+COTACAO_TRAVADA_MAX = int(os.getenv('COTACAO_TRAVADA_MAX', 100000))   # cotações guardadas por worker
+COTACAO_TRAVADA_SEGREDO = os.getenv('COTACAO_TRAVADA_SEGREDO', '')    # chave que assina os ids; vazio: aleatória por processo
+
+# Configurações do Cache de Carteiras
+CACHE_CARTEIRAS_MAX = int(os.getenv('CACHE_CARTEIRAS_MAX', 100000))                # carteiras em memória por worker
+CACHE_CARTEIRAS_TTL = float(os.getenv('CACHE_CARTEIRAS_TTL', 60))                  # segundos por carteira em cache
+CACHE_CARTEIRAS_TTL_NEGATIVO = float(os.getenv('CACHE_CARTEIRAS_TTL_NEGATIVO', 5))  # segundos para endereços inexistentes
+
+# Configurações do Cache de Saldos
+CACHE_SALDOS_MAX = int(os.getenv('CACHE_SALDOS_MAX', 100000))  # carteiras com saldos em memória por worker
+CACHE_SALDOS_TTL = float(os.getenv('CACHE_SALDOS_TTL', 30))    # segundos até reler os saldos do banco
+
+# Configurações do Commit Agrupado de Depósitos
+DEPOSITO_COMMIT_AGRUPADO = os.getenv('DEPOSITO_COMMIT_AGRUPADO', 'false').lower() in ('1', 'true', 'sim')
+COMMIT_AGRUPADO_JANELA_MS = float(os.getenv('COMMIT_AGRUPADO_JANELA_MS', 2))        # espera máxima para fechar um lote
+COMMIT_AGRUPADO_MAX_OPERACOES = int(os.getenv('COMMIT_AGRUPADO_MAX_OPERACOES', 200))  # operações por lote
+
+# Configurações de Saldos Particionados (carteiras quentes)
+# créditos das carteiras listadas caem em um de SALDO_SLOTS slots, em vez de todos disputarem a mesma linha
+SALDOS_PARTICIONADOS = os.getenv('SALDOS_PARTICIONADOS', 'false').lower() in ('1', 'true', 'sim')
+CARTEIRAS_QUENTES = frozenset(                                   # endereços separados por vírgula
+    endereco.strip() for endereco in os.getenv('CARTEIRAS_QUENTES', '').split(',') if endereco.strip()
+)
+SALDO_SLOTS = int(os.getenv('SALDO_SLOTS', 16))                  # slots de crédito por saldo de carteira quente
+
+# Configurações do Livro-Razão em Memória (ARMAZENAMENTO=memoria)
+LIVRO_DIRETORIO = os.getenv('LIVRO_DIRETORIO', 'dados_livro')                  # log (wal-*.log) e snapshot
+LIVRO_FSYNC = os.getenv('LIVRO_FSYNC', 'true').lower() in ('1', 'true', 'sim')  # fsync do log antes de cada resposta
+LIVRO_SNAPSHOT_OPERACOES = int(os.getenv('LIVRO_SNAPSHOT_OPERACOES', 100000))   # transações no log entre snapshots
+
+# Configurações de Criação de Carteiras em Lote
+LOTE_CARTEIRAS_MAX = int(os.getenv('LOTE_CARTEIRAS_MAX', 1000000))   # carteiras por requisição
+LOTE_CARTEIRAS_BLOCO = int(os.getenv('LOTE_CARTEIRAS_BLOCO', 1000))  # carteiras por INSERT multi-linha
+
+# Configurações de Operações em Lote
+LOTE_OPERACOES_MAX = int(os.getenv('LOTE_OPERACOES_MAX', 5000))  # operações por requisição
+
+# Configurações do Extrato
+EXTRATO_LIMITE_PADRAO = int(os.getenv('EXTRATO_LIMITE_PADRAO', 50))  # movimentos por página
+EXTRATO_LIMITE_MAX = int(os.getenv('EXTRATO_LIMITE_MAX', 500))       # maior página aceita
+
+# Configurações de Exportação
+EXPORTACAO_LOTE_LINHAS = int(os.getenv('EXPORTACAO_LOTE_LINHAS', 1000))              # linhas lidas do servidor por vez
+EXPORTACAO_TAMANHO_BLOCO = int(os.getenv('EXPORTACAO_TAMANHO_BLOCO', 65536))         # bytes por bloco escrito
+EXPORTACAO_NET_WRITE_TIMEOUT = int(os.getenv('EXPORTACAO_NET_WRITE_TIMEOUT', 3600))  # segundos que o MySQL espera o consumidor
+
+# Configurações da Reconciliação de Saldos (python -m app.reconciliacao)
+RECONCILIACAO_ATRASO = int(os.getenv('RECONCILIACAO_ATRASO', 60))              # segundos: movimentos mais novos ficam para a próxima execução
+RECONCILIACAO_BLOCO = int(os.getenv('RECONCILIACAO_BLOCO', 10000))             # movimentos somados por transação
+RECONCILIACAO_COMPARACAO = int(os.getenv('RECONCILIACAO_COMPARACAO', 1000))    # saldos comparados por consulta
+RECONCILIACAO_TOLERANCIA = os.getenv('RECONCILIACAO_TOLERANCIA', '0')          # diferença aceita entre saldo e movimentos
+
+# Configurações dos Eventos de Saldo (EVENTO_SALDO e GET /carteiras/{endereco}/eventos)
+EVENTOS_SALDO = os.getenv('EVENTOS_SALDO', 'false').lower() in ('1', 'true', 'sim')
+EVENTOS_INTERVALO_MS = float(os.getenv('EVENTOS_INTERVALO_MS', 100))     # intervalo entre leituras do despachante
+EVENTOS_LOTE = int(os.getenv('EVENTOS_LOTE', 1000))                      # eventos lidos por consulta
+EVENTOS_LACUNA_MS = float(os.getenv('EVENTOS_LACUNA_MS', 2000))          # espera por um id ainda não confirmado antes de pulá-lo
+EVENTOS_BUFFER = int(os.getenv('EVENTOS_BUFFER', 10000))                 # eventos recentes em memória por worker
+EVENTOS_ESPERA_MAX = float(os.getenv('EVENTOS_ESPERA_MAX', 30))          # segundos máximos de espera do long-poll
+EVENTOS_PULSO = float(os.getenv('EVENTOS_PULSO', 15))                    # segundos entre comentários de keep-alive no SSE
+EVENTOS_RETENCAO_HORAS = float(os.getenv('EVENTOS_RETENCAO_HORAS', 24))  # eventos mais antigos são apagados; 0 desliga
+
+# Configurações de Idempotência (cabeçalho Idempotency-Key nas operações e na criação de carteiras)
+IDEMPOTENCIA_CACHE_MAX = int(os.getenv('IDEMPOTENCIA_CACHE_MAX', 100000))          # resultados guardados em memória por worker
+IDEMPOTENCIA_CACHE_TTL = float(os.getenv('IDEMPOTENCIA_CACHE_TTL', 600))           # segundos de um resultado em memória
+IDEMPOTENCIA_ESPERA = float(os.getenv('IDEMPOTENCIA_ESPERA', 30))                  # segundos que a repetição espera a original (depois, 409)
+IDEMPOTENCIA_RETENCAO_HORAS = float(os.getenv('IDEMPOTENCIA_RETENCAO_HORAS', 24))  # resultados mais antigos são apagados da tabela; 0 desliga
+
+# Configurações do Controle de Admissão (app/admissao.py; taxa ou máximo 0 desliga cada limite)
+ADMISSAO_CARTEIRA_TAXA = float(os.getenv('ADMISSAO_CARTEIRA_TAXA', 0))       # operações (POST) por segundo por carteira
+ADMISSAO_CARTEIRA_RAJADA = int(os.getenv('ADMISSAO_CARTEIRA_RAJADA', 10))    # operações seguidas aceitas de uma carteira
+ADMISSAO_CLIENTE_TAXA = float(os.getenv('ADMISSAO_CLIENTE_TAXA', 0))         # requisições por segundo por cliente
+ADMISSAO_CLIENTE_RAJADA = int(os.getenv('ADMISSAO_CLIENTE_RAJADA', 50))      # requisições seguidas aceitas de um cliente
+ADMISSAO_CLIENTE_CABECALHO = os.getenv('ADMISSAO_CLIENTE_CABECALHO', '')     # cabeçalho que identifica o cliente; vazio usa o IP
+ADMISSAO_CHAVES_MAX = int(os.getenv('ADMISSAO_CHAVES_MAX', 100000))          # carteiras e clientes acompanhados por worker
+ADMISSAO_EM_ANDAMENTO_MAX = int(os.getenv('ADMISSAO_EM_ANDAMENTO_MAX', 0))   # requisições executando ao mesmo tempo por worker
+ADMISSAO_FILA_MAX = int(os.getenv('ADMISSAO_FILA_MAX', 100))                 # requisições esperando vaga; acima disso, 503
+ADMISSAO_FILA_ESPERA = float(os.getenv('ADMISSAO_FILA_ESPERA', 1))           # segundos esperando vaga antes do 503
+
+# Configurações de Perfilamento por Requisição (cProfile)
+PERFIL_TOKEN = os.getenv('PERFIL_TOKEN', '')                  # valor do cabeçalho X-Perfil que perfila a requisição; vazio desliga
+PERFIL_AMOSTRAGEM = float(os.getenv('PERFIL_AMOSTRAGEM', 0))  # fração das requisições perfiladas por sorteio (0 a 1)
+PERFIL_LIMIAR_MS = float(os.getenv('PERFIL_LIMIAR_MS', 0))    # perfis sorteados só são gravados acima desta duração
+PERFIL_DIRETORIO = os.getenv('PERFIL_DIRETORIO', 'perfis')    # onde os arquivos .prof são gravados
+PERFIL_LINHAS = int(os.getenv('PERFIL_LINHAS', 40))           # funções listadas no relatório em texto
+
 # Configurações de Chaves
 PRIVATE_KEY_SIZE = int(os.getenv('PRIVATE_KEY_SIZE', 32))
 PUBLIC_KEY_SIZE = int(os.getenv('PUBLIC_KEY_SIZE', 16))
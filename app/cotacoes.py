@@ -0,0 +1,467 @@
+"""
+Módulo de Cotações
+Cache de cotações na frente do provedor externo (Coinbase)
+
+A cada atualização o provedor devolve uma única tabela de taxas em relação à moeda
+base (ex.: USD) e todas as cotações cruzadas (BTC-SOL, ETH-BRL, ...) são derivadas
+dela por triangulação, formando a matriz de cotações.
+
+- TTL: dentro do TTL a matriz é servida da memória
+- stale-while-revalidate: depois do TTL, e dentro da janela de tolerância, a matriz
+  antiga é servida enquanto uma atualização roda em segundo plano
+- single-flight: requisições simultâneas disparam uma única busca
+- disjuntor: após falhas seguidas o provedor deixa de ser chamado por um tempo e a
+  última matriz boa é usada, desde que não seja mais velha que a idade máxima
+"""
+import asyncio
+import threading
+import time
+from decimal import Decimal, localcontext
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from app.config import (
+    COTACAO_PROVEDOR, COTACAO_TIMEOUT, COTACAO_TTL, COTACAO_JANELA_STALE, COTACAO_IDADE_MAXIMA,
+    COTACAO_FALHAS_DISJUNTOR, COTACAO_DISJUNTOR_RESET, COTACAO_MOEDA_BASE, COTACAO_POOL_HTTP
+)
+from app.metricas import LIMITES_LATENCIA, registro
+from app.moedas import obter_catalogo
+
+# precisão usada nas divisões da triangulação
+PRECISAO_COTACAO = 34
+
+# duração de cada chamada ao provedor (só as buscas; cotações servidas do cache não passam por aqui)
+_duracao_buscas = registro.histograma(
+    'carteira_cotacao_busca_duracao_segundos', "Duração das buscas de cotação no provedor",
+    LIMITES_LATENCIA, ('resultado',)
+)
+
+
+# PROVEDORES
+
+class ProvedorCoinbase:
+    """
+    Busca a tabela de taxas da moeda base na API pública da Coinbase
+
+    Usa uma sessão HTTP com pool de conexões keep-alive, reaproveitada entre atualizações.
+    No modo assíncrono usa um httpx.AsyncClient, criado no event loop da aplicação.
+    """
+
+    URL = "https://api.coinbase.com/v2/exchange-rates"
+
+    def __init__(self, timeout=COTACAO_TIMEOUT, tamanho_pool=COTACAO_POOL_HTTP):
+        self.timeout = timeout
+        self._sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho_pool)
+        self._sessao.mount("https://", adaptador)
+        self._limites_async = httpx.Limits(max_keepalive_connections=tamanho_pool)
+        self._cliente_async = None
+
+    @staticmethod
+    def _ler_tabela(data):
+        return {codigo: Decimal(taxa) for codigo, taxa in data['data']['rates'].items()}
+
+    def obter_tabela(self, moeda_base):
+        """Retorna {código: quantidade da moeda por 1 unidade da moeda base}"""
+        response = self._sessao.get(self.URL, params={'currency': moeda_base}, timeout=self.timeout)
+        response.raise_for_status()
+        return self._ler_tabela(response.json())
+
+    async def obter_tabela_async(self, moeda_base):
+        if self._cliente_async is None:
+            self._cliente_async = httpx.AsyncClient(timeout=self.timeout, limits=self._limites_async)
+        response = await self._cliente_async.get(self.URL, params={'currency': moeda_base})
+        response.raise_for_status()
+        return self._ler_tabela(response.json())
+
+    async def fechar_async(self):
+        if self._cliente_async is not None:
+            await self._cliente_async.aclose()
+            self._cliente_async = None
+
+
+class ProvedorFixo:
+    """
+    Provedor local com preços fixos em USD, para testes e benchmarks
+
+    `latencia` simula o tempo de resposta do provedor real.
+    """
+
+    PRECOS_USD = {
+        'BTC': Decimal('65000'),
+        'ETH': Decimal('3500'),
+        'SOL': Decimal('150'),
+        'USD': Decimal('1'),
+        'BRL': Decimal('0.18'),
+    }
+
+    def __init__(self, precos_usd=None, latencia=0.0):
+        self.precos_usd = dict(precos_usd or self.PRECOS_USD)
+        self.latencia = latencia
+        self.chamadas = 0
+
+    def obter_tabela(self, moeda_base):
+        self.chamadas += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+        return self._tabela(moeda_base)
+
+    async def obter_tabela_async(self, moeda_base):
+        self.chamadas += 1
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+        return self._tabela(moeda_base)
+
+    def _tabela(self, moeda_base):
+        if moeda_base not in self.precos_usd:
+            raise ValueError(f"Moeda base {moeda_base} sem preço")
+        preco_base = self.precos_usd[moeda_base]
+        with localcontext() as contexto:
+            contexto.prec = PRECISAO_COTACAO
+            return {codigo: preco_base / preco for codigo, preco in self.precos_usd.items()}
+
+
+# MATRIZ
+
+class MatrizCotacoes:
+    """
+    Todas as cotações cruzadas derivadas de uma tabela de taxas da moeda base
+
+    Para a tabela {código: unidades por 1 base}, a cotação origem -> destino é
+    taxa(destino) / taxa(origem). Os pares das moedas em `codigos` são calculados
+    na criação; outros pares presentes na tabela são calculados sob demanda.
+    """
+
+    def __init__(self, tabela, codigos=None):
+        self.tabela = {codigo: taxa for codigo, taxa in tabela.items() if taxa > 0}
+        self.pares = {}
+        if codigos is not None:
+            codigos = [codigo for codigo in codigos if codigo in self.tabela]
+            for origem in codigos:
+                for destino in codigos:
+                    self.pares[(origem, destino)] = self._triangular(origem, destino)
+
+    def _triangular(self, codigo_origem, codigo_destino):
+        if codigo_origem == codigo_destino:
+            return Decimal(1)
+        with localcontext() as contexto:
+            contexto.prec = PRECISAO_COTACAO
+            return self.tabela[codigo_destino] / self.tabela[codigo_origem]
+
+    def cotacao(self, codigo_origem, codigo_destino):
+        cotacao = self.pares.get((codigo_origem, codigo_destino))
+        if cotacao is not None:
+            return cotacao
+        if codigo_origem not in self.tabela or codigo_destino not in self.tabela:
+            raise ValueError(f"Par {codigo_origem}-{codigo_destino} sem cotação")
+        return self._triangular(codigo_origem, codigo_destino)
+
+
+# DISJUNTOR
+
+class Disjuntor:
+    """
+    Circuit breaker do provedor de cotações
+
+    Fechado: chamadas passam. Aberto: chamadas são recusadas até `tempo_reset`.
+    Depois disso uma única chamada de teste passa (meio-aberto); sucesso fecha o
+    disjuntor, falha abre de novo.
+    """
+
+    def __init__(self, falhas_para_abrir, tempo_reset):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.tempo_reset = tempo_reset
+        self._falhas = 0
+        self._aberto_em = None
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def permite(self):
+        with self._lock:
+            if self._aberto_em is None:
+                return True
+            if self._teste_em_andamento or time.monotonic() - self._aberto_em < self.tempo_reset:
+                return False
+            self._teste_em_andamento = True
+            return True
+
+    def sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._aberto_em = None
+            self._teste_em_andamento = False
+
+    def falha(self):
+        with self._lock:
+            self._falhas += 1
+            if self._teste_em_andamento or self._falhas >= self.falhas_para_abrir:
+                self._aberto_em = time.monotonic()
+            self._teste_em_andamento = False
+
+    @property
+    def estado(self):
+        with self._lock:
+            if self._aberto_em is None:
+                return 'fechado'
+            if self._teste_em_andamento:
+                return 'meio-aberto'
+            return 'aberto'
+
+
+# CACHE
+
+class _Voo:
+    """Busca em andamento; quem chega depois espera o resultado dela"""
+
+    __slots__ = ('evento', 'resultado', 'erro')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class CacheCotacoes:
+
+    def __init__(self, provedor, moeda_base=COTACAO_MOEDA_BASE, codigos=None, ttl=COTACAO_TTL,
+                 janela_stale=COTACAO_JANELA_STALE, idade_maxima=COTACAO_IDADE_MAXIMA,
+                 disjuntor=None, timeout_espera=COTACAO_TIMEOUT):
+        self.provedor = provedor
+        self.moeda_base = moeda_base
+        self.codigos = codigos  # função que retorna os códigos pré-calculados na matriz
+        self.ttl = ttl
+        self.janela_stale = janela_stale
+        self.idade_maxima = idade_maxima
+        self.timeout_espera = timeout_espera
+        self.disjuntor = disjuntor or Disjuntor(COTACAO_FALHAS_DISJUNTOR, COTACAO_DISJUNTOR_RESET)
+
+        self._matrizes = {}  # moeda base -> (MatrizCotacoes, obtida_em)
+        self._voos = {}      # moeda base -> _Voo
+        self._tarefas = {}   # moeda base -> asyncio.Task (modo assíncrono)
+        self._lock = threading.Lock()
+
+        # estatísticas
+        self.acertos = 0
+        self.acertos_stale = 0
+        self.buscas = 0
+        self.falhas = 0
+        self.fallbacks = 0
+
+    def obter(self, codigo_origem, codigo_destino):
+        return self.obter_matriz().cotacao(codigo_origem, codigo_destino)
+
+    def obter_matriz(self):
+        chave = self.moeda_base
+        agora = time.monotonic()
+
+        with self._lock:
+            entrada = self._matrizes.get(chave)
+            if entrada:
+                matriz, obtida_em = entrada
+                idade = agora - obtida_em
+                if idade < self.ttl:
+                    self.acertos += 1
+                    return matriz
+                if idade < self.ttl + self.janela_stale:
+                    # serve a matriz antiga e atualiza em segundo plano
+                    self.acertos_stale += 1
+                    voo, lider = self._entrar_voo(chave)
+                    if lider:
+                        threading.Thread(
+                            target=self._buscar, args=(chave, voo), daemon=True
+                        ).start()
+                    return matriz
+
+            voo, lider = self._entrar_voo(chave)
+
+        if lider:
+            self._buscar(chave, voo)
+        elif not voo.evento.wait(self.timeout_espera):
+            return self._fallback(chave, TimeoutError("tempo esgotado aguardando cotação"))
+
+        if voo.erro is not None:
+            return self._fallback(chave, voo.erro)
+        return voo.resultado
+
+    async def obter_async(self, codigo_origem, codigo_destino):
+        matriz = await self.obter_matriz_async()
+        return matriz.cotacao(codigo_origem, codigo_destino)
+
+    async def obter_matriz_async(self):
+        """Mesmas regras de obter_matriz, com a busca feita em uma task do event loop"""
+        chave = self.moeda_base
+        agora = time.monotonic()
+
+        with self._lock:
+            entrada = self._matrizes.get(chave)
+            if entrada:
+                matriz, obtida_em = entrada
+                idade = agora - obtida_em
+                if idade < self.ttl:
+                    self.acertos += 1
+                    return matriz
+                if idade < self.ttl + self.janela_stale:
+                    self.acertos_stale += 1
+                    self._tarefa_async(chave)
+                    return matriz
+
+        tarefa = self._tarefa_async(chave)
+        try:
+            # shield: o timeout de quem espera não cancela a busca compartilhada
+            return await asyncio.wait_for(asyncio.shield(tarefa), self.timeout_espera)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = TimeoutError("tempo esgotado aguardando cotação")
+            return self._fallback(chave, e)
+
+    def _tarefa_async(self, chave):
+        tarefa = self._tarefas.get(chave)
+        if tarefa is None:
+            tarefa = asyncio.ensure_future(self._buscar_async(chave))
+            # a atualização em segundo plano pode falhar sem ninguém esperando por ela
+            tarefa.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._tarefas[chave] = tarefa
+        return tarefa
+
+    async def _buscar_async(self, chave):
+        try:
+            if not self.disjuntor.permite():
+                raise ConnectionError("provedor de cotações indisponível (disjuntor aberto)")
+            inicio = time.perf_counter()
+            try:
+                tabela = await self.provedor.obter_tabela_async(chave)
+            except Exception:
+                _duracao_buscas.com('falha').observar(time.perf_counter() - inicio)
+                self.disjuntor.falha()
+                raise
+            _duracao_buscas.com('sucesso').observar(time.perf_counter() - inicio)
+            self.disjuntor.sucesso()
+            matriz = MatrizCotacoes(tabela, self.codigos() if self.codigos else None)
+            with self._lock:
+                self.buscas += 1
+                self._matrizes[chave] = (matriz, time.monotonic())
+            return matriz
+        except Exception:
+            with self._lock:
+                self.falhas += 1
+            raise
+        finally:
+            self._tarefas.pop(chave, None)
+
+    def _entrar_voo(self, chave):
+        # chamado com self._lock adquirido
+        voo = self._voos.get(chave)
+        if voo is not None:
+            return voo, False
+        voo = _Voo()
+        self._voos[chave] = voo
+        return voo, True
+
+    def _buscar(self, chave, voo):
+        try:
+            if not self.disjuntor.permite():
+                raise ConnectionError("provedor de cotações indisponível (disjuntor aberto)")
+            inicio = time.perf_counter()
+            try:
+                tabela = self.provedor.obter_tabela(chave)
+            except Exception:
+                _duracao_buscas.com('falha').observar(time.perf_counter() - inicio)
+                self.disjuntor.falha()
+                raise
+            _duracao_buscas.com('sucesso').observar(time.perf_counter() - inicio)
+            self.disjuntor.sucesso()
+            matriz = MatrizCotacoes(tabela, self.codigos() if self.codigos else None)
+            with self._lock:
+                self.buscas += 1
+                self._matrizes[chave] = (matriz, time.monotonic())
+            voo.resultado = matriz
+        except Exception as e:
+            with self._lock:
+                self.falhas += 1
+            voo.erro = e
+        finally:
+            with self._lock:
+                self._voos.pop(chave, None)
+            voo.evento.set()
+
+    def _fallback(self, chave, erro):
+        # última matriz boa, se ainda estiver dentro da idade máxima
+        with self._lock:
+            entrada = self._matrizes.get(chave)
+            if entrada and time.monotonic() - entrada[1] <= self.idade_maxima:
+                self.fallbacks += 1
+                return entrada[0]
+        raise ValueError(f"Erro ao obter cotação: {str(erro)}")
+
+    def limpar(self):
+        with self._lock:
+            self._matrizes.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            entrada = self._matrizes.get(self.moeda_base)
+            return {
+                'pares': len(entrada[0].pares) if entrada else 0,
+                'acertos': self.acertos,
+                'acertos_stale': self.acertos_stale,
+                'buscas': self.buscas,
+                'falhas': self.falhas,
+                'fallbacks': self.fallbacks,
+                'disjuntor': self.disjuntor.estado,
+            }
+
+
+# pares pré-calculados: moedas do catálogo (tabela MOEDA)
+def _codigos_catalogo():
+    return [moeda.codigo for moeda in obter_catalogo()]
+
+
+def _criar_provedor(nome):
+    if nome == 'coinbase':
+        return ProvedorCoinbase()
+    if nome == 'fixo':
+        return ProvedorFixo()
+    raise ValueError(f"Provedor de cotações desconhecido: {nome}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# cache do processo, com o provedor escolhido em COTACAO_PROVEDOR
+def obter_cache_cotacoes():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheCotacoes(_criar_provedor(COTACAO_PROVEDOR), codigos=_codigos_catalogo)
+    return _cache
+
+# troca o provedor (ex.: ProvedorFixo em testes e benchmarks) e descarta as cotações em cache
+def configurar_provedor(provedor):
+    global _cache
+    with _cache_lock:
+        _cache = CacheCotacoes(provedor, codigos=_codigos_catalogo)
+    return _cache
+
+# números do cache de cotações para GET /metrics (depois de criado)
+@registro.coletor
+def _coletar_metricas():
+    cache = _cache
+    if cache is None:
+        return []
+    estatisticas = cache.estatisticas()
+    return [
+        ('carteira_cotacao_cache_total', 'counter', "Pedidos de cotação por resultado",
+         [({'resultado': resultado}, estatisticas[resultado])
+          for resultado in ('acertos', 'acertos_stale', 'buscas', 'falhas', 'fallbacks')]),
+        ('carteira_cotacao_disjuntor', 'gauge', "Estado do disjuntor do provedor (1 no estado atual)",
+         [({'estado': estado}, int(estado == estatisticas['disjuntor']))
+          for estado in ('fechado', 'meio-aberto', 'aberto')]),
+    ]
+
+def obter_cotacao(codigo_origem, codigo_destino):
+    return obter_cache_cotacoes().obter(codigo_origem, codigo_destino)
+
+async def obter_cotacao_async(codigo_origem, codigo_destino):
+    return await obter_cache_cotacoes().obter_async(codigo_origem, codigo_destino)
@@ -0,0 +1,271 @@
+"""
+Módulo de Cotações Travadas
+Conversão em duas fases: POST /carteiras/{endereco}/conversoes/cotacao trava cotação e taxa por
+COTACAO_TRAVADA_TTL segundos e devolve um id; a conversão com esse id não chama o provedor
+
+- o id carrega os termos da cotação, assinados (HMAC) com COTACAO_TRAVADA_SEGREDO: qualquer worker
+  com o mesmo segredo aceita o id, mesmo que a cotação tenha sido emitida por outro
+- cada worker guarda as cotações que emitiu e as já usadas até expirarem; uma cotação só é
+  gasta quando a conversão é confirmada
+- com MySQL, a conversão grava o id em COTACAO_USADA na própria transação: a chave primária
+  recusa o segundo uso em qualquer worker, inclusive depois de um reinício
+- no livro em memória (um só processo), o uso fica só na memória do worker
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+import pymysql
+from app.config import ARMAZENAMENTO, COTACAO_TRAVADA_TTL, COTACAO_TRAVADA_MAX, COTACAO_TRAVADA_SEGREDO
+from app.database import transacao
+from app.metricas import Contador, registro
+
+SQL_GASTAR_COTACAO = "INSERT /* gastar_cotacao */ INTO COTACAO_USADA (id_cotacao, expira_em) VALUES (%s, %s)"
+
+SQL_APAGAR_COTACOES_USADAS = "DELETE /* apagar_cotacoes_usadas */ FROM COTACAO_USADA WHERE expira_em < %s LIMIT %s"
+
+_APAGAR_LOTE = 5000
+_LIMPEZA_SEGUNDOS = 60
+
+_ER_DUP_ENTRY = 1062
+
+
+@dataclass(frozen=True)
+class CotacaoTravada:
+    id_cotacao: str
+    endereco_carteira: str
+    id_moeda_origem: int
+    id_moeda_destino: int
+    valor: Decimal
+    cotacao: Decimal
+    valor_destino: Decimal
+    taxa_percentual: Decimal
+    taxa_valor: Decimal
+    expira_em: float  # time.time(): comparável entre workers
+
+
+def _b64(dados):
+    return base64.urlsafe_b64encode(dados).rstrip(b'=').decode()
+
+def _de_b64(texto):
+    return base64.urlsafe_b64decode(texto + '=' * (-len(texto) % 4))
+
+# decimal sem zeros à direita e sem notação científica (o id leva os termos por extenso)
+def _texto(valor):
+    return format(Decimal(str(valor)).normalize(), 'f')
+
+
+class CotacoesTravadas:
+    """
+    Cotações emitidas e usadas por este worker, com validade de `ttl` segundos
+
+    As duas tabelas são ordenadas por emissão (portanto por expiração) e limitadas a `maximo`
+    entradas; as expiradas saem pela frente a cada emissão ou uso.
+    """
+
+    def __init__(self, ttl, maximo, segredo):
+        self.ttl = ttl
+        self.maximo = maximo
+        self._segredo = segredo
+        self._emitidas = OrderedDict()  # id -> CotacaoTravada
+        self._usadas = OrderedDict()    # id -> expira_em (em uso ou já gasta)
+        self._lock = threading.Lock()
+
+        self.emissoes = Contador()
+        self.usos = Contador()
+        self.expiradas = Contador()
+        self.recusadas = Contador()
+
+    def _assinar(self, corpo):
+        return hmac.new(self._segredo, corpo, hashlib.sha256).digest()[:16]
+
+    def _limpar(self, agora):
+        for tabela, expira_em in ((self._emitidas, lambda item: item.expira_em), (self._usadas, lambda item: item)):
+            while tabela and (expira_em(next(iter(tabela.values()))) <= agora or len(tabela) > self.maximo):
+                tabela.popitem(last=False)
+
+    def emitir(self, endereco_carteira, id_moeda_origem, id_moeda_destino, valor, cotacao, valor_destino,
+               taxa_percentual, taxa_valor):
+        agora = time.time()
+        termos = [
+            endereco_carteira, id_moeda_origem, id_moeda_destino, _texto(valor), _texto(cotacao), _texto(valor_destino),
+            _texto(taxa_percentual), _texto(taxa_valor), round(agora + self.ttl, 3), secrets.token_hex(8)
+        ]
+        corpo = json.dumps(termos, separators=(',', ':')).encode()
+        travada = self._termos(f"{_b64(corpo)}.{_b64(self._assinar(corpo))}", termos)
+        with self._lock:
+            self._emitidas[travada.id_cotacao] = travada
+            self._limpar(agora)
+        self.emissoes.incrementar()
+        return travada
+
+    def _termos(self, id_cotacao, termos):
+        endereco, id_origem, id_destino, valor, cotacao, valor_destino, taxa_percentual, taxa_valor, expira_em, _ = termos
+        return CotacaoTravada(
+            id_cotacao, endereco, id_origem, id_destino, Decimal(valor), Decimal(cotacao), Decimal(valor_destino),
+            Decimal(taxa_percentual), Decimal(taxa_valor), expira_em
+        )
+
+    def _decodificar(self, id_cotacao):
+        """Termos de uma cotação emitida por outro worker (ou antes de um reinício), conferindo a assinatura"""
+        try:
+            corpo, assinatura = (_de_b64(parte) for parte in id_cotacao.split('.'))
+            if not hmac.compare_digest(assinatura, self._assinar(corpo)):
+                raise ValueError
+            return self._termos(id_cotacao, json.loads(corpo))
+        except (ValueError, TypeError, binascii.Error):
+            return None
+
+    def _recusar(self, mensagem):
+        self.recusadas.incrementar()
+        raise ValueError(mensagem)
+
+    @contextmanager
+    def usar(self, id_cotacao, endereco_carteira, id_moeda_origem, id_moeda_destino, valor):
+        """
+        Reserva a cotação para uma conversão e entrega os termos travados
+
+        A cotação é gasta se o bloco terminar sem erro; se a conversão falhar (ex. saldo
+        insuficiente, deadlock repetido), volta a valer até expirar.
+        """
+        with self._lock:
+            travada = self._emitidas.get(id_cotacao)
+        if travada is None:
+            travada = self._decodificar(id_cotacao)
+        if travada is None:
+            self._recusar("Cotação inválida")
+        agora = time.time()
+        if travada.expira_em <= agora:
+            self.expiradas.incrementar()
+            raise ValueError("Cotação expirada")
+        pedido = (endereco_carteira, id_moeda_origem, id_moeda_destino, Decimal(str(valor)))
+        if pedido != (travada.endereco_carteira, travada.id_moeda_origem, travada.id_moeda_destino, travada.valor):
+            self._recusar("Cotação não corresponde à conversão")
+
+        with self._lock:
+            self._limpar(agora)
+            if id_cotacao in self._usadas:
+                usada = True
+            else:
+                usada = False
+                self._usadas[id_cotacao] = travada.expira_em
+        if usada:
+            self._recusar("Cotação já utilizada")
+
+        try:
+            yield travada
+        except BaseException:
+            with self._lock:
+                self._usadas.pop(id_cotacao, None)
+            raise
+        with self._lock:
+            self._emitidas.pop(id_cotacao, None)
+        self.usos.incrementar()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'emitidas': len(self._emitidas),
+                'usadas': len(self._usadas),
+                'emissoes': self.emissoes.valor,
+                'usos': self.usos.valor,
+                'expiradas': self.expiradas.valor,
+                'recusadas': self.recusadas.valor,
+            }
+
+
+# sem COTACAO_TRAVADA_SEGREDO, a chave é aleatória e só o worker que emitiu aceita a cotação
+_cotacoes_travadas = CotacoesTravadas(
+    COTACAO_TRAVADA_TTL, COTACAO_TRAVADA_MAX, COTACAO_TRAVADA_SEGREDO.encode() or secrets.token_bytes(32)
+)
+
+def obter_cotacoes_travadas():
+    return _cotacoes_travadas
+
+
+# USO COMPARTILHADO
+# a linha de COTACAO_USADA entra na transação da conversão, antes de travar saldos: se a conversão
+# for desfeita, a cotação volta a valer; uma conversão simultânea com o mesmo id espera a trava da
+# linha e recebe chave duplicada quando a primeira confirma
+
+def _linha_usada(travada):
+    # o id inteiro é longo (termos em base64); a tabela guarda o sha256
+    return hashlib.sha256(travada.id_cotacao.encode()).hexdigest(), datetime.fromtimestamp(travada.expira_em)
+
+def gastar_cotacao(cursor, travada):
+    """Marca a cotação como gasta na transação aberta (nada sem cotação travada)"""
+    if travada is None:
+        return
+    try:
+        cursor.execute(SQL_GASTAR_COTACAO, _linha_usada(travada))
+    except pymysql.err.IntegrityError as e:
+        if not (e.args and e.args[0] == _ER_DUP_ENTRY):
+            raise
+        _cotacoes_travadas._recusar("Cotação já utilizada")
+
+async def gastar_cotacao_async(cursor, travada):
+    if travada is None:
+        return
+    try:
+        await cursor.execute(SQL_GASTAR_COTACAO, _linha_usada(travada))
+    except pymysql.err.IntegrityError as e:
+        if not (e.args and e.args[0] == _ER_DUP_ENTRY):
+            raise
+        _cotacoes_travadas._recusar("Cotação já utilizada")
+
+
+# LIMPEZA
+# cada worker apaga, a cada minuto, os usos de cotações já expiradas (que seriam recusadas de qualquer forma)
+
+def apagar_cotacoes_usadas():
+    limite = datetime.fromtimestamp(time.time())
+    while True:
+        with transacao() as cursor:
+            apagados = cursor.execute(SQL_APAGAR_COTACOES_USADAS, (limite, _APAGAR_LOTE))
+        if apagados < _APAGAR_LOTE:
+            return
+
+_limpeza = None
+_parar_limpeza = threading.Event()
+
+def _limpar_periodicamente():
+    while not _parar_limpeza.wait(_LIMPEZA_SEGUNDOS):
+        try:
+            apagar_cotacoes_usadas()
+        except Exception:
+            # banco fora do ar: tenta de novo no próximo minuto
+            pass
+
+def iniciar_limpeza_cotacoes():
+    global _limpeza
+    if _limpeza is None and ARMAZENAMENTO != 'memoria':
+        _parar_limpeza.clear()
+        _limpeza = threading.Thread(target=_limpar_periodicamente, name='limpeza-cotacoes', daemon=True)
+        _limpeza.start()
+
+def fechar_limpeza_cotacoes():
+    global _limpeza
+    if _limpeza is not None:
+        _parar_limpeza.set()
+        _limpeza.join()
+        _limpeza = None
+
+
+@registro.coletor
+def _coletar_metricas():
+    estatisticas = _cotacoes_travadas.estatisticas()
+    return [
+        ('carteira_cotacao_travada_total', 'counter', "Cotações travadas por resultado",
+         [({'resultado': resultado}, estatisticas[chave]) for resultado, chave in
+          (('emitida', 'emissoes'), ('usada', 'usos'), ('expirada', 'expiradas'), ('recusada', 'recusadas'))]),
+        ('carteira_cotacao_travada_em_memoria', 'gauge', "Cotações emitidas ainda não usadas", [({}, estatisticas['emitidas'])]),
+    ]
@@ -1,49 +1,780 @@
+import functools
+import itertools
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from urllib.parse import unquote, urlsplit
+
 import pymysql
-from app.config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+from pymysql.constants import SERVER_STATUS
+from app.config import (
+    DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME,
+    DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME, DB_POOL_VALIDAR_APOS,
+    DB_REPLICAS, DB_REPLICA_ATRASO_MAX, DB_REPLICA_VERIFICACAO, DB_REPLICA_JANELA_ESCRITA,
+    DB_REPETICOES_MAX, DB_REPETICAO_ESPERA_BASE_MS, DB_REPETICAO_ESPERA_MAX_MS
+)
+from app.metricas import Contador, LIMITES_QUERY, registro
+
+
+# MÉTRICAS DE QUERIES
+# toda query executada pelos cursores da aplicação é cronometrada pelo nome estável da query:
+# o comentário /* nome */ logo depois do verbo (antes do INSERT quebraria o INSERT multi-linha do
+# executemany), ou <verbo>_<tabela> para SQL sem nome (ex. update_saldo_carteira,
+# select_saldo_carteira_travada para SELECT ... FOR UPDATE)
+
+_duracao_queries = registro.histograma(
+    'carteira_db_query_duracao_segundos', "Duração das queries por nome", LIMITES_QUERY, ('query',)
+)
+
+_RE_NOME_QUERY = re.compile(r'/\*\s*(\w+)\s*\*/')
+_RE_TABELA_QUERY = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+`?(\w+)', re.IGNORECASE)
+_nomes_queries = {}
+
+def nome_da_query(query):
+    nome = _nomes_queries.get(query)
+    if nome is not None:
+        return nome
+
+    # o nome sai do começo do SQL; INSERTs multi-linha montados pelo executemany são longos
+    cabeca = query[:400]
+    marcado = _RE_NOME_QUERY.search(cabeca)
+    if marcado:
+        nome = marcado.group(1)
+    else:
+        palavras = cabeca.split(None, 1)
+        verbo = palavras[0].lower().lstrip('(') if palavras else 'vazia'
+        tabela = _RE_TABELA_QUERY.search(cabeca)
+        nome = f"{verbo}_{tabela.group(1).lower()}" if tabela else verbo
+        if verbo == 'select' and 'FOR UPDATE' in query[-200:].upper():
+            nome += '_travada'
+
+    # só guarda SQL de tamanho fixo (constantes e montadores); INSERTs multi-linha variam a cada lote
+    if len(query) <= 2000 and len(_nomes_queries) < 4096:
+        _nomes_queries[query] = nome
+    return nome
 
-# conexão com o banco
-def get_connection():
+def observar_query(query, duracao):
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    _duracao_queries.com(nome_da_query(query)).observar(duracao)
+
+
+class CursorMedido(pymysql.cursors.DictCursor):
+    """DictCursor que cronometra cada execute (o executemany passa por ele)"""
+
+    def execute(self, query, args=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            observar_query(query, time.perf_counter() - inicio)
+
+
+# conexão com o banco (o primário, ou uma réplica com os parâmetros dela)
+def get_connection(cursorclass=CursorMedido, host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD,
+                   database=DB_NAME):
     connection = pymysql.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        cursorclass=pymysql.cursors.DictCursor,
+        host=host,
+        port=port,
+        user=user,
+        password=password,
+        database=database,
+        cursorclass=cursorclass,
         autocommit=False
     )
     return connection
 
+
+# erros do cliente que indicam conexão perdida (server gone away, lost connection, ...)
+_ERROS_CONEXAO_PERDIDA = {2006, 2013, 2014, 2045, 2055}
+
+def _conexao_perdida(erro):
+    if isinstance(erro, pymysql.err.InterfaceError):
+        return True
+    if isinstance(erro, pymysql.err.OperationalError):
+        return bool(erro.args) and erro.args[0] in _ERROS_CONEXAO_PERDIDA
+    return False
+
+
+class PoolEsgotadoError(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo de espera do pool"""
+
+
+class _ConexaoPool:
+    """Guarda a conexão junto com os instantes usados para reciclar e validar"""
+
+    __slots__ = ('conexao', 'criada_em', 'devolvida_em')
+
+    def __init__(self, conexao):
+        self.conexao = conexao
+        self.criada_em = time.monotonic()
+        self.devolvida_em = self.criada_em
+
+
+class PoolConexoes:
+    """
+    Pool de conexões MySQL com tamanho mínimo e máximo
+
+    - valida a conexão (ping) na retirada se ela ficou ociosa por mais de `validar_apos` segundos
+    - recicla conexões com mais de `tempo_vida` segundos
+    - espera no máximo `timeout` segundos por uma conexão livre
+    """
+
+    def __init__(self, criar_conexao, minimo, maximo, timeout, tempo_vida, validar_apos):
+        if maximo < 1 or minimo < 0 or minimo > maximo:
+            raise ValueError("Tamanho de pool inválido")
+
+        self._criar_conexao = criar_conexao
+        self.minimo = minimo
+        self.maximo = maximo
+        self.timeout = timeout
+        self.tempo_vida = tempo_vida
+        self.validar_apos = validar_apos
+
+        self._ociosas = deque()
+        self._total = 0
+        self._em_uso = 0
+        self._condicao = threading.Condition(threading.Lock())
+        self._fechado = False
+
+        # estatísticas
+        self._esperas = 0
+        self._tempo_espera_total = 0.0
+        self._tempo_espera_max = 0.0
+        self._timeouts = 0
+        self._criadas = 0
+        self._recicladas = 0
+        self._descartadas = 0
+
+        for _ in range(minimo):
+            self._ociosas.append(self._nova_conexao())
+            self._total += 1
+
+    def _nova_conexao(self):
+        item = _ConexaoPool(self._criar_conexao())
+        with self._condicao:
+            self._criadas += 1
+        return item
+
+    def _expirada(self, item, agora):
+        return self.tempo_vida > 0 and agora - item.criada_em > self.tempo_vida
+
+    def _valida(self, item, agora):
+        if agora - item.devolvida_em < self.validar_apos:
+            return True
+        try:
+            item.conexao.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _fechar(item):
+        try:
+            item.conexao.close()
+        except Exception:
+            pass
+
+    def obter(self):
+        """Retira uma conexão do pool, esperando até `timeout` segundos"""
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        esperou = False
+
+        with self._condicao:
+            while True:
+                if self._fechado:
+                    raise PoolEsgotadoError("Pool de conexões fechado")
+                if self._ociosas:
+                    item = self._ociosas.pop()
+                    self._em_uso += 1
+                    criar = False
+                    break
+                if self._total < self.maximo:
+                    # reserva a vaga antes de conectar fora do lock
+                    self._total += 1
+                    self._em_uso += 1
+                    item = None
+                    criar = True
+                    break
+
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    raise PoolEsgotadoError(
+                        f"Nenhuma conexão livre após {self.timeout}s ({self.maximo} em uso)"
+                    )
+                esperou = True
+                self._condicao.wait(restante)
+
+            if esperou:
+                espera = time.monotonic() - inicio
+                self._esperas += 1
+                self._tempo_espera_total += espera
+                self._tempo_espera_max = max(self._tempo_espera_max, espera)
+
+        # conectar, validar e reciclar acontece fora do lock
+        try:
+            if criar:
+                item = self._nova_conexao()
+            else:
+                agora = time.monotonic()
+                if self._expirada(item, agora):
+                    self._fechar(item)
+                    self._contar(recicladas=1)
+                    item = self._nova_conexao()
+                elif not self._valida(item, agora):
+                    self._fechar(item)
+                    self._contar(descartadas=1)
+                    item = self._nova_conexao()
+        except Exception:
+            self._liberar_vaga()
+            raise
+
+        return item
+
+    def devolver(self, item, descartar=False):
+        """Devolve a conexão ao pool; conexões com erro ou expiradas são fechadas"""
+        conexao = item.conexao
+
+        if not descartar:
+            try:
+                # não deixa uma transação (ou snapshot de leitura) aberta para o próximo usuário
+                if conexao.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                    conexao.rollback()
+            except Exception:
+                descartar = True
+
+        agora = time.monotonic()
+        if descartar or self._fechado or self._expirada(item, agora):
+            self._fechar(item)
+            if descartar:
+                self._contar(descartadas=1)
+            else:
+                self._contar(recicladas=1)
+            self._liberar_vaga()
+            return
+
+        item.devolvida_em = agora
+        with self._condicao:
+            self._em_uso -= 1
+            self._ociosas.append(item)
+            self._condicao.notify()
+
+    def _contar(self, recicladas=0, descartadas=0):
+        with self._condicao:
+            self._recicladas += recicladas
+            self._descartadas += descartadas
+
+    def _liberar_vaga(self):
+        with self._condicao:
+            self._em_uso -= 1
+            self._total -= 1
+            self._condicao.notify()
+
+    @contextmanager
+    def conexao(self):
+        """Empresta uma conexão durante o bloco `with`"""
+        item = self.obter()
+        descartar = False
+        try:
+            yield item.conexao
+        except Exception as e:
+            # conexão quebrada não volta para o pool
+            descartar = _conexao_perdida(e)
+            raise
+        finally:
+            self.devolver(item, descartar)
+
+    def estatisticas(self):
+        """Números do pool para dimensionar o tamanho por worker"""
+        with self._condicao:
+            return {
+                'minimo': self.minimo,
+                'maximo': self.maximo,
+                'total': self._total,
+                'em_uso': self._em_uso,
+                'ociosas': len(self._ociosas),
+                'esperas': self._esperas,
+                'tempo_espera_total': self._tempo_espera_total,
+                'tempo_espera_max': self._tempo_espera_max,
+                'timeouts': self._timeouts,
+                'criadas': self._criadas,
+                'recicladas': self._recicladas,
+                'descartadas': self._descartadas,
+            }
+
+    def fechar(self):
+        with self._condicao:
+            self._fechado = True
+            ociosas = list(self._ociosas)
+            self._ociosas.clear()
+            self._total -= len(ociosas)
+            self._condicao.notify_all()
+        for item in ociosas:
+            self._fechar(item)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# pool do processo, criado na primeira utilização
+def obter_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolConexoes(
+                    get_connection,
+                    minimo=DB_POOL_MIN,
+                    maximo=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    tempo_vida=DB_POOL_MAX_LIFETIME,
+                    validar_apos=DB_POOL_VALIDAR_APOS
+                )
+    return _pool
+
+def fechar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.fechar()
+            _pool = None
+
+def estatisticas_pool():
+    return obter_pool().estatisticas()
+
+# números do pool e das repetições para GET /metrics (o pool só aparece depois de criado)
+@registro.coletor
+def _coletar_metricas():
+    metricas = [
+        ('carteira_db_repeticoes_total', 'counter', "Transações repetidas por deadlock ou espera de trava",
+         [({'motivo': nome}, _repeticoes[codigo].valor) for codigo, nome in ERROS_REPETIVEIS.items()]),
+        ('carteira_db_repeticoes_esgotadas_total', 'counter', "Operações que esgotaram as tentativas",
+         [({}, _repeticoes_esgotadas.valor)]),
+    ]
+    pool = _pool
+    if pool is None:
+        return metricas
+    estatisticas = pool.estatisticas()
+    rotulo = {'pool': 'sync'}
+    metricas += [
+        ('carteira_db_pool_conexoes', 'gauge', "Conexões do pool por estado",
+         [({**rotulo, 'estado': 'em_uso'}, estatisticas['em_uso']),
+          ({**rotulo, 'estado': 'ociosas'}, estatisticas['ociosas'])]),
+        ('carteira_db_pool_maximo', 'gauge', "Tamanho máximo do pool", [(rotulo, estatisticas['maximo'])]),
+        ('carteira_db_pool_esperas_total', 'counter', "Retiradas que esperaram por uma conexão livre",
+         [(rotulo, estatisticas['esperas'])]),
+        ('carteira_db_pool_espera_segundos_total', 'counter', "Tempo total esperando conexões livres",
+         [(rotulo, estatisticas['tempo_espera_total'])]),
+        ('carteira_db_pool_timeouts_total', 'counter', "Retiradas que desistiram por falta de conexão",
+         [(rotulo, estatisticas['timeouts'])]),
+        ('carteira_db_pool_conexoes_descartadas_total', 'counter', "Conexões fechadas por erro ou validação",
+         [(rotulo, estatisticas['descartadas'])]),
+    ]
+    return metricas
+
+# empresta uma conexão do pool
+def conexao():
+    return obter_pool().conexao()
+
 # função para executar uma query
 def execute_query(query, params=None, fetch=True):
-    connection = get_connection()
+    with conexao() as connection:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+
+                if fetch:
+                    result = cursor.fetchall()
+                    return result
+                else:
+                    connection.commit()
+                    return cursor.lastrowid
+        except Exception as e:
+            connection.rollback()
+            raise e
+
+# RÉPLICAS DE LEITURA
+# com DB_REPLICAS, leituras que toleram alguns instantes de atraso (saldos, carteira, extrato) vão
+# para a réplica menos ocupada entre as que estão no ar e com atraso até DB_REPLICA_ATRASO_MAX;
+# escritas e o resto das leituras continuam no primário. O atraso é medido por pulso: uma thread
+# grava NOW(6) do primário em REPLICACAO_PULSO e lê a linha em cada réplica (só o relógio do
+# primário entra na conta). Depois de uma escrita da carteira, as leituras dela ficam no primário
+# por DB_REPLICA_JANELA_ESCRITA segundos (lê a própria escrita, neste worker).
+
+SQL_GRAVAR_PULSO = """
+    INSERT /* gravar_pulso */ INTO REPLICACAO_PULSO (id, instante) VALUES (1, NOW(6))
+    ON DUPLICATE KEY UPDATE instante = VALUES(instante)
+"""
+
+SQL_AGORA = "SELECT /* agora */ NOW(6) AS agora"
+
+SQL_LER_PULSO = "SELECT /* ler_pulso */ instante FROM REPLICACAO_PULSO WHERE id = 1"
+
+# [usuario[:senha]@]host[:porta][/banco]; o que faltar vem da configuração do primário
+def ler_dsn(dsn):
+    partes = urlsplit(dsn if '://' in dsn else f"mysql://{dsn}")
+    parametros = {
+        'host': partes.hostname or DB_HOST,
+        'port': partes.port or DB_PORT,
+        'user': unquote(partes.username) if partes.username else DB_USER,
+        'password': unquote(partes.password) if partes.password is not None else DB_PASSWORD,
+        'database': partes.path.lstrip('/') or DB_NAME,
+    }
+    return f"{parametros['host']}:{parametros['port']}", parametros
+
+
+class Replica:
+    """Réplica de leitura: pool próprio e o resultado da última verificação"""
+
+    def __init__(self, nome, parametros, criar_pool):
+        self.nome = nome
+        self.parametros = parametros
+        self.pool = criar_pool(functools.partial(get_connection, **parametros))
+        self.atraso = None        # segundos; None se a última verificação falhou
+        self.verificada_em = 0.0  # time.monotonic() da última verificação com sucesso
+        self.leituras = Contador()
+        self.falhas = Contador()
+
+    def disponivel(self, atraso_max, validade, agora):
+        return self.atraso is not None and self.atraso <= atraso_max and agora - self.verificada_em <= validade
+
+    def marcar_falha(self):
+        # fora da rotação até a próxima verificação com sucesso
+        self.atraso = None
+        self.falhas.incrementar()
+
+
+class RoteadorLeituras:
+    """
+    Escolhe onde cada leitura roda: uma réplica em dia ou o primário
+
+    - `verificar()` (thread própria, a cada `intervalo` segundos) grava o pulso no primário e mede
+      o atraso de cada réplica; réplica fora do ar, sem pulso ou sem verificação recente fica de fora
+    - `escolher()` pega a réplica disponível com menos conexões em uso, em rodízio nos empates
+    - `fixar()` prende as leituras das carteiras ao primário por `janela` segundos
+    """
+
+    _FIXADAS_MAX = 100000
+
+    def __init__(self, replicas, conexao_primario, atraso_max, intervalo, janela, nome='verificador-replicas'):
+        self.replicas = replicas
+        self.atraso_max = atraso_max
+        self.intervalo = intervalo
+        self.janela = janela
+        self._conexao_primario = conexao_primario
+        self._rodizio = itertools.count()
+        self._fixadas = OrderedDict()  # endereco -> time.monotonic() até quando lê do primário
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+
+        self.leituras_primario = Contador()
+        self.leituras_fixadas = Contador()
+        self.pulsos_com_falha = Contador()
+
+        self._thread = threading.Thread(target=self._executar, name=nome, daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        while not self._parar.is_set():
+            self.verificar()
+            self._parar.wait(self.intervalo)
+
+    def verificar(self):
+        try:
+            with self._conexao_primario() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(SQL_GRAVAR_PULSO)
+                    connection.commit()
+                    cursor.execute(SQL_AGORA)
+                    agora_primario = cursor.fetchone()['agora']
+            gravado_em = time.monotonic()
+        except Exception:
+            # sem pulso novo o atraso não pode ser medido: as réplicas saem de rotação por validade
+            self.pulsos_com_falha.incrementar()
+            return
+
+        for replica in self.replicas:
+            try:
+                with replica.pool.conexao() as connection:
+                    with connection.cursor() as cursor:
+                        cursor.execute(SQL_LER_PULSO)
+                        linha = cursor.fetchone()
+                if linha is None:
+                    replica.atraso = None
+                    continue
+                # pulso visível na réplica comparado ao relógio do primário, mais o tempo desde a gravação
+                replica.atraso = max(0.0, (agora_primario - linha['instante']).total_seconds()) + (
+                    time.monotonic() - gravado_em
+                )
+                replica.verificada_em = time.monotonic()
+            except Exception:
+                replica.marcar_falha()
+
+    def fixar(self, *enderecos):
+        if self.janela <= 0:
+            return
+        agora = time.monotonic()
+        with self._lock:
+            for endereco in enderecos:
+                self._fixadas[endereco] = agora + self.janela
+                self._fixadas.move_to_end(endereco)
+            # todas com a mesma janela: as vencidas ficam na frente
+            while self._fixadas and (
+                len(self._fixadas) > self._FIXADAS_MAX or next(iter(self._fixadas.values())) <= agora
+            ):
+                self._fixadas.popitem(last=False)
+
+    def fixada(self, endereco):
+        ate = self._fixadas.get(endereco)
+        return ate is not None and ate > time.monotonic()
+
+    def escolher(self, endereco_carteira=None, ocupacao=None):
+        """Réplica para a leitura, ou None para ler do primário"""
+        if endereco_carteira is not None and self.fixada(endereco_carteira):
+            self.leituras_fixadas.incrementar()
+            return None
+        agora = time.monotonic()
+        # sem verificação há 3 intervalos (primário ou verificador parado), o atraso é desconhecido
+        disponiveis = [
+            replica for replica in self.replicas
+            if replica.disponivel(self.atraso_max, 3 * self.intervalo, agora)
+        ]
+        if not disponiveis:
+            self.leituras_primario.incrementar()
+            return None
+        ocupacao = ocupacao or (lambda replica: replica.pool.estatisticas()['em_uso'])
+        inicio = next(self._rodizio) % len(disponiveis)
+        ordem = disponiveis[inicio:] + disponiveis[:inicio]
+        replica = min(ordem, key=ocupacao)
+        replica.leituras.incrementar()
+        return replica
+
+    def fechar(self):
+        self._parar.set()
+        self._thread.join()
+        for replica in self.replicas:
+            replica.pool.fechar()
+
+
+_roteador = None
+_roteador_lock = threading.Lock()
+
+# roteador do processo, criado na primeira leitura (None sem DB_REPLICAS)
+def obter_roteador():
+    global _roteador
+    if _roteador is None and DB_REPLICAS:
+        with _roteador_lock:
+            if _roteador is None:
+                replicas = [
+                    Replica(*ler_dsn(dsn), lambda criar_conexao: PoolConexoes(
+                        criar_conexao,
+                        minimo=0,
+                        maximo=DB_POOL_MAX,
+                        timeout=DB_POOL_TIMEOUT,
+                        tempo_vida=DB_POOL_MAX_LIFETIME,
+                        validar_apos=DB_POOL_VALIDAR_APOS
+                    ))
+                    for dsn in DB_REPLICAS
+                ]
+                _roteador = RoteadorLeituras(
+                    replicas, conexao, DB_REPLICA_ATRASO_MAX, DB_REPLICA_VERIFICACAO, DB_REPLICA_JANELA_ESCRITA
+                )
+    return _roteador
+
+def fechar_roteador():
+    global _roteador
+    with _roteador_lock:
+        if _roteador is not None:
+            _roteador.fechar()
+            _roteador = None
+
+# chamar depois de alterar a carteira: as próximas leituras dela (neste worker) vão ao primário
+def fixar_no_primario(*enderecos):
+    roteador = _roteador
+    if roteador is not None:
+        roteador.fixar(*enderecos)
+
+def execute_leitura(query, params=None, endereco_carteira=None, confirmar_vazio=False):
+    """
+    SELECT em uma réplica em dia, ou no primário
+
+    Réplica que cai no meio da leitura sai de rotação e a leitura é refeita no primário. Com
+    `confirmar_vazio`, resultado vazio da réplica é conferido no primário (ex. carteira recém-criada
+    em outro worker, que ainda não chegou à réplica).
+    """
+    roteador = obter_roteador()
+    replica = roteador.escolher(endereco_carteira) if roteador is not None else None
+    if replica is None:
+        return execute_query(query, params)
+
     try:
-        with connection.cursor() as cursor:
-            cursor.execute(query, params)
-            
-            if fetch:
-                result = cursor.fetchall()
-                return result
-            else:
-                connection.commit()
-                return cursor.lastrowid
-    except Exception as e:
-        connection.rollback()
-        raise e
-    finally:
-        connection.close()
+        with replica.pool.conexao() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                resultado = cursor.fetchall()
+    except (PoolEsgotadoError, pymysql.err.OperationalError, pymysql.err.InterfaceError):
+        # réplica fora do ar ou sem conexão livre
+        replica.marcar_falha()
+        return execute_query(query, params)
+    if not resultado and confirmar_vazio:
+        return execute_query(query, params)
+    return resultado
+
+@registro.coletor
+def _coletar_metricas_replicas():
+    roteador = _roteador
+    if roteador is None:
+        return []
+    leituras = [({'destino': 'primario', 'motivo': 'sem_replica'}, roteador.leituras_primario.valor),
+                ({'destino': 'primario', 'motivo': 'escrita_recente'}, roteador.leituras_fixadas.valor)]
+    atrasos, disponiveis, falhas, conexoes = [], [], [], []
+    agora = time.monotonic()
+    for replica in roteador.replicas:
+        rotulo = {'replica': replica.nome}
+        leituras.append(({'destino': replica.nome, 'motivo': 'replica'}, replica.leituras.valor))
+        if replica.atraso is not None:
+            atrasos.append((rotulo, replica.atraso))
+        disponivel = replica.disponivel(roteador.atraso_max, 3 * roteador.intervalo, agora)
+        disponiveis.append((rotulo, 1 if disponivel else 0))
+        falhas.append((rotulo, replica.falhas.valor))
+        estatisticas = replica.pool.estatisticas()
+        conexoes += [({'pool': replica.nome, 'estado': 'em_uso'}, estatisticas['em_uso']),
+                     ({'pool': replica.nome, 'estado': 'ociosas'}, estatisticas['ociosas'])]
+    return [
+        ('carteira_db_leituras_total', 'counter', "Leituras roteáveis por destino", leituras),
+        ('carteira_db_replica_atraso_segundos', 'gauge', "Atraso de replicação medido pelo pulso", atrasos),
+        ('carteira_db_replica_disponivel', 'gauge', "Réplica em rotação (1) ou fora (0)", disponiveis),
+        ('carteira_db_replica_falhas_total', 'counter', "Leituras e verificações que falharam na réplica", falhas),
+        ('carteira_db_replica_pulsos_com_falha_total', 'counter', "Pulsos que não puderam ser gravados no primário",
+         [({}, roteador.pulsos_com_falha.valor)]),
+        ('carteira_db_replica_pool_conexoes', 'gauge', "Conexões dos pools das réplicas por estado", conexoes),
+    ]
+
+
+# REPETIÇÃO DE TRANSAÇÕES
+# deadlock (1213) e espera de trava esgotada (1205) não são erros da operação: o InnoDB desfez a
+# transação (ou o comando, e o rollback da unidade de trabalho desfaz o resto), e repetir a
+# unidade de trabalho inteira costuma passar. Os contadores mostram a disputa por travas.
+
+ERROS_REPETIVEIS = {1213: 'deadlock', 1205: 'espera_trava'}
+
+_repeticoes = {codigo: Contador() for codigo in ERROS_REPETIVEIS}
+_repeticoes_esgotadas = Contador()
+
+def codigo_repetivel(erro):
+    if isinstance(erro, pymysql.err.OperationalError) and erro.args and erro.args[0] in ERROS_REPETIVEIS:
+        return erro.args[0]
+    return None
+
+# decide se a unidade de trabalho que falhou na `tentativa` (0 = primeira) roda de novo, e conta
+def deve_repetir(erro, tentativa):
+    codigo = codigo_repetivel(erro)
+    if codigo is None:
+        return False
+    if tentativa >= DB_REPETICOES_MAX:
+        _repeticoes_esgotadas.incrementar()
+        return False
+    _repeticoes[codigo].incrementar()
+    return True
+
+# espera antes da próxima tentativa (segundos): exponencial com jitter total, para que as
+# transações que colidiram não voltem juntas
+def espera_repeticao(tentativa):
+    teto = min(DB_REPETICAO_ESPERA_MAX_MS, DB_REPETICAO_ESPERA_BASE_MS * 2 ** tentativa)
+    return random.uniform(0, teto) / 1000
+
+def estatisticas_repeticoes():
+    estatisticas = {nome: _repeticoes[codigo].valor for codigo, nome in ERROS_REPETIVEIS.items()}
+    estatisticas['esgotadas'] = _repeticoes_esgotadas.valor
+    return estatisticas
+
+def repetir_em_conflito(funcao):
+    """
+    Decorador para funções que abrem e fecham a própria transação (unidade de trabalho completa)
+
+    Em deadlock ou espera de trava esgotada, chama a função de novo do início, até DB_REPETICOES_MAX
+    vezes. Não usar em funções chamadas dentro de uma transação já aberta.
+    """
+    @functools.wraps(funcao)
+    def executar(*args, **kwargs):
+        tentativa = 0
+        while True:
+            try:
+                return funcao(*args, **kwargs)
+            except pymysql.err.OperationalError as e:
+                if not deve_repetir(e, tentativa):
+                    raise
+            time.sleep(espera_repeticao(tentativa))
+            tentativa += 1
+    return executar
 
 # função para executar mais de uma query
+@repetir_em_conflito
 def execute_transaction(queries_with_params):
-    connection = get_connection()
+    with conexao() as connection:
+        try:
+            with connection.cursor() as cursor:
+                for query, params in queries_with_params:
+                    cursor.execute(query, params)
+                connection.commit()
+                return True
+        except Exception as e:
+            connection.rollback()
+            raise e
+
+# unidade de trabalho: todas as queries do bloco usam a mesma conexão e a mesma transação
+# commit ao sair do bloco sem erro, rollback caso contrário
+@contextmanager
+def transacao():
+    with conexao() as connection:
+        try:
+            with connection.cursor() as cursor:
+                yield cursor
+            connection.commit()
+        except Exception:
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            raise
+
+
+# LEITURA EM FLUXO
+# para leituras grandes (exportações): conexão dedicada, fora do pool, com cursor sem buffer
+# (SSDictCursor), então as linhas chegam do servidor à medida que são consumidas
+
+def abrir_conexao_em_fluxo(net_write_timeout):
+    """
+    Abre a conexão de leitura em fluxo, já dentro de uma transação somente leitura
+
+    Todas as consultas feitas nela enxergam o mesmo instante do banco. Quem abre fecha
+    a conexão (connection.close()) ao terminar ou ao desistir da leitura.
+    """
+    connection = get_connection(cursorclass=pymysql.cursors.SSDictCursor)
     try:
         with connection.cursor() as cursor:
-            for query, params in queries_with_params:
-                cursor.execute(query, params)
-            connection.commit()
-            return True
-    except Exception as e:
-        connection.rollback()
-        raise e
-    finally:
+            # o servidor espera o consumidor ler cada linha; consumidor lento (download) precisa de folga
+            cursor.execute("SET SESSION net_write_timeout = %s", (net_write_timeout,))
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+    except Exception:
         connection.close()
+        raise
+    return connection
+
+# gerador das linhas de uma consulta, lidas do servidor em lotes de `tamanho_lote`
+def iterar_consulta(connection, query, params=None, tamanho_lote=1000):
+    cursor = connection.cursor()
+    cursor.execute(query, params)
+    while True:
+        linhas = cursor.fetchmany(tamanho_lote)
+        if not linhas:
+            break
+        yield from linhas
+    # só fecha o cursor depois de ler tudo: fechar antes obrigaria a ler o resto do resultado;
+    # para interromper a leitura, feche a conexão
+    cursor.close()
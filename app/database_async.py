@@ -0,0 +1,208 @@
+"""
+Acesso assíncrono ao banco (modo API_MODO=async)
+Pool próprio do driver aiomysql, com a mesma configuração de tamanho do pool síncrono
+"""
+import asyncio
+import functools
+import time
+from contextlib import asynccontextmanager
+
+import aiomysql
+import pymysql
+from app.config import (
+    DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME,
+    DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME
+)
+from app.database import (
+    PoolEsgotadoError, deve_repetir, espera_repeticao, observar_query, obter_roteador
+)
+from app.metricas import registro
+
+
+class CursorMedidoAsync(aiomysql.DictCursor):
+    """DictCursor do aiomysql que cronometra cada execute, como app.database.CursorMedido"""
+
+    async def execute(self, query, args=None):
+        inicio = time.perf_counter()
+        try:
+            return await super().execute(query, args)
+        finally:
+            observar_query(query, time.perf_counter() - inicio)
+
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+# pool do processo, criado na primeira utilização (dentro do event loop da aplicação)
+async def obter_pool_async():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await aiomysql.create_pool(
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    db=DB_NAME,
+                    minsize=DB_POOL_MIN,
+                    maxsize=DB_POOL_MAX,
+                    pool_recycle=int(DB_POOL_MAX_LIFETIME),
+                    cursorclass=CursorMedidoAsync,
+                    autocommit=False
+                )
+    return _pool
+
+async def fechar_pool_async():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+    for nome in list(_pools_replicas):
+        pool = _pools_replicas.pop(nome)
+        pool.close()
+        await pool.wait_closed()
+
+async def estatisticas_pool_async():
+    pool = await obter_pool_async()
+    return {
+        'minimo': pool.minsize,
+        'maximo': pool.maxsize,
+        'total': pool.size,
+        'em_uso': pool.size - pool.freesize,
+        'ociosas': pool.freesize,
+    }
+
+# conexões do pool assíncrono para GET /metrics (depois de criado)
+@registro.coletor
+def _coletar_metricas():
+    pool = _pool
+    if pool is None:
+        return []
+    rotulo = {'pool': 'async'}
+    return [
+        ('carteira_db_pool_conexoes', 'gauge', "Conexões do pool por estado",
+         [({**rotulo, 'estado': 'em_uso'}, pool.size - pool.freesize),
+          ({**rotulo, 'estado': 'ociosas'}, pool.freesize)]),
+        ('carteira_db_pool_maximo', 'gauge', "Tamanho máximo do pool", [(rotulo, pool.maxsize)]),
+    ]
+
+# empresta uma conexão do pool (do primário, ou o informado), esperando no máximo DB_POOL_TIMEOUT segundos
+@asynccontextmanager
+async def conexao_async(pool=None):
+    pool = pool or await obter_pool_async()
+    try:
+        connection = await asyncio.wait_for(pool.acquire(), DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolEsgotadoError(
+            f"Nenhuma conexão livre após {DB_POOL_TIMEOUT}s ({pool.maxsize} em uso)"
+        )
+    try:
+        yield connection
+    finally:
+        # o pool do aiomysql fecha conexões devolvidas com transação aberta
+        if not connection.closed and connection.get_transaction_status():
+            try:
+                await connection.rollback()
+            except Exception:
+                connection.close()
+        pool.release(connection)
+
+# função para executar uma query
+async def execute_query_async(query, params=None, fetch=True):
+    async with conexao_async() as connection:
+        try:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, params)
+
+                if fetch:
+                    return await cursor.fetchall()
+                await connection.commit()
+                return cursor.lastrowid
+        except Exception:
+            await connection.rollback()
+            raise
+
+# RÉPLICAS DE LEITURA
+# a escolha da réplica (atraso, disponibilidade, leituras fixadas no primário) é a do roteador de
+# app/database.py; aqui cada réplica ganha um pool aiomysql, e a ocupação considerada é a desse pool
+
+_pools_replicas = {}
+_pools_replicas_lock = asyncio.Lock()
+
+async def _pool_replica(replica):
+    pool = _pools_replicas.get(replica.nome)
+    if pool is None:
+        async with _pools_replicas_lock:
+            pool = _pools_replicas.get(replica.nome)
+            if pool is None:
+                parametros = replica.parametros
+                pool = _pools_replicas[replica.nome] = await aiomysql.create_pool(
+                    host=parametros['host'],
+                    port=parametros['port'],
+                    user=parametros['user'],
+                    password=parametros['password'],
+                    db=parametros['database'],
+                    minsize=0,
+                    maxsize=DB_POOL_MAX,
+                    pool_recycle=int(DB_POOL_MAX_LIFETIME),
+                    cursorclass=CursorMedidoAsync,
+                    autocommit=False
+                )
+    return pool
+
+def _ocupacao(replica):
+    pool = _pools_replicas.get(replica.nome)
+    return pool.size - pool.freesize if pool is not None else 0
+
+async def execute_leitura_async(query, params=None, endereco_carteira=None, confirmar_vazio=False):
+    """Versão assíncrona de app.database.execute_leitura"""
+    roteador = obter_roteador()
+    replica = roteador.escolher(endereco_carteira, _ocupacao) if roteador is not None else None
+    if replica is None:
+        return await execute_query_async(query, params)
+
+    try:
+        async with conexao_async(await _pool_replica(replica)) as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, params)
+                resultado = await cursor.fetchall()
+    except (PoolEsgotadoError, pymysql.err.OperationalError, pymysql.err.InterfaceError, OSError):
+        # réplica fora do ar ou sem conexão livre
+        replica.marcar_falha()
+        return await execute_query_async(query, params)
+    if not resultado and confirmar_vazio:
+        return await execute_query_async(query, params)
+    return resultado
+
+# unidade de trabalho assíncrona: mesma conexão e mesma transação para todo o bloco
+@asynccontextmanager
+async def transacao_async():
+    async with conexao_async() as connection:
+        try:
+            async with connection.cursor() as cursor:
+                yield cursor
+            await connection.commit()
+        except Exception:
+            try:
+                await connection.rollback()
+            except Exception:
+                pass
+            raise
+
+# mesma repetição de app/database.py (repetir_em_conflito), com espera que não bloqueia o event loop
+# (o aiomysql levanta os mesmos erros do pymysql)
+def repetir_em_conflito_async(funcao):
+    @functools.wraps(funcao)
+    async def executar(*args, **kwargs):
+        tentativa = 0
+        while True:
+            try:
+                return await funcao(*args, **kwargs)
+            except pymysql.err.OperationalError as e:
+                if not deve_repetir(e, tentativa):
+                    raise
+            await asyncio.sleep(espera_repeticao(tentativa))
+            tentativa += 1
+    return executar
@@ -0,0 +1,448 @@
+"""
+Módulo de Eventos de Saldo
+Entrega as linhas de EVENTO_SALDO (o outbox gravado na transação de cada alteração de saldo) a
+quem espera em GET /carteiras/{endereco}/eventos, no lugar de consultar os saldos em laço
+
+- um despachante por worker lê os eventos novos de todas as carteiras em uma consulta a cada
+  EVENTOS_INTERVALO_MS e acorda quem espera pelas carteiras afetadas
+- ids do AUTO_INCREMENT podem ser confirmados fora de ordem: um evento só é entregue depois que
+  os ids menores apareceram ou passaram EVENTOS_LACUNA_MS faltando (transação desfeita), então
+  um cursor nunca passa por cima de um evento que ainda vai aparecer
+- os EVENTOS_BUFFER eventos mais recentes ficam em memória; cursores mais antigos são atendidos
+  pelo banco (índice por carteira e id)
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from starlette.concurrency import run_in_threadpool
+from app.config import (
+    EVENTOS_INTERVALO_MS, EVENTOS_LOTE, EVENTOS_LACUNA_MS, EVENTOS_BUFFER, EVENTOS_PULSO, EVENTOS_RETENCAO_HORAS
+)
+from app.database import execute_query, transacao
+from app.metricas import Contador, registro
+from app.models import EventoSaldoResponse
+from app.moedas import obter_catalogo
+from app.services import CarteiraNaoEncontradaError, dados_carteira
+
+SQL_EVENTOS_NOVOS = """
+    SELECT /* eventos_novos */ id_evento, endereco_carteira, id_moeda, tipo, variacao, data_hora
+    FROM EVENTO_SALDO
+    WHERE id_evento > %s
+    ORDER BY id_evento
+    LIMIT %s
+"""
+
+SQL_ULTIMOS_EVENTOS = """
+    SELECT /* ultimos_eventos */ id_evento, endereco_carteira, id_moeda, tipo, variacao, data_hora
+    FROM EVENTO_SALDO
+    ORDER BY id_evento DESC
+    LIMIT %s
+"""
+
+SQL_EVENTOS_DA_CARTEIRA = """
+    SELECT /* eventos_da_carteira */ id_evento, endereco_carteira, id_moeda, tipo, variacao, data_hora
+    FROM EVENTO_SALDO
+    WHERE endereco_carteira = %s AND id_evento > %s AND id_evento <= %s
+    ORDER BY id_evento
+    LIMIT %s
+"""
+
+SQL_INCREMENTO = "SELECT @@auto_increment_increment AS incremento"
+
+SQL_PRIMEIRO_EVENTO = """
+    SELECT /* primeiro_evento */ id_evento, data_hora
+    FROM EVENTO_SALDO
+    WHERE id_evento >= %s
+    ORDER BY id_evento
+    LIMIT 1
+"""
+
+SQL_APAGAR_EVENTOS = """
+    DELETE /* apagar_eventos */ FROM EVENTO_SALDO
+    WHERE id_evento <= %s
+    ORDER BY id_evento
+    LIMIT %s
+"""
+
+
+def sql_eventos_por_id(quantidade):
+    marcadores = ", ".join(["%s"] * quantidade)
+    return f"""
+        SELECT /* eventos_por_id */ id_evento, endereco_carteira, id_moeda, tipo, variacao, data_hora
+        FROM EVENTO_SALDO
+        WHERE id_evento IN ({marcadores})
+    """
+
+# lacunas maiores que isso (ex. AUTO_INCREMENT alterado à mão) são puladas de uma vez
+_LACUNAS_MAX = 100000
+# eventos aguardando entrega em cada assinatura; acima disso a conexão é encerrada e o cliente retoma pelo cursor
+_FILA_ASSINATURA = 1000
+_LIMPEZA_SEGUNDOS = 300
+_APAGAR_LOTE = 5000
+
+
+class Assinatura:
+    """Fila de eventos de uma carteira para uma requisição em espera (no event loop dela)"""
+
+    def __init__(self, endereco_carteira):
+        self.endereco_carteira = endereco_carteira
+        self.loop = asyncio.get_running_loop()
+        self.fila = asyncio.Queue(_FILA_ASSINATURA)
+        self.transbordou = False
+
+    def _receber(self, evento):
+        if self.transbordou:
+            return
+        try:
+            self.fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            # descarta daqui em diante: a fila continua sem buracos até o último evento guardado
+            self.transbordou = True
+
+    def entregar(self, evento):
+        # chamado pela thread do despachante
+        self.loop.call_soon_threadsafe(self._receber, evento)
+
+
+class Despachante:
+    """
+    Thread que lê EVENTO_SALDO em ordem de id e entrega os eventos às assinaturas
+
+    Todo id até `horizonte` já foi entregue (está em memória ou no banco) ou foi dado como
+    desfeito; os eventos acima de uma lacuna esperam por ela. Os eventos em memória cobrem o
+    intervalo (piso, horizonte].
+    """
+
+    def __init__(self, intervalo, lote, lacuna, capacidade, retencao_horas=0, nome='despachante-eventos'):
+        self.intervalo = intervalo
+        self.lote = lote
+        self.lacuna = lacuna
+        self.capacidade = capacidade
+        self.retencao_horas = retencao_horas
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._iniciado = False
+        self._passo = 1
+        self._ultimo = None   # maior id lido
+        self._horizonte = 0
+        self._piso = 0
+        self._lacunas = {}    # id faltando -> instante em que foi notado
+        self._adiados = {}    # id -> evento lido acima de uma lacuna
+        self._recentes = deque()
+        self._assinaturas = {}
+        self._proxima_limpeza = 0
+
+        self.publicados = Contador()
+        self.lacunas_puladas = Contador()
+        self.falhas = Contador()
+
+        self._thread = threading.Thread(target=self._executar, name=nome, daemon=True)
+        self._thread.start()
+
+    # LEITURA
+
+    def _iniciar(self):
+        self._passo = execute_query(SQL_INCREMENTO)[0]['incremento'] or 1
+        # os últimos eventos entram em memória; ids faltando entre eles podem ser transações abertas
+        linhas = sorted(execute_query(SQL_ULTIMOS_EVENTOS, (self.lote,)), key=lambda linha: linha['id_evento'])
+        agora = time.monotonic()
+        with self._lock:
+            if linhas:
+                self._piso = linhas[0]['id_evento'] - self._passo
+                self._ultimo = self._piso
+            self._registrar(linhas, agora)
+            self._avancar(agora)
+            self._iniciado = True
+
+    def _registrar(self, linhas, agora):
+        for linha in linhas:
+            id_evento = linha['id_evento']
+            if id_evento in self._lacunas:
+                del self._lacunas[id_evento]
+            elif self._ultimo is None or id_evento > self._ultimo:
+                if self._ultimo is not None:
+                    faltando = range(self._ultimo + self._passo, id_evento, self._passo)
+                    if len(faltando) <= _LACUNAS_MAX:
+                        self._lacunas.update(dict.fromkeys(faltando, agora))
+                self._ultimo = id_evento
+            else:
+                continue
+            self._adiados[id_evento] = linha
+
+    # publica os adiados até a primeira lacuna ainda aberta; retorna os eventos publicados
+    def _avancar(self, agora):
+        for id_evento, notada in list(self._lacunas.items()):
+            if agora - notada > self.lacuna:
+                del self._lacunas[id_evento]
+                self.lacunas_puladas.incrementar()
+        if self._lacunas:
+            horizonte = min(self._lacunas) - 1
+        else:
+            horizonte = self._ultimo or 0
+        prontos = [self._adiados.pop(id_evento) for id_evento in sorted(self._adiados) if id_evento <= horizonte]
+        self._horizonte = max(self._horizonte, horizonte)
+
+        for evento in prontos:
+            if len(self._recentes) >= self.capacidade:
+                self._piso = self._recentes.popleft()['id_evento']
+            self._recentes.append(evento)
+        self.publicados.incrementar(len(prontos))
+        return prontos
+
+    def _ler(self):
+        """Lê os eventos novos e os que faltavam; retorna True se ainda houver eventos a ler"""
+        linhas = []
+        if self._lacunas:
+            # as lacunas mais antigas primeiro, no máximo um lote por vez
+            faltando = sorted(self._lacunas)[:self.lote]
+            linhas += execute_query(sql_eventos_por_id(len(faltando)), faltando)
+        novas = execute_query(SQL_EVENTOS_NOVOS, (self._ultimo or 0, self.lote))
+        linhas += novas
+
+        agora = time.monotonic()
+        with self._lock:
+            self._registrar(linhas, agora)
+            prontos = self._avancar(agora)
+            destinos = [
+                (assinatura, evento) for evento in prontos
+                for assinatura in self._assinaturas.get(evento['endereco_carteira'], ())
+            ]
+        for assinatura, evento in destinos:
+            assinatura.entregar(evento)
+        return len(novas) == self.lote
+
+    def _executar(self):
+        while not self._parar.is_set():
+            cheio = False
+            try:
+                if not self._iniciado:
+                    self._iniciar()
+                cheio = self._ler()
+                if self.retencao_horas > 0 and time.monotonic() >= self._proxima_limpeza:
+                    self._proxima_limpeza = time.monotonic() + _LIMPEZA_SEGUNDOS
+                    self._limpar()
+            except Exception:
+                # banco fora do ar: tenta de novo no próximo intervalo
+                self.falhas.incrementar()
+            if not cheio:
+                self._parar.wait(self.intervalo)
+
+    # RETENÇÃO
+
+    def _limpar(self):
+        """Apaga os eventos mais antigos que a retenção, sem passar do horizonte"""
+        limite = datetime.now() - timedelta(hours=self.retencao_horas)
+        # busca binária pelo maior id gravado antes do limite, pela chave primária (data_hora não tem índice)
+        baixo, alto = 0, self._horizonte
+        while baixo < alto:
+            meio = (baixo + alto + 1) // 2
+            linhas = execute_query(SQL_PRIMEIRO_EVENTO, (meio,))
+            if linhas and linhas[0]['id_evento'] <= alto and linhas[0]['data_hora'] < limite:
+                baixo = linhas[0]['id_evento']
+            else:
+                alto = meio - 1
+        # apaga em lotes curtos para não segurar travas sobre a tabela que as operações gravam
+        while baixo > 0 and not self._parar.is_set():
+            with transacao() as cursor:
+                apagados = cursor.execute(SQL_APAGAR_EVENTOS, (baixo, _APAGAR_LOTE))
+            if apagados < _APAGAR_LOTE:
+                break
+
+    # ASSINATURAS
+
+    def assinar(self, endereco_carteira):
+        assinatura = Assinatura(endereco_carteira)
+        with self._lock:
+            self._assinaturas.setdefault(endereco_carteira, set()).add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            assinaturas = self._assinaturas.get(assinatura.endereco_carteira)
+            if assinaturas is not None:
+                assinaturas.discard(assinatura)
+                if not assinaturas:
+                    del self._assinaturas[assinatura.endereco_carteira]
+
+    @property
+    def horizonte(self):
+        return self._horizonte
+
+    def recentes(self, endereco_carteira, cursor):
+        """
+        Eventos publicados da carteira posteriores ao cursor, com o horizonte
+
+        Retorna (None, horizonte) se o cursor for mais antigo que os eventos em memória.
+        """
+        with self._lock:
+            if not self._iniciado or cursor < self._piso:
+                return None, self._horizonte
+            return [
+                evento for evento in self._recentes
+                if evento['id_evento'] > cursor and evento['endereco_carteira'] == endereco_carteira
+            ], self._horizonte
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'assinaturas': sum(len(assinaturas) for assinaturas in self._assinaturas.values()),
+                'lacunas': len(self._lacunas),
+                'adiados': len(self._adiados),
+                'em_memoria': len(self._recentes),
+                'horizonte': self._horizonte,
+                'publicados': self.publicados.valor,
+                'lacunas_puladas': self.lacunas_puladas.valor,
+                'falhas': self.falhas.valor,
+            }
+
+    def fechar(self):
+        self._parar.set()
+        self._thread.join()
+
+
+# um despachante por worker, criado no lifespan quando EVENTOS_SALDO está ligado
+_despachante = None
+
+def iniciar_despachante():
+    global _despachante
+    if _despachante is None:
+        _despachante = Despachante(
+            EVENTOS_INTERVALO_MS / 1000, EVENTOS_LOTE, EVENTOS_LACUNA_MS / 1000,
+            EVENTOS_BUFFER, EVENTOS_RETENCAO_HORAS
+        )
+    return _despachante
+
+def obter_despachante():
+    return _despachante
+
+def fechar_despachante():
+    global _despachante
+    if _despachante is not None:
+        _despachante.fechar()
+        _despachante = None
+
+
+@registro.coletor
+def _coletar_metricas():
+    despachante = _despachante
+    if despachante is None:
+        return []
+    estatisticas = despachante.estatisticas()
+    return [
+        ('carteira_eventos_assinaturas', 'gauge', "Requisições aguardando eventos de saldo", [({}, estatisticas['assinaturas'])]),
+        ('carteira_eventos_lacunas', 'gauge', "Ids de evento ainda não confirmados segurando a entrega", [({}, estatisticas['lacunas'])]),
+        ('carteira_eventos_publicados_total', 'counter', "Eventos de saldo publicados pelo despachante", [({}, estatisticas['publicados'])]),
+        ('carteira_eventos_lacunas_puladas_total', 'counter', "Ids de evento dados como desfeitos após EVENTOS_LACUNA_MS",
+         [({}, estatisticas['lacunas_puladas'])]),
+        ('carteira_eventos_leituras_com_falha_total', 'counter', "Leituras do despachante que falharam", [({}, estatisticas['falhas'])]),
+    ]
+
+
+# ESPERA POR EVENTOS (long-poll e SSE)
+# a assinatura é feita antes de ler o que já foi publicado, então nenhum evento cai entre as duas
+# leituras; os repetidos são descartados pelo id
+
+def ler_cursor(texto):
+    if not texto:
+        return None
+    if not texto.isdigit():
+        raise ValueError("Cursor inválido")
+    return int(texto)
+
+def converter_evento(evento):
+    return EventoSaldoResponse(
+        cursor=str(evento['id_evento']),
+        tipo=evento['tipo'],
+        codigo_moeda=obter_catalogo().por_id(evento['id_moeda']).codigo,
+        variacao=evento['variacao'],
+        data_hora=evento['data_hora'],
+    )
+
+async def _validar_carteira(endereco_carteira):
+    if await run_in_threadpool(dados_carteira, endereco_carteira) is None:
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+
+async def _alcancar(despachante, endereco_carteira, cursor):
+    """Eventos publicados depois do cursor; retorna (eventos, horizonte, completo)"""
+    eventos, horizonte = despachante.recentes(endereco_carteira, cursor)
+    if eventos is not None:
+        return eventos, horizonte, True
+    # cursor antigo: o índice (endereco_carteira, id_evento) atende a leitura
+    eventos = await run_in_threadpool(
+        execute_query, SQL_EVENTOS_DA_CARTEIRA, (endereco_carteira, cursor, horizonte, despachante.lote)
+    )
+    return eventos, horizonte, len(eventos) < despachante.lote
+
+async def aguardar_eventos(despachante, endereco_carteira, cursor, espera):
+    """
+    Long-poll: retorna (eventos, próximo cursor) assim que houver eventos depois do cursor,
+    ou sem eventos depois de `espera` segundos. Sem cursor, só eventos a partir de agora.
+    """
+    await _validar_carteira(endereco_carteira)
+    assinatura = despachante.assinar(endereco_carteira)
+    try:
+        if cursor is None:
+            cursor = despachante.horizonte
+        eventos, horizonte, completo = await _alcancar(despachante, endereco_carteira, cursor)
+        if eventos:
+            proximo = horizonte if completo else eventos[-1]['id_evento']
+            return eventos, max(cursor, proximo)
+
+        cursor = max(cursor, horizonte)
+        prazo = time.monotonic() + espera
+        while True:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                return [], cursor
+            try:
+                recebidos = [await asyncio.wait_for(assinatura.fila.get(), restante)]
+            except asyncio.TimeoutError:
+                return [], cursor
+            while not assinatura.fila.empty():
+                recebidos.append(assinatura.fila.get_nowait())
+            eventos = [evento for evento in recebidos if evento['id_evento'] > cursor]
+            if eventos:
+                return eventos, eventos[-1]['id_evento']
+    finally:
+        despachante.cancelar(assinatura)
+
+def _quadro(evento):
+    return f"id: {evento['id_evento']}\nevent: saldo\ndata: {converter_evento(evento).model_dump_json()}\n\n"
+
+async def fluxo_eventos(despachante, endereco_carteira, cursor):
+    """
+    Server-Sent Events: um quadro por evento, com o id como Last-Event-ID para a reconexão, e um
+    comentário a cada EVENTOS_PULSO segundos sem eventos. Encerra se o cliente não acompanhar.
+    """
+    assinatura = despachante.assinar(endereco_carteira)
+    try:
+        if cursor is None:
+            cursor = despachante.horizonte
+        while True:
+            eventos, horizonte, completo = await _alcancar(despachante, endereco_carteira, cursor)
+            for evento in eventos:
+                yield _quadro(evento)
+                cursor = evento['id_evento']
+            if completo:
+                cursor = max(cursor, horizonte)
+                break
+
+        # transbordou: entrega o que está na fila e encerra; o cliente reconecta com Last-Event-ID
+        while not (assinatura.transbordou and assinatura.fila.empty()):
+            try:
+                evento = await asyncio.wait_for(assinatura.fila.get(), EVENTOS_PULSO)
+            except asyncio.TimeoutError:
+                yield ": pulso\n\n"
+                continue
+            if evento['id_evento'] > cursor:
+                cursor = evento['id_evento']
+                yield _quadro(evento)
+    finally:
+        despachante.cancelar(assinatura)
+
+async def abrir_fluxo_eventos(despachante, endereco_carteira, cursor):
+    # valida antes de a resposta começar, para o 404 sair como erro e não no meio do fluxo
+    await _validar_carteira(endereco_carteira)
+    return fluxo_eventos(despachante, endereco_carteira, cursor)
@@ -0,0 +1,200 @@
+"""
+Módulo de Exportação de Movimentos
+Lê DEPOSITO_SAQUE, CONVERSAO e TRANSFERENCIA de um período em fluxo (cursor sem buffer) e
+escreve CSV ou NDJSON em blocos, opcionalmente em gzip, com memória constante
+
+Uso pela linha de comando:
+    python -m app.exportacao --inicio 2025-11-24 [--fim 2025-11-25] [--formato csv|ndjson] [--gzip] [--saida arquivo]
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import datetime, timedelta
+from app.config import ARMAZENAMENTO, EXPORTACAO_LOTE_LINHAS, EXPORTACAO_TAMANHO_BLOCO, EXPORTACAO_NET_WRITE_TIMEOUT
+from app.database import abrir_conexao_em_fluxo, iterar_consulta
+from app.livro import obter_livro
+from app.moedas import obter_catalogo, recarregar_catalogo
+
+COLUNAS = (
+    'tipo', 'id', 'data_hora', 'endereco_carteira', 'contraparte', 'codigo_moeda', 'valor',
+    'taxa_valor', 'codigo_moeda_destino', 'valor_destino', 'cotacao'
+)
+
+# uma consulta por tabela, na ordem do índice (data_hora, id): sem ordenação no servidor,
+# a primeira linha sai assim que a consulta começa
+SQL_EXPORTAR = (
+    """
+    SELECT tipo, id_movimento AS id, data_hora, endereco_carteira, NULL AS contraparte,
+           id_moeda, valor, taxa_valor, NULL AS id_moeda_destino, NULL AS valor_destino, NULL AS cotacao
+    FROM DEPOSITO_SAQUE
+    WHERE data_hora >= %s AND data_hora < %s
+    ORDER BY data_hora, id_movimento
+    """,
+    """
+    SELECT 'CONVERSAO' AS tipo, id_conversao AS id, data_hora, endereco_carteira, NULL AS contraparte,
+           id_moeda_origem AS id_moeda, valor_origem AS valor, taxa_valor, id_moeda_destino,
+           valor_destino, cotacao_utilizada AS cotacao
+    FROM CONVERSAO
+    WHERE data_hora >= %s AND data_hora < %s
+    ORDER BY data_hora, id_conversao
+    """,
+    """
+    SELECT 'TRANSFERENCIA' AS tipo, id_transferencia AS id, data_hora, endereco_origem AS endereco_carteira,
+           endereco_destino AS contraparte, id_moeda, valor, taxa_valor, NULL AS id_moeda_destino,
+           NULL AS valor_destino, NULL AS cotacao
+    FROM TRANSFERENCIA
+    WHERE data_hora >= %s AND data_hora < %s
+    ORDER BY data_hora, id_transferencia
+    """,
+)
+
+FORMATOS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+# ETAPAS
+# cada etapa é um gerador que consome a anterior, então só um lote de linhas
+# e um bloco de saída ficam em memória
+
+def _ler_movimentos(connection, data_inicio, data_fim, tamanho_lote):
+    for query in SQL_EXPORTAR:
+        yield from iterar_consulta(connection, query, (data_inicio, data_fim), tamanho_lote)
+
+# troca ids de moeda por códigos e deixa datas e decimais como texto
+def _formatar(linhas):
+    moedas = obter_catalogo()
+    for linha in linhas:
+        for coluna in ('id_moeda', 'id_moeda_destino'):
+            if linha[coluna] is not None and moedas.por_id(linha[coluna]) is None:
+                # moeda cadastrada depois da carga do catálogo
+                moedas = recarregar_catalogo()
+        moeda_destino = moedas.por_id(linha['id_moeda_destino']) if linha['id_moeda_destino'] else None
+        yield {
+            'tipo': linha['tipo'],
+            'id': linha['id'],
+            'data_hora': linha['data_hora'].isoformat(),
+            'endereco_carteira': linha['endereco_carteira'],
+            'contraparte': linha['contraparte'],
+            'codigo_moeda': moedas.por_id(linha['id_moeda']).codigo,
+            'valor': str(linha['valor']),
+            'taxa_valor': str(linha['taxa_valor']),
+            'codigo_moeda_destino': moeda_destino.codigo if moeda_destino else None,
+            'valor_destino': None if linha['valor_destino'] is None else str(linha['valor_destino']),
+            'cotacao': None if linha['cotacao'] is None else str(linha['cotacao']),
+        }
+
+def _serializar_csv(movimentos, tamanho_bloco):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUNAS)
+    for movimento in movimentos:
+        escritor.writerow([movimento[coluna] for coluna in COLUNAS])
+        if buffer.tell() >= tamanho_bloco:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def _serializar_ndjson(movimentos, tamanho_bloco):
+    partes = []
+    tamanho = 0
+    for movimento in movimentos:
+        linha = json.dumps(movimento) + "\n"
+        partes.append(linha)
+        tamanho += len(linha)
+        if tamanho >= tamanho_bloco:
+            yield "".join(partes).encode()
+            partes = []
+            tamanho = 0
+    if partes:
+        yield "".join(partes).encode()
+
+_SERIALIZADORES = {'csv': _serializar_csv, 'ndjson': _serializar_ndjson}
+
+def _comprimir_gzip(blocos):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # cabeçalho gzip
+    for bloco in blocos:
+        dados = compressor.compress(bloco)
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+def _exportar(linhas, formato, compactar, tamanho_bloco, connection=None):
+    try:
+        blocos = _SERIALIZADORES[formato](_formatar(linhas), tamanho_bloco)
+        if compactar:
+            blocos = _comprimir_gzip(blocos)
+        yield from blocos
+    finally:
+        # fechar a conexão encerra também uma leitura interrompida no meio
+        if connection is not None:
+            connection.close()
+
+
+def exportar_movimentos(data_inicio, data_fim, formato='csv', compactar=False,
+                        tamanho_lote=EXPORTACAO_LOTE_LINHAS, tamanho_bloco=EXPORTACAO_TAMANHO_BLOCO):
+    """
+    Exporta os movimentos com data_hora em [data_inicio, data_fim)
+
+    Valida os parâmetros e abre a conexão antes de retornar, para que erros apareçam
+    antes do primeiro byte. Retorna um gerador de blocos de bytes; as três tabelas saem
+    uma depois da outra, cada uma em ordem de data, todas no mesmo instante do banco.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato {formato} não suportado (use csv ou ndjson)")
+    if data_fim <= data_inicio:
+        raise ValueError("data_fim deve ser posterior a data_inicio")
+
+    if ARMAZENAMENTO == 'memoria':
+        # movimentos do livro em memória, na mesma ordem das consultas (tabela, data, id)
+        linhas = obter_livro().movimentos_periodo(data_inicio, data_fim)
+        return _exportar(linhas, formato, compactar, tamanho_bloco)
+
+    obter_catalogo()
+    connection = abrir_conexao_em_fluxo(EXPORTACAO_NET_WRITE_TIMEOUT)
+    linhas = _ler_movimentos(connection, data_inicio, data_fim, tamanho_lote)
+    return _exportar(linhas, formato, compactar, tamanho_bloco, connection)
+
+def nome_arquivo(data_inicio, data_fim, formato, compactar=False):
+    nome = f"movimentos_{data_inicio:%Y%m%d%H%M%S}_{data_fim:%Y%m%d%H%M%S}.{formato}"
+    return nome + ".gz" if compactar else nome
+
+
+# LINHA DE COMANDO
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Exporta os movimentos de um período")
+    parser.add_argument('--inicio', required=True, type=datetime.fromisoformat,
+                        help="início do período (inclusivo), ex. 2025-11-24")
+    parser.add_argument('--fim', type=datetime.fromisoformat,
+                        help="fim do período (exclusivo); padrão: um dia após o início")
+    parser.add_argument('--formato', choices=sorted(FORMATOS), default='csv')
+    parser.add_argument('--gzip', action='store_true', help="compacta a saída em gzip")
+    parser.add_argument('--saida', help="arquivo de saída; padrão: saída padrão")
+    args = parser.parse_args(argumentos)
+    if ARMAZENAMENTO == 'memoria':
+        # o livro em memória pertence ao processo da API
+        parser.error("com ARMAZENAMENTO=memoria, exporte por GET /exportacoes/movimentos")
+
+    data_fim = args.fim or args.inicio + timedelta(days=1)
+    try:
+        blocos = exportar_movimentos(args.inicio, data_fim, args.formato, args.gzip)
+    except ValueError as e:
+        parser.error(str(e))
+
+    saida = open(args.saida, 'wb') if args.saida else sys.stdout.buffer
+    try:
+        for bloco in blocos:
+            saida.write(bloco)
+    finally:
+        if args.saida:
+            saida.close()
+        else:
+            saida.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Módulo do Extrato
+Histórico de movimentos de uma carteira (depósitos, saques, conversões e transferências)
+em uma única lista, do mais recente para o mais antigo, com paginação por cursor
+"""
+import base64
+import json
+from datetime import datetime
+from app.moedas import obter_catalogo, recarregar_catalogo
+
+TIPOS_MOVIMENTO = ('DEPOSITO', 'SAQUE', 'CONVERSAO', 'TRANSFERENCIA_ENVIADA', 'TRANSFERENCIA_RECEBIDA')
+
+# cada fonte é lida pelo índice (endereco, data_hora, id) da sua tabela
+# `ordem` desempata movimentos de tabelas diferentes no mesmo data_hora
+_FONTES = (
+    {
+        'ordem': 1,
+        'tipos': ('DEPOSITO', 'SAQUE'),
+        'tabela': 'DEPOSITO_SAQUE',
+        'coluna_endereco': 'endereco_carteira',
+        'coluna_id': 'id_movimento',
+        'colunas': """tipo, id_moeda, valor, taxa_valor, NULL AS id_moeda_destino,
+                      NULL AS valor_destino, NULL AS cotacao, NULL AS contraparte""",
+        'filtro_moeda': "id_moeda = %s",
+    },
+    {
+        'ordem': 2,
+        'tipos': ('CONVERSAO',),
+        'tabela': 'CONVERSAO',
+        'coluna_endereco': 'endereco_carteira',
+        'coluna_id': 'id_conversao',
+        'colunas': """'CONVERSAO' AS tipo, id_moeda_origem AS id_moeda, valor_origem AS valor, taxa_valor,
+                      id_moeda_destino, valor_destino, cotacao_utilizada AS cotacao, NULL AS contraparte""",
+        'filtro_moeda': "(id_moeda_origem = %s OR id_moeda_destino = %s)",
+    },
+    {
+        'ordem': 3,
+        'tipos': ('TRANSFERENCIA_ENVIADA',),
+        'tabela': 'TRANSFERENCIA',
+        'coluna_endereco': 'endereco_origem',
+        'coluna_id': 'id_transferencia',
+        'colunas': """'TRANSFERENCIA_ENVIADA' AS tipo, id_moeda, valor, taxa_valor, NULL AS id_moeda_destino,
+                      NULL AS valor_destino, NULL AS cotacao, endereco_destino AS contraparte""",
+        'filtro_moeda': "id_moeda = %s",
+    },
+    {
+        'ordem': 4,
+        'tipos': ('TRANSFERENCIA_RECEBIDA',),
+        'tabela': 'TRANSFERENCIA',
+        'coluna_endereco': 'endereco_destino',
+        'coluna_id': 'id_transferencia',
+        # a taxa da transferência é paga pela origem
+        'colunas': """'TRANSFERENCIA_RECEBIDA' AS tipo, id_moeda, valor, 0 AS taxa_valor, NULL AS id_moeda_destino,
+                      NULL AS valor_destino, NULL AS cotacao, endereco_origem AS contraparte""",
+        'filtro_moeda': "id_moeda = %s",
+    },
+)
+
+
+# CURSOR
+# posição do último movimento entregue: (data_hora, ordem, id), em base64 para ir na URL
+
+def codificar_cursor(linha):
+    posicao = [linha['data_hora'].isoformat(), linha['ordem'], linha['id']]
+    return base64.urlsafe_b64encode(json.dumps(posicao).encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor):
+    try:
+        texto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        data_hora, ordem, id_movimento = json.loads(texto)
+        return datetime.fromisoformat(data_hora), int(ordem), int(id_movimento)
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+
+
+# QUERY
+
+# condição "depois do cursor" na ordem decrescente (data_hora, ordem, id), resolvida por fonte:
+# como `ordem` é constante em cada SELECT, sobra uma comparação que usa o índice
+def _filtro_cursor(fonte, cursor):
+    data_hora, ordem, id_movimento = cursor
+    if fonte['ordem'] < ordem:
+        return "data_hora <= %s", [data_hora]
+    if fonte['ordem'] > ordem:
+        return "data_hora < %s", [data_hora]
+    return f"(data_hora < %s OR (data_hora = %s AND {fonte['coluna_id']} < %s))", [data_hora, data_hora, id_movimento]
+
+def sql_extrato(endereco_carteira, limite, id_moeda=None, tipos=None,
+                data_inicio=None, data_fim=None, cursor=None):
+    """
+    Monta o UNION ALL das fontes do extrato
+
+    Cada SELECT já sai ordenado e limitado pelo seu índice, então cada página lê no
+    máximo `limite + 1` linhas por fonte, independente do tamanho do histórico.
+    Retorna (query, params).
+    """
+    selects = []
+    params = []
+    for fonte in _FONTES:
+        tipos_fonte = [tipo for tipo in fonte['tipos'] if not tipos or tipo in tipos]
+        if not tipos_fonte:
+            continue
+
+        condicoes = [f"{fonte['coluna_endereco']} = %s"]
+        params_fonte = [endereco_carteira]
+        if len(tipos_fonte) < len(fonte['tipos']):
+            condicoes.append(f"tipo IN ({', '.join(['%s'] * len(tipos_fonte))})")
+            params_fonte.extend(tipos_fonte)
+        if id_moeda is not None:
+            condicoes.append(fonte['filtro_moeda'])
+            params_fonte.extend([id_moeda] * fonte['filtro_moeda'].count("%s"))
+        if data_inicio is not None:
+            condicoes.append("data_hora >= %s")
+            params_fonte.append(data_inicio)
+        if data_fim is not None:
+            condicoes.append("data_hora <= %s")
+            params_fonte.append(data_fim)
+        if cursor is not None:
+            condicao, valores = _filtro_cursor(fonte, cursor)
+            condicoes.append(condicao)
+            params_fonte.extend(valores)
+
+        selects.append(f"""
+            (SELECT {fonte['ordem']} AS ordem, {fonte['coluna_id']} AS id, data_hora, {fonte['colunas']}
+             FROM {fonte['tabela']}
+             WHERE {' AND '.join(condicoes)}
+             ORDER BY data_hora DESC, {fonte['coluna_id']} DESC
+             LIMIT %s)""")
+        params.extend(params_fonte)
+        params.append(limite + 1)
+
+    if not selects:
+        raise ValueError("Nenhum tipo de movimento válido informado")
+
+    query = "/* extrato */" + " UNION ALL ".join(selects) + """
+        ORDER BY data_hora DESC, ordem DESC, id DESC
+        LIMIT %s
+    """
+    params.append(limite + 1)
+    return query, params
+
+
+# RESPOSTA
+
+def _movimento(linha, moedas):
+    moeda_destino = moedas.por_id(linha['id_moeda_destino']) if linha['id_moeda_destino'] else None
+    return {
+        'tipo': linha['tipo'],
+        'id': linha['id'],
+        'data_hora': linha['data_hora'],
+        'codigo_moeda': moedas.por_id(linha['id_moeda']).codigo,
+        'valor': linha['valor'],
+        'taxa_valor': linha['taxa_valor'],
+        'codigo_moeda_destino': moeda_destino.codigo if moeda_destino else None,
+        'valor_destino': linha['valor_destino'],
+        'cotacao': linha['cotacao'],
+        'contraparte': linha['contraparte'],
+    }
+
+# converte as linhas da query para a resposta, com os códigos de moeda do catálogo
+# retorna (movimentos, proximo_cursor); proximo_cursor é None na última página
+def montar_extrato(linhas, limite):
+    pagina = linhas[:limite]
+    moedas = obter_catalogo()
+    ids_moeda = {linha['id_moeda'] for linha in pagina} | {linha['id_moeda_destino'] for linha in pagina}
+    if any(id_moeda and moedas.por_id(id_moeda) is None for id_moeda in ids_moeda):
+        # moeda cadastrada depois da carga do catálogo
+        moedas = recarregar_catalogo()
+
+    movimentos = [_movimento(linha, moedas) for linha in pagina]
+    proximo_cursor = codificar_cursor(pagina[-1]) if len(linhas) > limite else None
+    return movimentos, proximo_cursor
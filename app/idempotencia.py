@@ -0,0 +1,323 @@
+"""
+Módulo de Idempotência
+Repetições de uma operação com o mesmo cabeçalho Idempotency-Key recebem o resultado da primeira,
+sem aplicá-la de novo (depósitos, saques, conversões, transferências e criação de carteiras)
+
+- o resultado é gravado em IDEMPOTENCIA na mesma transação da operação: ou os dois ficam, ou
+  nenhum, e uma operação desfeita pode ser repetida com a mesma chave
+- os resultados ficam também em um LRU por worker, para a repetição não ir ao banco
+- repetições simultâneas esperam a original: no mesmo worker pela operação em andamento, entre
+  workers pela trava da linha de IDEMPOTENCIA que a transação original inseriu
+- a chave vale para uma só requisição: a impressão (operação, carteira e corpo) de uma repetição
+  diferente da original é recusada
+- `guardar` escolhe a parte do resultado que é guardada; só a requisição que executou a operação
+  recebe o resultado inteiro (a chave privada de uma carteira criada nunca é guardada)
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future, TimeoutError as FuturoEsgotado
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import pymysql
+from app.cache import AUSENTE, CacheLRU
+from app.config import (
+    ARMAZENAMENTO, IDEMPOTENCIA_CACHE_MAX, IDEMPOTENCIA_CACHE_TTL, IDEMPOTENCIA_ESPERA, IDEMPOTENCIA_RETENCAO_HORAS
+)
+from app.database import execute_query, transacao
+from app.database_async import execute_query_async
+from app.metricas import Contador, registro
+
+SQL_GRAVAR_IDEMPOTENCIA = """
+    INSERT /* gravar_idempotencia */ INTO IDEMPOTENCIA (chave, impressao, resultado) VALUES (%s, %s, %s)
+"""
+
+SQL_OBTER_IDEMPOTENCIA = "SELECT /* obter_idempotencia */ impressao, resultado FROM IDEMPOTENCIA WHERE chave = %s"
+
+# resultado gravado no começo de uma transação de lote cuja operação acabou falhando
+SQL_DESCARTAR_IDEMPOTENCIA = "DELETE /* descartar_idempotencia */ FROM IDEMPOTENCIA WHERE chave = %s"
+
+SQL_APAGAR_IDEMPOTENCIA = "DELETE /* apagar_idempotencia */ FROM IDEMPOTENCIA WHERE criada_em < %s LIMIT %s"
+
+_APAGAR_LOTE = 5000
+_LIMPEZA_SEGUNDOS = 60
+
+_ER_DUP_ENTRY = 1062
+
+
+class RequisicaoEmAndamentoError(Exception):
+    """A requisição original com a mesma Idempotency-Key ainda não terminou"""
+
+
+@dataclass(frozen=True)
+class Pedido:
+    """Chave e impressão de uma operação idempotente, passadas ao serviço que a executa"""
+    chave: str
+    impressao: str
+
+    def linha(self, resultado):
+        """Parâmetros de SQL_GRAVAR_IDEMPOTENCIA, para a transação da operação"""
+        return (self.chave, self.impressao, json.dumps(resultado))
+
+
+def impressao_requisicao(operacao, *termos):
+    """Resumo da requisição (operação, carteira e corpo, inclusive a chave privada, que só entra no hash)"""
+    return hashlib.sha256(json.dumps([operacao, *map(str, termos)]).encode()).hexdigest()
+
+def gravar_idempotencia(cursor, pedido, resultado):
+    """Grava o resultado da operação na transação aberta (nada sem Idempotency-Key)"""
+    if pedido is not None:
+        cursor.execute(SQL_GRAVAR_IDEMPOTENCIA, pedido.linha(resultado))
+
+async def gravar_idempotencia_async(cursor, pedido, resultado):
+    if pedido is not None:
+        await cursor.execute(SQL_GRAVAR_IDEMPOTENCIA, pedido.linha(resultado))
+
+def _chave_duplicada(erro):
+    return isinstance(erro, pymysql.err.IntegrityError) and erro.args and erro.args[0] == _ER_DUP_ENTRY
+
+def _guardado(linhas):
+    if not linhas:
+        return None
+    return linhas[0]['impressao'], json.loads(linhas[0]['resultado'])
+
+
+class Idempotencia:
+    """
+    Resultados das operações com Idempotency-Key, em memória e no banco
+
+    `executar(chave, impressao, operacao)` chama `operacao(pedido)` só se a chave ainda não tem
+    resultado; o serviço chamado grava o resultado (ou `guardar(resultado)`) com
+    gravar_idempotencia() na sua transação.
+    Sem banco (`persistir=False`, livro em memória), o resultado fica só no LRU.
+    """
+
+    def __init__(self, maximo, ttl, espera, persistir=True):
+        self.espera = espera
+        self.persistir = persistir
+        self._cache = CacheLRU(maximo, ttl)
+        self._em_andamento = {}  # chave -> (impressao, Future com o (impressao, resultado) gravado)
+        self._lock = threading.Lock()
+
+        self.executadas = Contador()
+        self.repetidas = Contador()
+        self.aguardadas = Contador()
+        self.recusadas = Contador()
+        self.esgotadas = Contador()
+
+    def _reservar(self, chave, impressao):
+        """('guardado', (impressao, resultado)), ('aguardar', futuro da original) ou ('executar', futuro próprio)"""
+        with self._lock:
+            guardado = self._cache.obter(chave)
+            if guardado is not AUSENTE:
+                return 'guardado', guardado
+            original = self._em_andamento.get(chave)
+            if original is not None:
+                if original[0] != impressao:
+                    self._recusar()
+                return 'aguardar', original[1]
+            futuro = Future()
+            self._em_andamento[chave] = (impressao, futuro)
+            return 'executar', futuro
+
+    def _concluir(self, chave, futuro, guardado=None, erro=None):
+        with self._lock:
+            if erro is None:
+                self._cache.guardar(chave, guardado)
+            del self._em_andamento[chave]
+        # quem espera pela original recebe o resultado, ou tenta de novo se ela falhou
+        if erro is None:
+            futuro.set_result(guardado)
+        else:
+            futuro.set_exception(erro)
+
+    def _recusar(self):
+        self.recusadas.incrementar()
+        raise ValueError("Idempotency-Key já usada em outra requisição")
+
+    def _conferir(self, guardado, impressao):
+        if guardado[0] != impressao:
+            self._recusar()
+        return guardado[1]
+
+    def executar(self, chave, impressao, operacao, guardar=None):
+        if chave is None:
+            return operacao(None)
+        while True:
+            situacao, valor = self._reservar(chave, impressao)
+            if situacao == 'guardado':
+                self.repetidas.incrementar()
+                return self._conferir(valor, impressao)
+            if situacao == 'executar':
+                break
+            try:
+                guardado = valor.result(timeout=self.espera)
+            except FuturoEsgotado:
+                self.esgotadas.incrementar()
+                raise RequisicaoEmAndamentoError("Requisição com a mesma Idempotency-Key ainda em andamento")
+            except Exception:
+                continue
+            self.aguardadas.incrementar()
+            return self._conferir(guardado, impressao)
+
+        futuro = valor
+        resposta = AUSENTE
+        try:
+            guardado = self._buscar(chave)
+            if guardado is None:
+                try:
+                    resposta = operacao(Pedido(chave, impressao))
+                    guardado = (impressao, resposta if guardar is None else guardar(resposta))
+                    self.executadas.incrementar()
+                except pymysql.err.IntegrityError as e:
+                    # outro worker gravou a mesma chave; a inserção esperou o commit dele
+                    guardado = self._buscar(chave) if _chave_duplicada(e) else None
+                    if guardado is None:
+                        raise
+                    self.repetidas.incrementar()
+            else:
+                self.repetidas.incrementar()
+        except BaseException as e:
+            self._concluir(chave, futuro, erro=e)
+            raise
+        self._concluir(chave, futuro, guardado)
+        if resposta is not AUSENTE:
+            return resposta
+        return self._conferir(guardado, impressao)
+
+    async def executar_async(self, chave, impressao, operacao, guardar=None):
+        """Versão de executar() para os serviços assíncronos (`operacao(pedido)` retorna um aguardável)"""
+        if chave is None:
+            return await operacao(None)
+        while True:
+            situacao, valor = self._reservar(chave, impressao)
+            if situacao == 'guardado':
+                self.repetidas.incrementar()
+                return self._conferir(valor, impressao)
+            if situacao == 'executar':
+                break
+            try:
+                # shield: desistir da espera não cancela o futuro da original
+                guardado = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(valor)), self.espera)
+            except asyncio.TimeoutError:
+                self.esgotadas.incrementar()
+                raise RequisicaoEmAndamentoError("Requisição com a mesma Idempotency-Key ainda em andamento")
+            except Exception:
+                continue
+            self.aguardadas.incrementar()
+            return self._conferir(guardado, impressao)
+
+        futuro = valor
+        resposta = AUSENTE
+        try:
+            guardado = await self._buscar_async(chave)
+            if guardado is None:
+                try:
+                    resposta = await operacao(Pedido(chave, impressao))
+                    guardado = (impressao, resposta if guardar is None else guardar(resposta))
+                    self.executadas.incrementar()
+                except pymysql.err.IntegrityError as e:
+                    guardado = await self._buscar_async(chave) if _chave_duplicada(e) else None
+                    if guardado is None:
+                        raise
+                    self.repetidas.incrementar()
+            else:
+                self.repetidas.incrementar()
+        except BaseException as e:
+            self._concluir(chave, futuro, erro=e)
+            raise
+        self._concluir(chave, futuro, guardado)
+        if resposta is not AUSENTE:
+            return resposta
+        return self._conferir(guardado, impressao)
+
+    # resultado gravado por outro worker, ou antes de um reinício (sempre no primário)
+    def _buscar(self, chave):
+        if not self.persistir:
+            return None
+        return _guardado(execute_query(SQL_OBTER_IDEMPOTENCIA, (chave,)))
+
+    async def _buscar_async(self, chave):
+        if not self.persistir:
+            return None
+        return _guardado(await execute_query_async(SQL_OBTER_IDEMPOTENCIA, (chave,)))
+
+    def estatisticas(self):
+        with self._lock:
+            em_andamento = len(self._em_andamento)
+        return {
+            'em_andamento': em_andamento,
+            'em_cache': self._cache.estatisticas()['tamanho'],
+            'executadas': self.executadas.valor,
+            'repetidas': self.repetidas.valor,
+            'aguardadas': self.aguardadas.valor,
+            'recusadas': self.recusadas.valor,
+            'esgotadas': self.esgotadas.valor,
+        }
+
+
+_idempotencia = Idempotencia(
+    IDEMPOTENCIA_CACHE_MAX, IDEMPOTENCIA_CACHE_TTL, IDEMPOTENCIA_ESPERA, persistir=ARMAZENAMENTO != 'memoria'
+)
+
+def obter_idempotencia():
+    return _idempotencia
+
+def executar_idempotente(chave, impressao, operacao, guardar=None):
+    return _idempotencia.executar(chave, impressao, operacao, guardar)
+
+async def executar_idempotente_async(chave, impressao, operacao, guardar=None):
+    return await _idempotencia.executar_async(chave, impressao, operacao, guardar)
+
+
+# RETENÇÃO
+# cada worker apaga, a cada minuto, os resultados mais antigos que IDEMPOTENCIA_RETENCAO_HORAS
+
+def apagar_idempotencia_antiga(retencao_horas=IDEMPOTENCIA_RETENCAO_HORAS):
+    limite = datetime.now() - timedelta(hours=retencao_horas)
+    # lotes curtos, para não segurar travas sobre a tabela que as operações gravam
+    while True:
+        with transacao() as cursor:
+            apagados = cursor.execute(SQL_APAGAR_IDEMPOTENCIA, (limite, _APAGAR_LOTE))
+        if apagados < _APAGAR_LOTE:
+            return
+
+_limpeza = None
+_parar_limpeza = threading.Event()
+
+def _limpar_periodicamente():
+    while not _parar_limpeza.wait(_LIMPEZA_SEGUNDOS):
+        try:
+            apagar_idempotencia_antiga()
+        except Exception:
+            # banco fora do ar: tenta de novo no próximo minuto
+            pass
+
+def iniciar_limpeza_idempotencia():
+    global _limpeza
+    if _limpeza is None and IDEMPOTENCIA_RETENCAO_HORAS > 0 and ARMAZENAMENTO != 'memoria':
+        _parar_limpeza.clear()
+        _limpeza = threading.Thread(target=_limpar_periodicamente, name='limpeza-idempotencia', daemon=True)
+        _limpeza.start()
+
+def fechar_limpeza_idempotencia():
+    global _limpeza
+    if _limpeza is not None:
+        _parar_limpeza.set()
+        _limpeza.join()
+        _limpeza = None
+
+
+@registro.coletor
+def _coletar_metricas():
+    estatisticas = _idempotencia.estatisticas()
+    return [
+        ('carteira_idempotencia_total', 'counter', "Requisições com Idempotency-Key por resultado",
+         [({'resultado': resultado}, estatisticas[chave]) for resultado, chave in (
+             ('executada', 'executadas'), ('repetida', 'repetidas'), ('aguardou_original', 'aguardadas'),
+             ('recusada', 'recusadas'), ('espera_esgotada', 'esgotadas'))]),
+        ('carteira_idempotencia_em_andamento', 'gauge', "Operações com Idempotency-Key executando neste worker",
+         [({}, estatisticas['em_andamento'])]),
+        ('carteira_idempotencia_em_cache', 'gauge', "Resultados guardados em memória", [({}, estatisticas['em_cache'])]),
+    ]
@@ -0,0 +1,549 @@
+"""
+Módulo do Livro-Razão em Memória
+Carteiras, saldos e movimentos guardados no processo, sem MySQL (ARMAZENAMENTO=memoria)
+
+- saldos de cada carteira em um array de inteiros em unidades de 1e-8 (a escala de DECIMAL(20, 8)),
+  na ordem do catálogo de moedas, com o mesmo arredondamento do MySQL
+- cada transação vira uma linha JSON no log (WAL) antes de ser aplicada; com LIVRO_FSYNC a linha
+  chega ao disco antes da resposta
+- a cada LIVRO_SNAPSHOT_OPERACOES transações o estado vai para um snapshot e o log recomeça em um
+  novo segmento; a subida carrega o snapshot e reaplica só os segmentos posteriores a ele
+
+As transações são serializadas por uma trava: cada uma leva microssegundos mais a escrita do log.
+Todo o histórico de movimentos fica em memória (ambientes de simulação e homologação).
+"""
+import bisect
+import json
+import os
+import pickle
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP, localcontext
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+from app.config import LIVRO_DIRETORIO, LIVRO_FSYNC, LIVRO_SNAPSHOT_OPERACOES
+from app.moedas import definir_catalogo
+
+# moedas de um livro novo (as mesmas de sql/03_popular_moedas.sql)
+MOEDAS_PADRAO = (
+    {'id_moeda': 1, 'codigo': 'BTC', 'string': 'Bitcoin', 'tipo': 'CRYPTO'},
+    {'id_moeda': 2, 'codigo': 'ETH', 'string': 'Ethereum', 'tipo': 'CRYPTO'},
+    {'id_moeda': 3, 'codigo': 'SOL', 'string': 'Solana', 'tipo': 'CRYPTO'},
+    {'id_moeda': 4, 'codigo': 'USD', 'string': 'Dólar Americano', 'tipo': 'FIAT'},
+    {'id_moeda': 5, 'codigo': 'BRL', 'string': 'Real Brasileiro', 'tipo': 'FIAT'},
+)
+
+_ESCALA = 8
+_OITO_CASAS = Decimal('0.00000001')
+_QUATRO_CASAS = Decimal('0.0001')
+_ZERO = Decimal('0.00000000')
+_LIMITE_UNIDADES = 2 ** 63  # array('q')
+
+_VERSAO_SNAPSHOT = 1
+_ARQUIVO_SNAPSHOT = 'snapshot.pickle'
+
+
+# valor gravado em uma coluna DECIMAL(20, 8) (ou DECIMAL(5, 4)): arredondado, metade para longe do zero
+def _coluna(valor, casas=_OITO_CASAS):
+    return Decimal(str(valor)).quantize(casas, ROUND_HALF_UP)
+
+def _decimal(unidades):
+    return Decimal(unidades).scaleb(-_ESCALA)
+
+def _unidades(valor):
+    with localcontext() as contexto:
+        contexto.prec = 50
+        unidades = int(Decimal(str(valor)).scaleb(_ESCALA).to_integral_value(ROUND_HALF_UP))
+    if not -_LIMITE_UNIDADES <= unidades < _LIMITE_UNIDADES:
+        raise ValueError("Saldo acima do limite do livro em memória")
+    return unidades
+
+# datas com fuso viram horário local sem fuso, como as colunas DATETIME
+def _sem_fuso(data_hora):
+    if data_hora is None or data_hora.tzinfo is None:
+        return data_hora
+    return data_hora.astimezone().replace(tzinfo=None)
+
+
+class _Carteira:
+    __slots__ = ('hash_chave_privada', 'data_criacao', 'status', 'saldos', 'movimentos')
+
+    def __init__(self, hash_chave_privada, data_criacao, status, saldos):
+        self.hash_chave_privada = hash_chave_privada
+        self.data_criacao = data_criacao
+        self.status = status
+        self.saldos = saldos
+        # chaves (data_hora, ordem, id) dos movimentos da carteira, em ordem crescente (ordem do extrato)
+        self.movimentos = []
+
+
+class Transacao:
+    """
+    Alterações de uma transação do livro, aplicadas juntas no fim do bloco `with livro.transacao()`
+
+    Leituras veem as alterações da própria transação. Uma exceção dentro do bloco descarta tudo.
+    """
+
+    def __init__(self, livro):
+        self._livro = livro
+        self._saldos = {}  # (endereco, id_moeda) -> unidades
+        self._novas = {}   # endereco -> hash da chave privada
+        self.registro = {}
+
+    def _anotar(self, chave, valor):
+        self.registro.setdefault(chave, []).append(valor)
+
+    def carteira(self, endereco_carteira):
+        """Linha da carteira como a do banco (com o hash da chave), ou None"""
+        return self._livro._dados_carteira(endereco_carteira)
+
+    def saldo(self, endereco_carteira, id_moeda):
+        """Saldo em Decimal, ou None se a carteira (ou a moeda) não existir"""
+        chave = (endereco_carteira, id_moeda)
+        if chave in self._saldos:
+            return _decimal(self._saldos[chave])
+        unidades = self._livro._unidades_saldo(endereco_carteira, id_moeda)
+        return None if unidades is None else _decimal(unidades)
+
+    def somar(self, endereco_carteira, id_moeda, variacao):
+        """Soma `variacao` ao saldo (como `saldo = saldo + %s`); retorna False se não houver o saldo"""
+        saldo = self.saldo(endereco_carteira, id_moeda)
+        if saldo is None:
+            return False
+        with localcontext() as contexto:
+            contexto.prec = 50
+            self.gravar_saldo(endereco_carteira, id_moeda, saldo + Decimal(str(variacao)))
+        return True
+
+    def gravar_saldo(self, endereco_carteira, id_moeda, saldo):
+        self._saldos[(endereco_carteira, id_moeda)] = _unidades(saldo)
+
+    def criar_carteira(self, endereco_carteira, hash_chave_privada):
+        if endereco_carteira in self._novas or self._livro._dados_carteira(endereco_carteira):
+            raise ValueError(f"Carteira {endereco_carteira} já existe")
+        self._novas[endereco_carteira] = hash_chave_privada
+        self._anotar('c', [endereco_carteira, hash_chave_privada])
+
+    def alterar_status(self, endereco_carteira, status):
+        self._anotar('st', [endereco_carteira, status])
+
+    def deposito_saque(self, endereco_carteira, id_moeda, valor, tipo, taxa_valor):
+        self._anotar('ds', [endereco_carteira, id_moeda, str(_coluna(valor)), tipo, str(_coluna(taxa_valor))])
+
+    def conversao(self, endereco_carteira, id_moeda_origem, id_moeda_destino, valor_origem, valor_destino,
+                  taxa_percentual, taxa_valor, cotacao):
+        self._anotar('cv', [
+            endereco_carteira, id_moeda_origem, id_moeda_destino, str(_coluna(valor_origem)),
+            str(_coluna(valor_destino)), str(_coluna(taxa_percentual, _QUATRO_CASAS)),
+            str(_coluna(taxa_valor)), str(_coluna(cotacao))
+        ])
+
+    def transferencia(self, endereco_origem, endereco_destino, id_moeda, valor, taxa_valor):
+        self._anotar('tr', [endereco_origem, endereco_destino, id_moeda, str(_coluna(valor)), str(_coluna(taxa_valor))])
+
+    def _fechar(self):
+        if self._saldos:
+            self.registro['s'] = [[endereco, id_moeda, unidades] for (endereco, id_moeda), unidades in self._saldos.items()]
+        return self.registro
+
+
+class LivroMemoria:
+    """
+    Livro-razão em memória com log de escrita antecipada e snapshots
+
+    abrir() carrega o estado do disco e precisa ser chamado antes de qualquer operação;
+    fechar() grava um snapshot final, para a próxima subida não reaplicar o log.
+    """
+
+    def __init__(self, diretorio, fsync=True, snapshot_operacoes=100000):
+        self.diretorio = diretorio
+        self.fsync = fsync
+        self.snapshot_operacoes = snapshot_operacoes
+        self._lock = threading.Lock()
+        self._moedas = [dict(moeda) for moeda in MOEDAS_PADRAO]
+        self._posicao = {}
+        self._carteiras = {}
+        # movimentos na ordem de gravação; o id é a posição + 1, como o AUTO_INCREMENT das tabelas
+        self._deposito_saque = []  # (endereco, id_moeda, tipo, valor, taxa_valor, data_hora)
+        self._conversoes = []      # (endereco, id_origem, id_destino, valor_origem, valor_destino, taxa_percentual, taxa_valor, cotacao, data_hora)
+        self._transferencias = []  # (endereco_origem, endereco_destino, id_moeda, valor, taxa_valor, data_hora)
+        self._segmento = 1
+        self._transacoes_no_segmento = 0
+        self._log = None
+        self._trava = None     # arquivo travado enquanto o livro está aberto
+        self._snapshot = None  # thread do snapshot em andamento
+
+    # SUBIDA
+
+    def _caminho(self, nome):
+        return os.path.join(self.diretorio, nome)
+
+    def _segmentos(self):
+        segmentos = []
+        for nome in os.listdir(self.diretorio):
+            if nome.startswith('wal-') and nome.endswith('.log'):
+                segmentos.append(int(nome[4:-4]))
+        return sorted(segmentos)
+
+    def _travar_diretorio(self):
+        # um processo por diretório: dois workers do uvicorn no mesmo log o corromperiam
+        self._trava = open(self._caminho('livro.lock'), 'w')
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._trava.close()
+            self._trava = None
+            raise RuntimeError(
+                f"Livro em {self.diretorio} já está aberto por outro processo (use um único worker)"
+            )
+
+    def abrir(self):
+        os.makedirs(self.diretorio, exist_ok=True)
+        self._travar_diretorio()
+        self._carregar_snapshot()
+        catalogo = definir_catalogo(self._moedas)
+        self._posicao = {moeda.id_moeda: catalogo.posicao(moeda.id_moeda) for moeda in catalogo}
+
+        for segmento in self._segmentos():
+            if segmento >= self._segmento:
+                self._reaplicar(segmento)
+                self._segmento = segmento + 1
+        # cada subida escreve em um segmento novo: uma linha cortada no fim do anterior
+        # (queda no meio da escrita) nunca fica no meio do log
+        self._log = open(self._caminho(f'wal-{self._segmento:06d}.log'), 'ab')
+        return catalogo
+
+    def _carregar_snapshot(self):
+        caminho = self._caminho(_ARQUIVO_SNAPSHOT)
+        if not os.path.exists(caminho):
+            return
+        with open(caminho, 'rb') as arquivo:
+            estado = pickle.load(arquivo)
+        if estado['versao'] != _VERSAO_SNAPSHOT:
+            raise RuntimeError(f"Snapshot do livro na versão {estado['versao']}, esperada {_VERSAO_SNAPSHOT}")
+
+        self._moedas = estado['moedas']
+        self._segmento = estado['segmento']
+        for endereco, hash_chave, data_criacao, status, saldos in estado['carteiras']:
+            self._carteiras[endereco] = _Carteira(hash_chave, data_criacao, status, array('q', saldos))
+        self._deposito_saque = estado['deposito_saque']
+        self._conversoes = estado['conversoes']
+        self._transferencias = estado['transferencias']
+
+        # índices do extrato, refeitos a partir dos movimentos
+        for id_movimento, movimento in enumerate(self._deposito_saque, 1):
+            self._carteiras[movimento[0]].movimentos.append((movimento[5], 1, id_movimento))
+        for id_conversao, conversao in enumerate(self._conversoes, 1):
+            self._carteiras[conversao[0]].movimentos.append((conversao[8], 2, id_conversao))
+        for id_transferencia, transferencia in enumerate(self._transferencias, 1):
+            self._carteiras[transferencia[0]].movimentos.append((transferencia[5], 3, id_transferencia))
+            self._carteiras[transferencia[1]].movimentos.append((transferencia[5], 4, id_transferencia))
+        for carteira in self._carteiras.values():
+            carteira.movimentos.sort()
+
+    def _reaplicar(self, segmento):
+        with open(self._caminho(f'wal-{segmento:06d}.log'), 'rb') as arquivo:
+            for numero, linha in enumerate(arquivo, 1):
+                if not linha.endswith(b'\n'):
+                    # escrita interrompida: a transação não foi confirmada a ninguém
+                    break
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    raise RuntimeError(f"Log do livro corrompido: wal-{segmento:06d}.log, linha {numero}")
+                self._aplicar(registro)
+
+    # APLICAÇÃO
+    # o mesmo código aplica as transações novas e as reaplicadas do log
+
+    def _aplicar(self, registro):
+        data_hora = datetime.fromisoformat(registro['d'])
+        tamanho = len(self._moedas)
+        for endereco, hash_chave in registro.get('c', ()):
+            self._carteiras[endereco] = _Carteira(hash_chave, data_hora, 'ATIVA', array('q', bytes(8 * tamanho)))
+        for endereco, status in registro.get('st', ()):
+            self._carteiras[endereco].status = status
+        for endereco, id_moeda, unidades in registro.get('s', ()):
+            self._carteiras[endereco].saldos[self._posicao[id_moeda]] = unidades
+
+        for endereco, id_moeda, valor, tipo, taxa_valor in registro.get('ds', ()):
+            self._deposito_saque.append((endereco, id_moeda, tipo, Decimal(valor), Decimal(taxa_valor), data_hora))
+            self._indexar(endereco, (data_hora, 1, len(self._deposito_saque)))
+        for endereco, id_origem, id_destino, valor_origem, valor_destino, taxa_percentual, taxa_valor, cotacao in registro.get('cv', ()):
+            self._conversoes.append((
+                endereco, id_origem, id_destino, Decimal(valor_origem), Decimal(valor_destino),
+                Decimal(taxa_percentual), Decimal(taxa_valor), Decimal(cotacao), data_hora
+            ))
+            self._indexar(endereco, (data_hora, 2, len(self._conversoes)))
+        for origem, destino, id_moeda, valor, taxa_valor in registro.get('tr', ()):
+            self._transferencias.append((origem, destino, id_moeda, Decimal(valor), Decimal(taxa_valor), data_hora))
+            self._indexar(origem, (data_hora, 3, len(self._transferencias)))
+            self._indexar(destino, (data_hora, 4, len(self._transferencias)))
+
+    def _indexar(self, endereco, chave):
+        movimentos = self._carteiras[endereco].movimentos
+        if not movimentos or movimentos[-1] < chave:
+            movimentos.append(chave)
+        else:
+            bisect.insort(movimentos, chave)
+
+    # TRANSAÇÕES
+
+    @contextmanager
+    def transacao(self):
+        """
+        Bloco com a trava do livro; no fim, grava a transação no log e aplica em memória
+
+        Uso:
+            with livro.transacao() as t:
+                saldo = t.saldo(endereco, id_moeda)
+                ...
+                t.somar(endereco, id_moeda, -valor)
+        """
+        with self._lock:
+            transacao = Transacao(self)
+            yield transacao
+            registro = transacao._fechar()
+            if not registro:
+                return
+            registro['d'] = datetime.now().replace(microsecond=0).isoformat()
+            self._escrever(registro)
+            self._aplicar(registro)
+            self._transacoes_no_segmento += 1
+            if self._transacoes_no_segmento >= self.snapshot_operacoes and self._snapshot is None:
+                self._iniciar_snapshot()
+
+    def _escrever(self, registro):
+        posicao = self._log.tell()
+        try:
+            self._log.write(json.dumps(registro, separators=(',', ':')).encode() + b'\n')
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+        except Exception:
+            # sem deixar meia linha no meio do log (a transação não é aplicada)
+            self._log.truncate(posicao)
+            raise
+
+    # LEITURAS (com a trava já tomada pela transação ou tomadas aqui)
+
+    def _dados_carteira(self, endereco_carteira):
+        carteira = self._carteiras.get(endereco_carteira)
+        if carteira is None:
+            return None
+        return {
+            'endereco_carteira': endereco_carteira,
+            'data_criacao': carteira.data_criacao,
+            'status': carteira.status,
+            'hash_chave_privada': carteira.hash_chave_privada,
+        }
+
+    def _unidades_saldo(self, endereco_carteira, id_moeda):
+        carteira = self._carteiras.get(endereco_carteira)
+        posicao = self._posicao.get(id_moeda)
+        if carteira is None or posicao is None:
+            return None
+        return carteira.saldos[posicao]
+
+    def dados_carteira(self, endereco_carteira):
+        with self._lock:
+            return self._dados_carteira(endereco_carteira)
+
+    def saldos(self, endereco_carteira):
+        """Saldos em unidades de 1e-8 na ordem do catálogo, ou None se a carteira não existir"""
+        with self._lock:
+            carteira = self._carteiras.get(endereco_carteira)
+            return None if carteira is None else tuple(carteira.saldos)
+
+    def extrato(self, endereco_carteira, limite, id_moeda=None, tipos=None, data_inicio=None, data_fim=None, cursor=None):
+        """Linhas do extrato no formato da query de app/extrato.py (até limite + 1, do mais recente)"""
+        data_inicio, data_fim = _sem_fuso(data_inicio), _sem_fuso(data_fim)
+        linhas = []
+        with self._lock:
+            carteira = self._carteiras.get(endereco_carteira)
+            if carteira is None:
+                return linhas
+            chaves = carteira.movimentos
+            fim = len(chaves)
+            if data_fim is not None:
+                fim = bisect.bisect_right(chaves, (data_fim, 5))
+            if cursor is not None:
+                fim = min(fim, bisect.bisect_left(chaves, (_sem_fuso(cursor[0]), *cursor[1:])))
+            for posicao in range(fim - 1, -1, -1):
+                data_hora, ordem, id_movimento = chaves[posicao]
+                if data_inicio is not None and data_hora < data_inicio:
+                    break
+                linha = self._linha_extrato(ordem, id_movimento)
+                if tipos and linha['tipo'] not in tipos:
+                    continue
+                if id_moeda is not None and id_moeda not in (linha['id_moeda'], linha['id_moeda_destino']):
+                    continue
+                linhas.append(linha)
+                if len(linhas) > limite:
+                    break
+        return linhas
+
+    def _linha_extrato(self, ordem, id_movimento):
+        linha = {
+            'ordem': ordem, 'id': id_movimento, 'id_moeda_destino': None, 'valor_destino': None,
+            'cotacao': None, 'contraparte': None,
+        }
+        if ordem == 1:
+            _, id_moeda, tipo, valor, taxa_valor, data_hora = self._deposito_saque[id_movimento - 1]
+            linha.update(tipo=tipo, id_moeda=id_moeda, valor=valor, taxa_valor=taxa_valor, data_hora=data_hora)
+        elif ordem == 2:
+            _, id_origem, id_destino, valor_origem, valor_destino, _, taxa_valor, cotacao, data_hora = \
+                self._conversoes[id_movimento - 1]
+            linha.update(
+                tipo='CONVERSAO', id_moeda=id_origem, valor=valor_origem, taxa_valor=taxa_valor,
+                id_moeda_destino=id_destino, valor_destino=valor_destino, cotacao=cotacao, data_hora=data_hora
+            )
+        else:
+            origem, destino, id_moeda, valor, taxa_valor, data_hora = self._transferencias[id_movimento - 1]
+            enviada = ordem == 3
+            linha.update(
+                tipo='TRANSFERENCIA_ENVIADA' if enviada else 'TRANSFERENCIA_RECEBIDA', id_moeda=id_moeda,
+                valor=valor, taxa_valor=taxa_valor if enviada else _ZERO,
+                contraparte=destino if enviada else origem, data_hora=data_hora
+            )
+        return linha
+
+    def movimentos_periodo(self, data_inicio, data_fim):
+        """
+        Movimentos com data_hora em [data_inicio, data_fim) no formato das linhas da exportação
+
+        Gerador: as listas só crescem, então basta fixar o tamanho delas no início da leitura.
+        """
+        data_inicio, data_fim = _sem_fuso(data_inicio), _sem_fuso(data_fim)
+        with self._lock:
+            tamanhos = len(self._deposito_saque), len(self._conversoes), len(self._transferencias)
+
+        for id_movimento in range(1, tamanhos[0] + 1):
+            endereco, id_moeda, tipo, valor, taxa_valor, data_hora = self._deposito_saque[id_movimento - 1]
+            if data_inicio <= data_hora < data_fim:
+                yield {
+                    'tipo': tipo, 'id': id_movimento, 'data_hora': data_hora, 'endereco_carteira': endereco,
+                    'contraparte': None, 'id_moeda': id_moeda, 'valor': valor, 'taxa_valor': taxa_valor,
+                    'id_moeda_destino': None, 'valor_destino': None, 'cotacao': None,
+                }
+        for id_conversao in range(1, tamanhos[1] + 1):
+            endereco, id_origem, id_destino, valor_origem, valor_destino, _, taxa_valor, cotacao, data_hora = \
+                self._conversoes[id_conversao - 1]
+            if data_inicio <= data_hora < data_fim:
+                yield {
+                    'tipo': 'CONVERSAO', 'id': id_conversao, 'data_hora': data_hora, 'endereco_carteira': endereco,
+                    'contraparte': None, 'id_moeda': id_origem, 'valor': valor_origem, 'taxa_valor': taxa_valor,
+                    'id_moeda_destino': id_destino, 'valor_destino': valor_destino, 'cotacao': cotacao,
+                }
+        for id_transferencia in range(1, tamanhos[2] + 1):
+            origem, destino, id_moeda, valor, taxa_valor, data_hora = self._transferencias[id_transferencia - 1]
+            if data_inicio <= data_hora < data_fim:
+                yield {
+                    'tipo': 'TRANSFERENCIA', 'id': id_transferencia, 'data_hora': data_hora, 'endereco_carteira': origem,
+                    'contraparte': destino, 'id_moeda': id_moeda, 'valor': valor, 'taxa_valor': taxa_valor,
+                    'id_moeda_destino': None, 'valor_destino': None, 'cotacao': None,
+                }
+
+    # SNAPSHOTS
+
+    def _estado(self):
+        """Cópia do estado para o snapshot (com a trava tomada); o log passa para o próximo segmento"""
+        estado = {
+            'versao': _VERSAO_SNAPSHOT,
+            'moedas': [dict(moeda) for moeda in self._moedas],
+            'carteiras': [
+                (endereco, carteira.hash_chave_privada, carteira.data_criacao, carteira.status, carteira.saldos.tobytes())
+                for endereco, carteira in self._carteiras.items()
+            ],
+            'deposito_saque': list(self._deposito_saque),
+            'conversoes': list(self._conversoes),
+            'transferencias': list(self._transferencias),
+        }
+        self._log.close()
+        self._segmento += 1
+        self._transacoes_no_segmento = 0
+        self._log = open(self._caminho(f'wal-{self._segmento:06d}.log'), 'ab')
+        # a reaplicação começa no segmento aberto agora
+        estado['segmento'] = self._segmento
+        return estado
+
+    def _gravar_snapshot(self, estado):
+        temporario = self._caminho(_ARQUIVO_SNAPSHOT + '.tmp')
+        with open(temporario, 'wb') as arquivo:
+            pickle.dump(estado, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, self._caminho(_ARQUIVO_SNAPSHOT))
+        # segmentos já contidos no snapshot
+        for segmento in self._segmentos():
+            if segmento < estado['segmento']:
+                os.remove(self._caminho(f'wal-{segmento:06d}.log'))
+
+    def _iniciar_snapshot(self):
+        estado = self._estado()
+        def gravar():
+            try:
+                self._gravar_snapshot(estado)
+            finally:
+                self._snapshot = None
+        self._snapshot = threading.Thread(target=gravar, name='snapshot-livro', daemon=True)
+        self._snapshot.start()
+
+    def fechar(self):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            snapshot.join()
+        with self._lock:
+            if self._log is None:
+                return
+            estado = self._estado() if self._transacoes_no_segmento else None
+            self._log.close()
+            self._log = None
+        if estado is not None:
+            self._gravar_snapshot(estado)
+        self._trava.close()
+        self._trava = None
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'carteiras': len(self._carteiras),
+                'depositos_saques': len(self._deposito_saque),
+                'conversoes': len(self._conversoes),
+                'transferencias': len(self._transferencias),
+                'segmento': self._segmento,
+                'transacoes_no_segmento': self._transacoes_no_segmento,
+            }
+
+
+# livro do processo (ARMAZENAMENTO=memoria), aberto na subida da API
+_livro = None
+_livro_lock = threading.Lock()
+
+def abrir_livro():
+    global _livro
+    with _livro_lock:
+        if _livro is None:
+            livro = LivroMemoria(LIVRO_DIRETORIO, LIVRO_FSYNC, LIVRO_SNAPSHOT_OPERACOES)
+            livro.abrir()
+            _livro = livro
+    return _livro
+
+def obter_livro():
+    livro = _livro
+    if livro is None:
+        livro = abrir_livro()
+    return livro
+
+def fechar_livro():
+    global _livro
+    with _livro_lock:
+        if _livro is not None:
+            _livro.fechar()
+            _livro = None
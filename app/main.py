@@ -1,30 +1,182 @@
-from fastapi import FastAPI, HTTPException, status
+import json
+import time
+from datetime import datetime
+from typing import Literal, Optional
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Query, Request, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from app.admissao import ControlarAdmissao
+from app.config import API_MODO, ARMAZENAMENTO, EXTRATO_LIMITE_PADRAO, EXTRATO_LIMITE_MAX, EVENTOS_SALDO, EVENTOS_ESPERA_MAX
+from app.cotacoes import obter_cache_cotacoes
+from app.cotacoes_travadas import iniciar_limpeza_cotacoes, fechar_limpeza_cotacoes
+from app.database import fechar_pool, fechar_roteador, obter_roteador
+from app.database_async import fechar_pool_async
+from app.eventos import (
+    abrir_fluxo_eventos, aguardar_eventos, converter_evento, fechar_despachante, iniciar_despachante,
+    ler_cursor, obter_despachante
+)
+from app.exportacao import FORMATOS, exportar_movimentos, nome_arquivo
+from app.idempotencia import (
+    RequisicaoEmAndamentoError, executar_idempotente, impressao_requisicao, iniciar_limpeza_idempotencia,
+    fechar_limpeza_idempotencia
+)
+from app.livro import abrir_livro, fechar_livro
+from app.metricas import LIMITES_LATENCIA, registro
+from app.moedas import obter_catalogo, recarregar_catalogo, recarregar_catalogo_async
+from app.perfil import PerfilarRequisicoes, RotaPerfilavel
 from app.models import (
-    CarteiraResponse, SaldosResponse, OperacaoResponse,
-    DepositoRequest, SaqueRequest, ConversaoRequest, TransferenciaRequest
+    CarteiraResponse, SaldosResponse, ExtratoResponse, EventosResponse, TipoMovimento, OperacaoResponse,
+    CotacaoConversaoResponse, MoedaResponse, LoteCarteirasRequest, OperacoesLoteRequest, OperacoesLoteResponse,
+    DepositoRequest, SaqueRequest, ConversaoRequest, CotacaoConversaoRequest, TransferenciaRequest
 )
 from app.services import (
-    criar_carteira, obter_carteira, obter_saldos,
-    realizar_deposito, realizar_saque, realizar_conversao, realizar_transferencia
+    CarteiraNaoEncontradaError, carteira_guardada, fechar_commit_depositos, preparar_carteiras_quentes
 )
+# ARMAZENAMENTO=memoria: as mesmas operações sobre o livro-razão em memória, sem MySQL
+if ARMAZENAMENTO == 'memoria':
+    from app.services_memoria import (
+        criar_carteira, criar_carteiras_em_lote, obter_carteira, obter_saldos, obter_extrato,
+        realizar_deposito, realizar_saque, cotar_conversao, realizar_conversao, realizar_transferencia,
+        realizar_operacoes_em_lote
+    )
+else:
+    from app.services import (
+        criar_carteira, criar_carteiras_em_lote, obter_carteira, obter_saldos, obter_extrato,
+        realizar_deposito, realizar_saque, cotar_conversao, realizar_conversao, realizar_transferencia,
+        realizar_operacoes_em_lote
+    )
+
+# ciclo de vida da aplicação: carrega o catálogo de moedas e prepara os slots das
+# carteiras quentes na subida (ou abre o livro em memória), inicia o despachante de eventos, a
+# verificação das réplicas e a limpeza da idempotência, e libera as conexões do pool ao encerrar
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if ARMAZENAMENTO == 'memoria':
+        # catálogo, carteiras e saldos vêm do snapshot e do log do livro
+        abrir_livro()
+    else:
+        if API_MODO == 'async':
+            await recarregar_catalogo_async()
+        else:
+            recarregar_catalogo()
+        preparar_carteiras_quentes()
+        # mede o atraso das réplicas (DB_REPLICAS) antes das primeiras leituras
+        obter_roteador()
+        iniciar_limpeza_idempotencia()
+        iniciar_limpeza_cotacoes()
+        if EVENTOS_SALDO:
+            iniciar_despachante()
+    yield
+    # snapshot final do livro em memória (nada a fazer com ARMAZENAMENTO=mysql)
+    fechar_livro()
+    # grava os depósitos ainda na fila do commit agrupado antes de fechar o pool
+    fechar_commit_depositos()
+    fechar_despachante()
+    fechar_roteador()
+    fechar_limpeza_idempotencia()
+    fechar_limpeza_cotacoes()
+    fechar_pool()
+    await fechar_pool_async()
+    provedor = obter_cache_cotacoes().provedor
+    if hasattr(provedor, 'fechar_async'):
+        await provedor.fechar_async()
+
 
 # cria aplicação FastAPI
 app = FastAPI(
     title="Carteira Digital API",
     description="API para gerenciamento de carteiras digitais com suporte a múltiplas moedas",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+# endpoints envolvidos para poderem rodar sob o cProfile (app/perfil.py)
+app.router.route_class = RotaPerfilavel
+
+
+# MÉTRICAS DE REQUISIÇÕES
+
+_duracao_requisicoes = registro.histograma(
+    'carteira_http_duracao_segundos', "Duração das requisições por rota",
+    LIMITES_LATENCIA, ('metodo', 'rota')
+)
+_requisicoes = registro.contador(
+    'carteira_http_requisicoes_total', "Requisições por rota e status", ('metodo', 'rota', 'status')
+)
+
+
+class MedirRequisicoes:
+    """
+    Middleware ASGI que mede a duração e conta as respostas de cada requisição
+
+    A rota é o caminho declarado (/carteiras/{endereco_carteira}), não o da requisição, para
+    que os rótulos fiquem em um conjunto pequeno; requisições que não casam com nenhuma rota
+    ficam em 'desconhecida'.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._rotas = None
+
+    def _rota(self, scope):
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'desconhecida'
+        if self._rotas is None:
+            # montado na primeira requisição, depois de incluídos os routers
+            self._rotas = {rota.endpoint: rota.path for rota in scope['app'].routes if hasattr(rota, 'endpoint')}
+        return self._rotas.get(endpoint, 'desconhecida')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_resposta = 500
+        async def enviar(mensagem):
+            nonlocal status_resposta
+            if mensagem['type'] == 'http.response.start':
+                status_resposta = mensagem['status']
+            await send(mensagem)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # o roteador preenche scope['endpoint'] ao encontrar a rota
+            metodo = scope['method']
+            rota = self._rota(scope)
+            _duracao_requisicoes.com(metodo, rota).observar(time.perf_counter() - inicio)
+            _requisicoes.com(metodo, rota, str(status_resposta)).incrementar()
+
+
+# o último adicionado é o mais externo: as recusas da admissão entram nas métricas de requisições
+# e não chegam a ocupar o perfilamento
+app.add_middleware(PerfilarRequisicoes)
+app.add_middleware(ControlarAdmissao)
+app.add_middleware(MedirRequisicoes)
+
+# endpoints das operações de carteira na versão síncrona (def, executados no pool de threads)
+# em API_MODO=async os mesmos caminhos são servidos por app/rotas_async.py
+rotas = APIRouter(route_class=RotaPerfilavel)
 
 
 # post para criar uma nova carteira
 # retorna o endereço da carteira e a chave privada
-@app.post("/carteiras", response_model=CarteiraResponse, status_code=status.HTTP_201_CREATED)
-def criar_nova_carteira():
+@rotas.post("/carteiras", response_model=CarteiraResponse, status_code=status.HTTP_201_CREATED)
+def criar_nova_carteira(idempotency_key: Optional[str] = Header(None, max_length=255)):
     try:
-        resultado = criar_carteira()
-        return CarteiraResponse(
-            endereco_carteira=resultado['endereco_carteira'],
-            chave_privada=resultado['chave_privada']
+        resultado = executar_idempotente(
+            idempotency_key, impressao_requisicao('criar_carteira'), criar_carteira, carteira_guardada
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
         )
     except Exception as e:
         raise HTTPException(
@@ -32,8 +184,19 @@ def criar_nova_carteira():
             detail=f"Erro ao criar carteira: {str(e)}"
         )
 
+    # repetição: a carteira já existe e a chave privada, que não é guardada, só saiu na primeira resposta
+    if 'chave_privada' not in resultado:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Carteira {resultado['endereco_carteira']} já criada com esta Idempotency-Key"
+        )
+    return CarteiraResponse(
+        endereco_carteira=resultado['endereco_carteira'],
+        chave_privada=resultado['chave_privada']
+    )
+
 # get para consultar informações de uma carteira (endereço, data de criação e status)
-@app.get("/carteiras/{endereco_carteira}", response_model=CarteiraResponse)
+@rotas.get("/carteiras/{endereco_carteira}", response_model=CarteiraResponse)
 def consultar_carteira(endereco_carteira: str):
     carteira = obter_carteira(endereco_carteira)
     
@@ -50,38 +213,245 @@ def consultar_carteira(endereco_carteira: str):
     )
 
 # consulta o saldo e retorna lista com o saldo de cada moeda
-@app.get("/carteiras/{endereco_carteira}/saldos", response_model=SaldosResponse)
+@rotas.get("/carteiras/{endereco_carteira}/saldos", response_model=SaldosResponse)
 def consultar_saldos(endereco_carteira: str):
-    # verifica se carteira existe
-    carteira = obter_carteira(endereco_carteira)
-    if not carteira:
+    # a existência da carteira é verificada na mesma query dos saldos
+    saldos = obter_saldos(endereco_carteira)
+    if saldos is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Carteira não encontrada"
         )
     
-    saldos = obter_saldos(endereco_carteira)
-    
     return SaldosResponse(
         endereco_carteira=endereco_carteira,
         saldos=saldos
     )
 
+# extrato da carteira: depósitos, saques, conversões e transferências, do mais recente ao mais antigo
+# paginação por cursor: o proximo_cursor da resposta busca a página seguinte
+@rotas.get("/carteiras/{endereco_carteira}/extrato", response_model=ExtratoResponse)
+def consultar_extrato(
+    endereco_carteira: str,
+    codigo_moeda: Optional[str] = None,
+    tipo: Optional[list[TipoMovimento]] = Query(None),
+    data_inicio: Optional[datetime] = None,
+    data_fim: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limite: int = Query(EXTRATO_LIMITE_PADRAO, ge=1, le=EXTRATO_LIMITE_MAX)
+):
+    try:
+        movimentos, proximo_cursor = obter_extrato(
+            endereco_carteira, limite, codigo_moeda, tipo, data_inicio, data_fim, cursor
+        )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao consultar extrato: {str(e)}"
+        )
+
+    return ExtratoResponse(
+        endereco_carteira=endereco_carteira,
+        movimentos=movimentos,
+        proximo_cursor=proximo_cursor
+    )
+
 
-# ENDPOINTS DE DEPÓSITOS
-# realiza depósito de um tipo de moeda
-@app.post("/carteiras/{endereco_carteira}/depositos", response_model=OperacaoResponse)
-def depositar(endereco_carteira: str, deposito: DepositoRequest):
-    # Verificar se carteira existe
-    carteira = obter_carteira(endereco_carteira)
-    if not carteira:
+# ENDPOINTS DE CARTEIRAS EM LOTE
+
+@app.post("/carteiras/lote", status_code=status.HTTP_201_CREATED)
+def criar_carteiras_lote(lote: LoteCarteirasRequest):
+    """
+    Cria várias carteiras em uma única transação
+
+    Resposta em NDJSON: uma linha {endereco_carteira, chave_privada} por carteira,
+    enviada à medida que cada bloco é inserido, e uma última linha de status.
+    As carteiras só valem se a última linha for {"status": "confirmado"}; em caso de
+    erro a última linha é {"status": "erro"} e nenhuma carteira foi gravada.
+    """
+    def gerar_linhas():
+        criadas = 0
+        try:
+            for chaves in criar_carteiras_em_lote(lote.quantidade):
+                criadas += len(chaves)
+                yield "".join(
+                    json.dumps({"endereco_carteira": endereco, "chave_privada": chave}) + "\n"
+                    for endereco, chave in chaves
+                )
+        except Exception as e:
+            yield json.dumps({"status": "erro", "mensagem": f"Erro ao criar carteiras: {str(e)}"}) + "\n"
+            return
+        yield json.dumps({"status": "confirmado", "quantidade": criadas}) + "\n"
+
+    return StreamingResponse(
+        gerar_linhas(), media_type="application/x-ndjson", status_code=status.HTTP_201_CREATED
+    )
+
+
+# ENDPOINTS DE OPERAÇÕES EM LOTE
+
+@app.post("/operacoes/lote", response_model=OperacoesLoteResponse)
+def operacoes_lote(lote: OperacoesLoteRequest):
+    """
+    Aplica depósitos, saques e transferências em uma única transação
+
+    Todos os saldos envolvidos são travados de uma vez e as operações são validadas
+    na ordem recebida. No modo "atomico" uma operação inválida rejeita o lote inteiro;
+    no modo "melhor_esforco" as válidas são aplicadas. O resultado vem por operação.
+    """
+    try:
+        resultado = realizar_operacoes_em_lote(
+            [operacao.model_dump() for operacao in lote.operacoes],
+            atomico=lote.modo == 'atomico'
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao processar lote de operações: {str(e)}"
+        )
+
+    return OperacoesLoteResponse(modo=lote.modo, **resultado)
+
+
+# ENDPOINTS DE EXPORTAÇÃO
+
+@app.get("/exportacoes/movimentos")
+def exportar(
+    data_inicio: datetime,
+    data_fim: datetime,
+    formato: Literal['csv', 'ndjson'] = 'csv',
+    gzip: bool = False
+):
+    """
+    Exporta todos os movimentos com data_hora em [data_inicio, data_fim)
+
+    A resposta é enviada em blocos à medida que as linhas são lidas do banco (cursor sem
+    buffer), então o consumo de memória não depende do tamanho do período.
+    """
+    try:
+        blocos = exportar_movimentos(data_inicio, data_fim, formato, gzip)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao iniciar exportação: {str(e)}"
+        )
+
+    arquivo = nome_arquivo(data_inicio, data_fim, formato, gzip)
+    return StreamingResponse(
+        blocos,
+        media_type="application/gzip" if gzip else FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{arquivo}"'}
+    )
+
+
+# ENDPOINTS DE EVENTOS DE SALDO
+
+@app.get("/carteiras/{endereco_carteira}/eventos", response_model=EventosResponse)
+async def eventos_saldo(
+    endereco_carteira: str,
+    request: Request,
+    cursor: Optional[str] = None,
+    espera: float = Query(EVENTOS_ESPERA_MAX, ge=0, le=EVENTOS_ESPERA_MAX),
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Aguarda alterações de saldo da carteira, no lugar de consultar os saldos em laço
+
+    Long-poll: responde assim que houver eventos depois do cursor, ou vazio após `espera`
+    segundos; o `cursor` da resposta é o da próxima chamada. Sem cursor, só eventos a partir
+    de agora. Com "Accept: text/event-stream" a resposta é um fluxo SSE, retomado pelo
+    cabeçalho Last-Event-ID na reconexão.
+    """
+    despachante = obter_despachante()
+    if despachante is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Carteira não encontrada"
+            detail="Eventos de saldo desativados"
         )
-    
+
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    try:
+        inicio = ler_cursor(last_event_id or cursor) if sse else ler_cursor(cursor)
+        if sse:
+            quadros = await abrir_fluxo_eventos(despachante, endereco_carteira, inicio)
+        else:
+            eventos, proximo = await aguardar_eventos(despachante, endereco_carteira, inicio, espera)
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao aguardar eventos: {str(e)}"
+        )
+
+    if sse:
+        return StreamingResponse(
+            quadros,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    return EventosResponse(
+        endereco_carteira=endereco_carteira,
+        eventos=[converter_evento(evento) for evento in eventos],
+        cursor=str(proximo)
+    )
+
+
+# ENDPOINTS DE MOEDAS
+
+# lista o catálogo de moedas carregado em memória
+@app.get("/moedas", response_model=list[MoedaResponse])
+def listar_moedas():
+    return [MoedaResponse(**vars(moeda)) for moeda in obter_catalogo()]
+
+# recarrega o catálogo a partir da tabela MOEDA (usar após cadastrar ou alterar moedas)
+# com ARMAZENAMENTO=memoria as moedas são as do livro e o catálogo atual é devolvido
+@app.post("/moedas/recarregar", response_model=list[MoedaResponse])
+def recarregar_moedas():
+    catalogo = obter_catalogo() if ARMAZENAMENTO == 'memoria' else recarregar_catalogo()
+    return [MoedaResponse(**vars(moeda)) for moeda in catalogo]
+
+
+# ENDPOINTS DE DEPÓSITOS
+# realiza depósito de um tipo de moeda
+@rotas.post("/carteiras/{endereco_carteira}/depositos", response_model=OperacaoResponse)
+def depositar(
+    endereco_carteira: str,
+    deposito: DepositoRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    # a existência da carteira é verificada dentro da transação do serviço
     try:
-        realizar_deposito(endereco_carteira, deposito.codigo_moeda, deposito.valor)
+        executar_idempotente(
+            idempotency_key,
+            impressao_requisicao('depositar', endereco_carteira, deposito.codigo_moeda, deposito.valor),
+            lambda idempotencia: realizar_deposito(
+                endereco_carteira, deposito.codigo_moeda, deposito.valor, idempotencia
+            )
+        )
         
         return OperacaoResponse(
             sucesso=True,
@@ -92,6 +462,16 @@ def depositar(endereco_carteira: str, deposito: DepositoRequest):
                 "valor": float(deposito.valor)
             }
         )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -101,23 +481,26 @@ def depositar(endereco_carteira: str, deposito: DepositoRequest):
 
 # ENDPOINTS DE SAQUES
 
-@app.post("/carteiras/{endereco_carteira}/saques", response_model=OperacaoResponse)
-def sacar(endereco_carteira: str, saque: SaqueRequest):
+@rotas.post("/carteiras/{endereco_carteira}/saques", response_model=OperacaoResponse)
+def sacar(
+    endereco_carteira: str,
+    saque: SaqueRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
     """
     Realiza um saque de uma moeda específica
     
     Exige autenticação por chave privada e cobra taxa
     """
-    # Verificar se carteira existe
-    carteira = obter_carteira(endereco_carteira)
-    if not carteira:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Carteira não encontrada"
-        )
-    
+    # a existência da carteira é verificada dentro da transação do serviço
     try:
-        realizar_saque(endereco_carteira, saque.codigo_moeda, saque.valor, saque.chave_privada)
+        executar_idempotente(
+            idempotency_key,
+            impressao_requisicao('sacar', endereco_carteira, saque.codigo_moeda, saque.valor, saque.chave_privada),
+            lambda idempotencia: realizar_saque(
+                endereco_carteira, saque.codigo_moeda, saque.valor, saque.chave_privada, idempotencia
+            )
+        )
         
         return OperacaoResponse(
             sucesso=True,
@@ -128,6 +511,16 @@ def sacar(endereco_carteira: str, saque: SaqueRequest):
                 "valor": float(saque.valor)
             }
         )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -142,28 +535,68 @@ def sacar(endereco_carteira: str, saque: SaqueRequest):
 
 # ENDPOINTS DE CONVERSÃO
 
-@app.post("/carteiras/{endereco_carteira}/conversoes", response_model=OperacaoResponse)
-def converter_moeda(endereco_carteira: str, conversao: ConversaoRequest):
+@rotas.post("/carteiras/{endereco_carteira}/conversoes/cotacao", response_model=CotacaoConversaoResponse)
+def cotar_moeda(endereco_carteira: str, pedido: CotacaoConversaoRequest):
     """
-    Realiza conversão entre duas moedas
-    
-    Usa cotação da API da Coinbase, exige autenticação e cobra taxa
+    Trava a cotação e a taxa de uma conversão por COTACAO_TRAVADA_TTL segundos
+
+    A conversão que enviar o `id_cotacao` retornado (com as mesmas moedas e valor) usa
+    esses valores, sem consultar o provedor de cotações.
     """
-    # Verificar se carteira existe
-    carteira = obter_carteira(endereco_carteira)
-    if not carteira:
+    try:
+        resultado = cotar_conversao(
+            endereco_carteira,
+            pedido.codigo_origem,
+            pedido.codigo_destino,
+            pedido.valor
+        )
+        return CotacaoConversaoResponse(**resultado)
+    except CarteiraNaoEncontradaError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Carteira não encontrada"
+            detail=str(e)
         )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao cotar conversão: {str(e)}"
+        )
+
+
+@rotas.post("/carteiras/{endereco_carteira}/conversoes", response_model=OperacaoResponse)
+def converter_moeda(
+    endereco_carteira: str,
+    conversao: ConversaoRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    """
+    Realiza conversão entre duas moedas
     
+    Usa cotação da API da Coinbase, exige autenticação e cobra taxa. Com `id_cotacao`,
+    usa a cotação e a taxa travadas em POST .../conversoes/cotacao
+    """
+    # a existência da carteira é verificada dentro da transação do serviço
     try:
-        resultado = realizar_conversao(
-            endereco_carteira,
-            conversao.codigo_origem,
-            conversao.codigo_destino,
-            conversao.valor,
-            conversao.chave_privada
+        resultado = executar_idempotente(
+            idempotency_key,
+            impressao_requisicao(
+                'converter', endereco_carteira, conversao.codigo_origem, conversao.codigo_destino, conversao.valor,
+                conversao.chave_privada, conversao.id_cotacao
+            ),
+            lambda idempotencia: realizar_conversao(
+                endereco_carteira,
+                conversao.codigo_origem,
+                conversao.codigo_destino,
+                conversao.valor,
+                conversao.chave_privada,
+                conversao.id_cotacao,
+                idempotencia
+            )
         )
         
         return OperacaoResponse(
@@ -171,6 +604,16 @@ def converter_moeda(endereco_carteira: str, conversao: ConversaoRequest):
             mensagem=f"Conversão de {conversao.codigo_origem} para {conversao.codigo_destino} realizada com sucesso",
             dados=resultado
         )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -185,28 +628,33 @@ def converter_moeda(endereco_carteira: str, conversao: ConversaoRequest):
 
 # ENDPOINTS DE TRANSFERÊNCIA
 
-@app.post("/carteiras/{endereco_origem}/transferencias", response_model=OperacaoResponse)
-def transferir(endereco_origem: str, transferencia: TransferenciaRequest):
+@rotas.post("/carteiras/{endereco_origem}/transferencias", response_model=OperacaoResponse)
+def transferir(
+    endereco_origem: str,
+    transferencia: TransferenciaRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
     """
     Realiza transferência de valor entre carteiras
     
     Exige autenticação da carteira de origem e cobra taxa
     """
-    # Verificar se carteira origem existe
-    carteira_origem = obter_carteira(endereco_origem)
-    if not carteira_origem:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Carteira de origem não encontrada"
-        )
-    
+    # a existência da carteira de origem é verificada dentro da transação do serviço
     try:
-        realizar_transferencia(
-            endereco_origem,
-            transferencia.endereco_destino,
-            transferencia.codigo_moeda,
-            transferencia.valor,
-            transferencia.chave_privada
+        executar_idempotente(
+            idempotency_key,
+            impressao_requisicao(
+                'transferir', endereco_origem, transferencia.endereco_destino, transferencia.codigo_moeda,
+                transferencia.valor, transferencia.chave_privada
+            ),
+            lambda idempotencia: realizar_transferencia(
+                endereco_origem,
+                transferencia.endereco_destino,
+                transferencia.codigo_moeda,
+                transferencia.valor,
+                transferencia.chave_privada,
+                idempotencia
+            )
         )
         
         return OperacaoResponse(
@@ -219,6 +667,16 @@ def transferir(endereco_origem: str, transferencia: TransferenciaRequest):
                 "valor": float(transferencia.valor)
             }
         )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -249,3 +707,18 @@ def health_check():
     Endpoint de health check
     """
     return {"status": "healthy"}
+
+
+# métricas do processo no formato texto do Prometheus
+@app.get("/metrics", include_in_schema=False)
+def metricas():
+    return PlainTextResponse(registro.exportar(), media_type="text/plain; version=0.0.4")
+
+
+# modo de execução das operações de carteira (sync ou async), para comparar os dois em benchmarks
+# o livro em memória não faz E/S de banco: usa sempre as rotas síncronas
+if API_MODO == 'async' and ARMAZENAMENTO != 'memoria':
+    from app.rotas_async import rotas as rotas_async
+    app.include_router(rotas_async)
+else:
+    app.include_router(rotas)
@@ -0,0 +1,199 @@
+"""
+Módulo de Métricas
+Contadores e histogramas em memória, por processo, e o registro exportado em GET /metrics
+(formato texto do Prometheus)
+"""
+import bisect
+import math
+import threading
+
+
+class Contador:
+    """Contador que só cresce"""
+
+    def __init__(self):
+        self._valor = 0
+        self._lock = threading.Lock()
+
+    def incrementar(self, quantidade=1):
+        with self._lock:
+            self._valor += quantidade
+
+    @property
+    def valor(self):
+        return self._valor
+
+
+class Histograma:
+    """
+    Histograma de baldes fixos
+
+    `limites` são os limites superiores dos baldes, em ordem crescente; valores acima
+    do último caem no balde +Inf. Guarda também a soma e a contagem das observações.
+    """
+
+    def __init__(self, limites):
+        self.limites = tuple(sorted(limites))
+        self._baldes = [0] * (len(self.limites) + 1)
+        self._soma = 0.0
+        self._contagem = 0
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        indice = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            self._baldes[indice] += 1
+            self._soma += valor
+            self._contagem += 1
+
+    def estatisticas(self):
+        with self._lock:
+            baldes = list(self._baldes)
+            soma = self._soma
+            contagem = self._contagem
+
+        acumulado = 0
+        cumulativos = {}
+        for limite, quantidade in zip(self.limites + (float('inf'),), baldes):
+            acumulado += quantidade
+            cumulativos[limite] = acumulado
+        return {
+            'contagem': contagem,
+            'soma': soma,
+            'media': soma / contagem if contagem else 0.0,
+            'baldes': cumulativos,  # limite -> observações <= limite
+        }
+
+
+# LIMITES PADRÃO (segundos)
+LIMITES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_QUERY = (0.0002, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+
+class Familia:
+    """
+    Métrica com rótulos: um Contador ou Histograma por combinação de valores dos rótulos
+
+    familia.com('GET', '/moedas') devolve (criando na primeira vez) a métrica daquela combinação.
+    Os valores dos rótulos devem vir de um conjunto pequeno (rotas, nomes de query), nunca de
+    endereços ou outros dados da requisição.
+    """
+
+    def __init__(self, nome, tipo, ajuda, rotulos, criar):
+        self.nome = nome
+        self.tipo = tipo
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._criar = criar
+        self._filhos = {}
+        self._lock = threading.Lock()
+
+    def com(self, *valores):
+        filho = self._filhos.get(valores)
+        if filho is None:
+            with self._lock:
+                filho = self._filhos.get(valores)
+                if filho is None:
+                    filho = self._criar()
+                    self._filhos[valores] = filho
+        return filho
+
+    def amostras(self):
+        with self._lock:
+            filhos = list(self._filhos.items())
+        for valores, filho in filhos:
+            rotulos = dict(zip(self.rotulos, valores))
+            yield rotulos, filho.estatisticas() if self.tipo == 'histogram' else filho.valor
+
+
+class Registro:
+    """
+    Registro das métricas do processo
+
+    - contador() e histograma() criam famílias atualizadas pelo código a cada evento
+    - coletor(funcao) registra uma função chamada a cada exportação, para números que já são
+      mantidos em outro lugar (pool, caches); ela retorna uma lista de
+      (nome, tipo, ajuda, [(rotulos, valor), ...]), com tipo 'counter', 'gauge' ou 'histogram'
+      (valor de histograma no formato de Histograma.estatisticas())
+    """
+
+    def __init__(self):
+        self._familias = {}
+        self._coletores = []
+        self._lock = threading.Lock()
+
+    def _familia(self, nome, tipo, ajuda, rotulos, criar):
+        with self._lock:
+            if nome not in self._familias:
+                self._familias[nome] = Familia(nome, tipo, ajuda, rotulos, criar)
+            return self._familias[nome]
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._familia(nome, 'counter', ajuda, rotulos, Contador)
+
+    def histograma(self, nome, ajuda, limites, rotulos=()):
+        return self._familia(nome, 'histogram', ajuda, rotulos, lambda: Histograma(limites))
+
+    def coletor(self, funcao):
+        with self._lock:
+            self._coletores.append(funcao)
+        return funcao
+
+    def exportar(self):
+        with self._lock:
+            familias = list(self._familias.values())
+            coletores = list(self._coletores)
+
+        # o formato exige as amostras de um nome juntas: coletores diferentes podem emitir o
+        # mesmo nome (ex. pool síncrono e assíncrono), então agrupa antes de escrever
+        agrupadas = {}
+        for familia in familias:
+            agrupadas[familia.nome] = (familia.tipo, familia.ajuda, list(familia.amostras()))
+        for coletor in coletores:
+            for nome, tipo, ajuda, amostras in coletor():
+                if nome in agrupadas:
+                    agrupadas[nome][2].extend(amostras)
+                else:
+                    agrupadas[nome] = (tipo, ajuda, list(amostras))
+
+        linhas = []
+        for nome, (tipo, ajuda, amostras) in agrupadas.items():
+            _escrever(linhas, nome, tipo, ajuda, amostras)
+        return "\n".join(linhas) + "\n"
+
+
+# FORMATO TEXTO DO PROMETHEUS
+
+def _numero(valor):
+    if isinstance(valor, bool):
+        return '1' if valor else '0'
+    if isinstance(valor, float):
+        if math.isinf(valor):
+            return '+Inf' if valor > 0 else '-Inf'
+        return repr(valor)
+    return str(valor)
+
+def _rotulos(rotulos):
+    if not rotulos:
+        return ''
+    pares = []
+    for nome, valor in rotulos.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{nome}="{valor}"')
+    return '{' + ','.join(pares) + '}'
+
+def _escrever(linhas, nome, tipo, ajuda, amostras):
+    linhas.append(f"# HELP {nome} {ajuda}")
+    linhas.append(f"# TYPE {nome} {tipo}")
+    for rotulos, valor in amostras:
+        if tipo != 'histogram':
+            linhas.append(f"{nome}{_rotulos(rotulos)} {_numero(valor)}")
+            continue
+        for limite, acumulado in valor['baldes'].items():
+            linhas.append(f"{nome}_bucket{_rotulos({**rotulos, 'le': _numero(float(limite))})} {acumulado}")
+        linhas.append(f"{nome}_sum{_rotulos(rotulos)} {_numero(valor['soma'])}")
+        linhas.append(f"{nome}_count{_rotulos(rotulos)} {valor['contagem']}")
+
+
+# registro do processo, exportado em GET /metrics
+registro = Registro()
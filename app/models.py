@@ -2,9 +2,10 @@
 Define os modelos Pydantic para validação de entrada e saída da API
 """
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Literal, Optional
 from datetime import datetime
 from decimal import Decimal
+from app.config import LOTE_CARTEIRAS_MAX, LOTE_OPERACOES_MAX
 
 
 # Modelos de Resposta
@@ -25,7 +26,51 @@ class SaldosResponse(BaseModel):
     saldos: list[SaldoMoedaResponse]
 
 
+TipoMovimento = Literal['DEPOSITO', 'SAQUE', 'CONVERSAO', 'TRANSFERENCIA_ENVIADA', 'TRANSFERENCIA_RECEBIDA']
+
+class MovimentoExtratoResponse(BaseModel):
+    tipo: TipoMovimento
+    id: int
+    data_hora: datetime
+    codigo_moeda: str  # moeda de origem, na conversão
+    valor: Decimal
+    taxa_valor: Decimal
+    codigo_moeda_destino: Optional[str] = None  # Apenas conversão
+    valor_destino: Optional[Decimal] = None     # Apenas conversão
+    cotacao: Optional[Decimal] = None           # Apenas conversão
+    contraparte: Optional[str] = None           # Apenas transferência
+
+class ExtratoResponse(BaseModel):
+    endereco_carteira: str
+    movimentos: list[MovimentoExtratoResponse]
+    proximo_cursor: Optional[str] = None  # None na última página
+
+
+class EventoSaldoResponse(BaseModel):
+    cursor: str  # id do evento; retoma a leitura logo depois dele
+    tipo: TipoMovimento
+    codigo_moeda: str
+    variacao: Decimal  # negativa nos débitos (valor + taxa)
+    data_hora: datetime
+
+class EventosResponse(BaseModel):
+    endereco_carteira: str
+    eventos: list[EventoSaldoResponse]
+    cursor: str  # cursor da próxima espera, mesmo sem eventos
+
+
+class MoedaResponse(BaseModel):
+    id_moeda: int
+    codigo: str
+    string: str
+    tipo: str
+
+
 # Modelos de Requisição
+class LoteCarteirasRequest(BaseModel):
+    quantidade: int = Field(..., gt=0, le=LOTE_CARTEIRAS_MAX, description="Número de carteiras a criar")
+
+
 class DepositoRequest(BaseModel):
     codigo_moeda: str = Field(..., description="Código da moeda (BTC, ETH, SOL, USD, BRL)")
     valor: Decimal = Field(..., gt=0, description="Valor do depósito (deve ser maior que 0)")
@@ -37,11 +82,20 @@ class SaqueRequest(BaseModel):
     chave_privada: str = Field(..., description="Chave privada para autenticação")
 
 
+class CotacaoConversaoRequest(BaseModel):
+    codigo_origem: str = Field(..., description="Código da moeda de origem")
+    codigo_destino: str = Field(..., description="Código da moeda de destino")
+    valor: Decimal = Field(..., gt=0, description="Valor a ser convertido")
+
+
 class ConversaoRequest(BaseModel):
     codigo_origem: str = Field(..., description="Código da moeda de origem")
     codigo_destino: str = Field(..., description="Código da moeda de destino")
     valor: Decimal = Field(..., gt=0, description="Valor a ser convertido")
     chave_privada: str = Field(..., description="Chave privada para autenticação")
+    id_cotacao: Optional[str] = Field(
+        None, description="Cotação travada (POST .../conversoes/cotacao) com as mesmas moedas e valor; sem ela, a cotação do momento"
+    )
 
 
 class TransferenciaRequest(BaseModel):
@@ -51,8 +105,49 @@ class TransferenciaRequest(BaseModel):
     chave_privada: str = Field(..., description="Chave privada para autenticação")
 
 
+class OperacaoLoteItem(BaseModel):
+    tipo: Literal['DEPOSITO', 'SAQUE', 'TRANSFERENCIA'] = Field(..., description="Tipo da operação")
+    endereco_carteira: str = Field(..., description="Carteira da operação (origem, na transferência)")
+    endereco_destino: Optional[str] = Field(None, description="Carteira de destino (apenas transferência)")
+    codigo_moeda: str = Field(..., description="Código da moeda")
+    valor: Decimal = Field(..., gt=0, description="Valor da operação")
+    chave_privada: Optional[str] = Field(None, description="Chave privada (saque e transferência)")
+
+
+class OperacoesLoteRequest(BaseModel):
+    modo: Literal['atomico', 'melhor_esforco'] = Field(
+        'atomico', description="atomico: tudo ou nada; melhor_esforco: aplica as operações válidas"
+    )
+    operacoes: list[OperacaoLoteItem] = Field(..., min_length=1, max_length=LOTE_OPERACOES_MAX)
+
+
 # Modelos de Resposta de Operações
 class OperacaoResponse(BaseModel):
     sucesso: bool
     mensagem: str
     dados: Optional[dict] = None
+
+
+class CotacaoConversaoResponse(BaseModel):
+    id_cotacao: str  # enviado em ConversaoRequest.id_cotacao até expira_em
+    codigo_origem: str
+    codigo_destino: str
+    valor: Decimal
+    cotacao: Decimal
+    taxa_percentual: Decimal
+    taxa_valor: Decimal
+    valor_destino: Decimal
+    expira_em: datetime
+
+
+class ResultadoOperacaoLote(BaseModel):
+    indice: int
+    sucesso: bool
+    mensagem: str
+
+
+class OperacoesLoteResponse(BaseModel):
+    sucesso: bool
+    modo: str
+    aplicadas: int
+    resultados: list[ResultadoOperacaoLote]
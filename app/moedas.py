@@ -0,0 +1,96 @@
+"""
+Módulo do Catálogo de Moedas
+Mantém em memória a tabela MOEDA, carregada na inicialização da API
+"""
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from app.database import execute_query
+from app.database_async import execute_query_async
+
+
+@dataclass(frozen=True)
+class Moeda:
+    id_moeda: int
+    codigo: str
+    string: str
+    tipo: str
+
+
+class CatalogoMoedas:
+    """
+    Catálogo imutável de moedas (código -> id, nome e tipo)
+
+    Para atualizar, um novo catálogo é carregado e substitui o anterior por inteiro,
+    então quem já tem uma referência nunca vê um catálogo pela metade.
+    """
+
+    def __init__(self, moedas):
+        moedas = sorted(moedas, key=lambda moeda: moeda.codigo)
+        self._por_codigo = MappingProxyType({moeda.codigo: moeda for moeda in moedas})
+        self._por_id = MappingProxyType({moeda.id_moeda: moeda for moeda in moedas})
+        self._posicao = MappingProxyType({moeda.id_moeda: posicao for posicao, moeda in enumerate(moedas)})
+        self.moedas = tuple(moedas)
+
+    def obter(self, codigo):
+        if not codigo:
+            return None
+        return self._por_codigo.get(codigo.upper())
+
+    def por_id(self, id_moeda):
+        return self._por_id.get(id_moeda)
+
+    def posicao(self, id_moeda):
+        """Índice da moeda em `moedas` (ordem por código), para estruturas indexadas por moeda"""
+        return self._posicao.get(id_moeda)
+
+    def validar(self, codigo):
+        """Retorna a moeda do código informado ou levanta ValueError"""
+        moeda = self.obter(codigo)
+        if moeda is None:
+            raise ValueError(f"Moeda {codigo} não encontrada")
+        return moeda
+
+    def __contains__(self, codigo):
+        return self.obter(codigo) is not None
+
+    def __iter__(self):
+        return iter(self.moedas)
+
+    def __len__(self):
+        return len(self.moedas)
+
+
+_catalogo = None
+_lock = threading.Lock()
+
+SQL_MOEDAS = "SELECT /* listar_moedas */ id_moeda, codigo, string, tipo FROM MOEDA"
+
+def _substituir_catalogo(linhas):
+    global _catalogo
+    novo = CatalogoMoedas(
+        Moeda(linha['id_moeda'], linha['codigo'], linha['string'], linha['tipo'])
+        for linha in linhas
+    )
+    with _lock:
+        _catalogo = novo
+    return novo
+
+# substitui o catálogo por moedas que não vêm da tabela MOEDA (livro em memória, ARMAZENAMENTO=memoria)
+def definir_catalogo(linhas):
+    return _substituir_catalogo(linhas)
+
+# lê a tabela MOEDA e substitui o catálogo em memória
+def recarregar_catalogo():
+    return _substituir_catalogo(execute_query(SQL_MOEDAS))
+
+# mesma carga, pelo pool assíncrono (modo API_MODO=async)
+async def recarregar_catalogo_async():
+    return _substituir_catalogo(await execute_query_async(SQL_MOEDAS))
+
+# catálogo atual; carrega na primeira utilização se a inicialização ainda não o fez
+def obter_catalogo():
+    catalogo = _catalogo
+    if catalogo is None:
+        catalogo = recarregar_catalogo()
+    return catalogo
@@ -0,0 +1,197 @@
+"""
+Módulo de Perfilamento por Requisição
+Executa requisições escolhidas sob o cProfile, sem reiniciar a API
+
+- cabeçalho `X-Perfil: <PERFIL_TOKEN>` perfila aquela requisição; com `X-Perfil-Formato: texto`
+  o relatório volta no lugar da resposta, senão o perfil é gravado em PERFIL_DIRETORIO e o nome
+  do arquivo vem no cabeçalho X-Perfil-Arquivo
+- PERFIL_AMOSTRAGEM sorteia uma fração das requisições; os perfis sorteados só são gravados se
+  a requisição passar de PERFIL_LIMIAR_MS, para pegar os casos lentos sem guardar todos
+
+Um perfil por vez em cada processo: enquanto um está em andamento, as outras requisições passam
+sem perfilar. Os arquivos .prof abrem com `python -m pstats arquivo` ou snakeviz.
+"""
+import cProfile
+import functools
+import hmac
+import inspect
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from app.config import PERFIL_TOKEN, PERFIL_AMOSTRAGEM, PERFIL_LIMIAR_MS, PERFIL_DIRETORIO, PERFIL_LINHAS
+from app.metricas import registro
+
+# perfil da requisição em andamento; o contexto acompanha a requisição até o pool de threads
+# onde rodam os endpoints síncronos
+_perfil_atual = ContextVar('perfil_atual', default=None)
+_em_andamento = threading.Lock()
+
+_perfis = registro.contador(
+    'carteira_perfis_total', "Requisições perfiladas por origem e destino do perfil", ('origem', 'destino')
+)
+
+
+class Perfil:
+    """cProfile de uma requisição, ligado só enquanto o endpoint executa"""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def executar(self, funcao, *args, **kwargs):
+        self.profiler.enable()
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            self.profiler.disable()
+
+    async def executar_async(self, funcao, *args, **kwargs):
+        # em endpoints async entram também as corrotinas de outras requisições que rodarem
+        # no event loop enquanto esta aguarda
+        self.profiler.enable()
+        try:
+            return await funcao(*args, **kwargs)
+        finally:
+            self.profiler.disable()
+
+    def relatorio(self, titulo, linhas=PERFIL_LINHAS):
+        saida = io.StringIO()
+        saida.write(titulo + "\n\n")
+        estatisticas = pstats.Stats(self.profiler, stream=saida)
+        saida.write("Funções do projeto (app/) por tempo acumulado\n")
+        estatisticas.sort_stats('cumulative').print_stats(r'[/\\]app[/\\]', linhas)
+        saida.write("Funções por tempo próprio\n")
+        estatisticas.sort_stats('tottime').print_stats(linhas)
+        return saida.getvalue()
+
+    def gravar(self, caminho):
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        self.profiler.dump_stats(caminho)
+
+
+def perfilavel(endpoint):
+    """Envolve o endpoint para rodar sob o perfil da requisição, quando houver um"""
+    if getattr(endpoint, '_perfilavel', False):
+        return endpoint
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def executar(*args, **kwargs):
+            perfil = _perfil_atual.get()
+            if perfil is None:
+                return await endpoint(*args, **kwargs)
+            return await perfil.executar_async(endpoint, *args, **kwargs)
+    else:
+        @functools.wraps(endpoint)
+        def executar(*args, **kwargs):
+            perfil = _perfil_atual.get()
+            if perfil is None:
+                return endpoint(*args, **kwargs)
+            return perfil.executar(endpoint, *args, **kwargs)
+
+    executar._perfilavel = True
+    return executar
+
+
+class RotaPerfilavel(APIRoute):
+    """Rota cujo endpoint pode ser perfilado (route_class dos routers da API)"""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, perfilavel(endpoint), **kwargs)
+
+
+def _cabecalho(scope, nome):
+    for chave, valor in scope['headers']:
+        if chave == nome:
+            return valor
+    return None
+
+def _origem(scope):
+    if PERFIL_TOKEN:
+        token = _cabecalho(scope, b'x-perfil')
+        if token is not None and hmac.compare_digest(token, PERFIL_TOKEN.encode()):
+            return 'cabecalho'
+    if PERFIL_AMOSTRAGEM > 0 and random.random() < PERFIL_AMOSTRAGEM:
+        return 'amostragem'
+    return None
+
+
+class PerfilarRequisicoes:
+    """Middleware ASGI que decide quais requisições perfilar e entrega o resultado"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        origem = _origem(scope)
+        if origem is None or not _em_andamento.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self._perfilar(scope, receive, send, origem)
+        finally:
+            _em_andamento.release()
+
+    async def _perfilar(self, scope, receive, send, origem):
+        perfil = Perfil()
+        em_texto = origem == 'cabecalho' and _cabecalho(scope, b'x-perfil-formato') == b'texto'
+        arquivo = None
+        status_resposta = 500
+        async def enviar(mensagem):
+            nonlocal arquivo, status_resposta
+            if mensagem['type'] == 'http.response.start':
+                status_resposta = mensagem['status']
+                if em_texto:
+                    return
+                # o roteador já preencheu scope['endpoint']: o nome do arquivo sai antes da resposta
+                arquivo = f"{datetime.now():%Y%m%d-%H%M%S-%f}_{_nome_endpoint(scope)}.prof"
+                if origem == 'cabecalho':
+                    mensagem = {**mensagem, 'headers': [*mensagem.get('headers', []), (b'x-perfil-arquivo', arquivo.encode())]}
+            elif em_texto:
+                # a resposta original é descartada; o relatório vai no lugar dela
+                return
+            await send(mensagem)
+
+        inicio = time.perf_counter()
+        token = _perfil_atual.set(perfil)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _perfil_atual.reset(token)
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+
+        if em_texto:
+            titulo = f"{scope['method']} {_nome_endpoint(scope)} -> {status_resposta} em {duracao_ms:.1f} ms"
+            corpo = (await run_in_threadpool(perfil.relatorio, titulo)).encode()
+            await send({
+                'type': 'http.response.start',
+                'status': status_resposta,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8'), (b'content-length', str(len(corpo)).encode())],
+            })
+            await send({'type': 'http.response.body', 'body': corpo})
+            _perfis.com(origem, 'texto').incrementar()
+            return
+
+        if arquivo is None or (origem == 'amostragem' and duracao_ms < PERFIL_LIMIAR_MS):
+            _perfis.com(origem, 'descartado').incrementar()
+            return
+        try:
+            await run_in_threadpool(perfil.gravar, os.path.join(PERFIL_DIRETORIO, arquivo))
+        except OSError:
+            # a resposta já foi enviada; a falha aparece só na métrica
+            _perfis.com(origem, 'erro').incrementar()
+            return
+        _perfis.com(origem, 'gravado').incrementar()
+
+
+def _nome_endpoint(scope):
+    return getattr(scope.get('endpoint'), '__name__', 'desconhecida')
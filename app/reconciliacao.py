@@ -0,0 +1,362 @@
+"""
+Módulo de Reconciliação de Saldos
+Confere SALDO_CARTEIRA (mais os slots das carteiras quentes) contra a soma dos movimentos de
+DEPOSITO_SAQUE, CONVERSAO e TRANSFERENCIA, sem refazer a soma do histórico a cada execução
+
+- RECONCILIACAO_MARCA guarda o último id somado de cada tabela; cada execução soma só os
+  movimentos novos em RECONCILIACAO_TOTAL, em blocos de RECONCILIACAO_BLOCO ids, no servidor
+- movimentos com menos de RECONCILIACAO_ATRASO segundos ficam para a próxima execução: um id
+  menor que o deles ainda pode estar em uma transação aberta, e a marca não pode pular um id
+- a comparação confere, em um instante consistente do banco, só os totais alterados desde a
+  última execução e os que já estavam divergentes; --completa confere todos os saldos
+
+Uso pela linha de comando (sai com código 1 quando há divergência, para agendar no cron):
+    python -m app.reconciliacao [--completa] [--max-movimentos N] [--saida relatorio.json]
+"""
+import argparse
+import json
+import sys
+from decimal import Decimal
+from app.config import (
+    ARMAZENAMENTO, RECONCILIACAO_ATRASO, RECONCILIACAO_BLOCO, RECONCILIACAO_COMPARACAO, RECONCILIACAO_TOLERANCIA
+)
+from app.database import get_connection, repetir_em_conflito, transacao
+from app.moedas import obter_catalogo
+
+# variação de saldo por carteira e moeda dos movimentos com id no intervalo (inicio, fim], com as
+# regras de app/services.py: saques e transferências debitam valor + taxa, conversões debitam
+# valor_origem e creditam valor_destino
+TABELAS = {
+    'DEPOSITO_SAQUE': ('id_movimento', 1, """
+        SELECT /* reconciliacao_variacoes */ endereco_carteira, id_moeda,
+               SUM(CASE tipo WHEN 'DEPOSITO' THEN valor ELSE -(valor + COALESCE(taxa_valor, 0)) END) AS variacao
+        FROM DEPOSITO_SAQUE
+        WHERE id_movimento > %s AND id_movimento <= %s
+        GROUP BY endereco_carteira, id_moeda
+    """),
+    'CONVERSAO': ('id_conversao', 2, """
+        SELECT /* reconciliacao_variacoes */ endereco_carteira, id_moeda, SUM(variacao) AS variacao
+        FROM (
+            SELECT endereco_carteira, id_moeda_origem AS id_moeda, -valor_origem AS variacao
+            FROM CONVERSAO
+            WHERE id_conversao > %s AND id_conversao <= %s
+            UNION ALL
+            SELECT endereco_carteira, id_moeda_destino, valor_destino
+            FROM CONVERSAO
+            WHERE id_conversao > %s AND id_conversao <= %s
+        ) AS movimentos
+        GROUP BY endereco_carteira, id_moeda
+    """),
+    'TRANSFERENCIA': ('id_transferencia', 2, """
+        SELECT /* reconciliacao_variacoes */ endereco_carteira, id_moeda, SUM(variacao) AS variacao
+        FROM (
+            SELECT endereco_origem AS endereco_carteira, id_moeda, -(valor + taxa_valor) AS variacao
+            FROM TRANSFERENCIA
+            WHERE id_transferencia > %s AND id_transferencia <= %s
+            UNION ALL
+            SELECT endereco_destino, id_moeda, valor
+            FROM TRANSFERENCIA
+            WHERE id_transferencia > %s AND id_transferencia <= %s
+        ) AS movimentos
+        GROUP BY endereco_carteira, id_moeda
+    """),
+}
+
+_ULTIMO_ID = 2 ** 63 - 1
+
+# uma reconciliação por vez no banco: duas somando o mesmo bloco contariam os movimentos em dobro
+_NOME_TRAVA = 'carteira_reconciliacao'
+
+SQL_CRIAR_MARCA = """
+    INSERT /* reconciliacao_criar_marca */ IGNORE INTO RECONCILIACAO_MARCA (tabela)
+    VALUES (%s)
+"""
+
+SQL_TRAVAR_MARCA = """
+    SELECT /* reconciliacao_travar_marca */ ultimo_id
+    FROM RECONCILIACAO_MARCA
+    WHERE tabela = %s
+    FOR UPDATE
+"""
+
+SQL_AVANCAR_MARCA = """
+    UPDATE /* reconciliacao_avancar_marca */ RECONCILIACAO_MARCA
+    SET ultimo_id = %s
+    WHERE tabela = %s
+"""
+
+SQL_MARCAS = """
+    SELECT /* reconciliacao_marcas */ tabela, ultimo_id
+    FROM RECONCILIACAO_MARCA
+"""
+
+SQL_CORTE = "SELECT /* reconciliacao_corte */ NOW() - INTERVAL %s SECOND AS corte"
+
+# totais a conferir, com o saldo da carteira (linha principal mais slots) na mesma linha
+_SQL_COMPARAR = """
+    SELECT /* reconciliacao_{nome} */ {origem}.endereco_carteira, {origem}.id_moeda, COALESCE(t.total, 0) AS total,
+           sc.saldo + COALESCE((
+               SELECT SUM(ss.saldo)
+               FROM SALDO_CARTEIRA_SLOT ss
+               WHERE ss.endereco_carteira = {origem}.endereco_carteira AND ss.id_moeda = {origem}.id_moeda
+           ), 0) AS saldo
+    FROM {de}
+    WHERE {filtro}({origem}.endereco_carteira > %s OR ({origem}.endereco_carteira = %s AND {origem}.id_moeda > %s))
+    ORDER BY {origem}.endereco_carteira, {origem}.id_moeda
+    LIMIT %s
+"""
+
+SQL_COMPARAR_PENDENTES = _SQL_COMPARAR.format(
+    nome='comparar_pendentes', origem='t', filtro='t.pendente = TRUE AND ',
+    de="""RECONCILIACAO_TOTAL t
+    LEFT JOIN SALDO_CARTEIRA sc ON sc.endereco_carteira = t.endereco_carteira AND sc.id_moeda = t.id_moeda"""
+)
+
+SQL_COMPARAR_TODOS = _SQL_COMPARAR.format(
+    nome='comparar_todos', origem='sc', filtro='',
+    de="""SALDO_CARTEIRA sc
+    LEFT JOIN RECONCILIACAO_TOTAL t ON t.endereco_carteira = sc.endereco_carteira AND t.id_moeda = sc.id_moeda"""
+)
+
+SQL_MARCAR_DIVERGENTE = """
+    INSERT /* reconciliacao_marcar_divergente */ INTO RECONCILIACAO_TOTAL (endereco_carteira, id_moeda, pendente)
+    VALUES (%s, %s, TRUE)
+    ON DUPLICATE KEY UPDATE pendente = TRUE
+"""
+
+def sql_ids(tabela, coluna):
+    return f"""
+        SELECT /* reconciliacao_ids */ {coluna} AS id, data_hora
+        FROM {tabela}
+        WHERE {coluna} > %s
+        ORDER BY {coluna}
+        LIMIT %s
+    """
+
+# soma as variações do bloco nos totais e marca os totais alterados para a comparação
+def sql_somar(variacoes):
+    return f"""
+        INSERT /* reconciliacao_somar */ INTO RECONCILIACAO_TOTAL (endereco_carteira, id_moeda, total)
+        SELECT * FROM ({variacoes}) AS novas
+        ON DUPLICATE KEY UPDATE total = total + novas.variacao, pendente = TRUE
+    """
+
+def sql_limpar_pendentes(quantidade):
+    marcadores = ", ".join(["(%s, %s)"] * quantidade)
+    return f"""
+        UPDATE /* reconciliacao_limpar_pendentes */ RECONCILIACAO_TOTAL
+        SET pendente = FALSE
+        WHERE pendente = TRUE AND (endereco_carteira, id_moeda) IN ({marcadores})
+    """
+
+
+# SOMA DOS MOVIMENTOS
+
+@repetir_em_conflito
+def _somar_bloco(tabela, tamanho_bloco, atraso):
+    """
+    Soma o próximo bloco de movimentos da tabela e avança a marca na mesma transação
+
+    Retorna (movimentos somados, marca, em_dia); em_dia indica que não há movimentos
+    anteriores ao corte além dos somados.
+    """
+    coluna, partes, variacoes = TABELAS[tabela]
+    with transacao() as cursor:
+        cursor.execute(SQL_TRAVAR_MARCA, (tabela,))
+        inicio = cursor.fetchone()['ultimo_id']
+        cursor.execute(SQL_CORTE, (atraso,))
+        corte = cursor.fetchone()['corte']
+        cursor.execute(sql_ids(tabela, coluna), (inicio, tamanho_bloco))
+        linhas = cursor.fetchall()
+
+        # para no primeiro movimento recente: ids seguintes podem ter vizinhos ainda não confirmados
+        fim, quantidade = inicio, 0
+        for linha in linhas:
+            if linha['data_hora'] > corte:
+                break
+            fim, quantidade = linha['id'], quantidade + 1
+        em_dia = quantidade < tamanho_bloco
+
+        if quantidade:
+            cursor.execute(sql_somar(variacoes), (inicio, fim) * partes)
+            cursor.execute(SQL_AVANCAR_MARCA, (fim, tabela))
+    return quantidade, fim, em_dia
+
+def somar_movimentos(tabela, tamanho_bloco=RECONCILIACAO_BLOCO, atraso=RECONCILIACAO_ATRASO, max_movimentos=None):
+    """Soma os movimentos novos da tabela até alcançar o corte ou `max_movimentos`"""
+    with transacao() as cursor:
+        cursor.execute(SQL_CRIAR_MARCA, (tabela,))
+
+    movimentos, marca = 0, None
+    while True:
+        bloco = tamanho_bloco if max_movimentos is None else min(tamanho_bloco, max_movimentos - movimentos)
+        if bloco <= 0:
+            return {'movimentos': movimentos, 'marca': marca, 'em_dia': False}
+        quantidade, marca, em_dia = _somar_bloco(tabela, bloco, atraso)
+        movimentos += quantidade
+        if em_dia:
+            return {'movimentos': movimentos, 'marca': marca, 'em_dia': True}
+
+
+# COMPARAÇÃO
+
+def _variacoes_pendentes(cursor, marcas):
+    """Variações dos movimentos posteriores às marcas, que o saldo já inclui e os totais ainda não"""
+    pendentes = {}
+    for tabela, (_, partes, variacoes) in TABELAS.items():
+        cursor.execute(variacoes, (marcas.get(tabela, 0), _ULTIMO_ID) * partes)
+        for linha in cursor.fetchall():
+            chave = (linha['endereco_carteira'], linha['id_moeda'])
+            pendentes[chave] = pendentes.get(chave, 0) + linha['variacao']
+    return pendentes
+
+def _conferir(linhas, pendentes, tolerancia, moedas):
+    conferidas, divergencias = [], []
+    for linha in linhas:
+        chave = (linha['endereco_carteira'], linha['id_moeda'])
+        esperado = linha['total'] + pendentes.get(chave, 0)
+        if linha['saldo'] is not None and abs(linha['saldo'] - esperado) <= tolerancia:
+            conferidas.append(chave)
+            continue
+        moeda = moedas.por_id(linha['id_moeda'])
+        divergencias.append({
+            'endereco_carteira': linha['endereco_carteira'],
+            'codigo_moeda': moeda.codigo if moeda else str(linha['id_moeda']),
+            'id_moeda': linha['id_moeda'],
+            'saldo': linha['saldo'],
+            'esperado': esperado,
+            'diferenca': None if linha['saldo'] is None else linha['saldo'] - esperado,
+        })
+    return conferidas, divergencias
+
+def _gravar_conferencia(conferidas, divergencias):
+    with transacao() as cursor:
+        if conferidas:
+            cursor.execute(
+                sql_limpar_pendentes(len(conferidas)),
+                [valor for chave in conferidas for valor in chave]
+            )
+        if divergencias:
+            # continuam pendentes até a próxima execução encontrá-las certas
+            cursor.executemany(
+                SQL_MARCAR_DIVERGENTE,
+                [(divergencia['endereco_carteira'], divergencia['id_moeda']) for divergencia in divergencias]
+            )
+
+def comparar_saldos(completa=False, tamanho_pagina=RECONCILIACAO_COMPARACAO, tolerancia=None):
+    """
+    Compara os totais com SALDO_CARTEIRA e retorna (saldos conferidos, divergências)
+
+    As leituras usam uma única transação somente leitura (mesmo instante do banco para saldos,
+    totais, marcas e movimentos posteriores às marcas). Só deve rodar com a soma dos movimentos
+    em dia: os posteriores às marcas são lidos de uma vez.
+    """
+    tolerancia = Decimal(RECONCILIACAO_TOLERANCIA if tolerancia is None else tolerancia)
+    moedas = obter_catalogo()
+    consultas = [SQL_COMPARAR_PENDENTES] + ([SQL_COMPARAR_TODOS] if completa else [])
+
+    conferidos = 0
+    divergencias = {}
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+            cursor.execute(SQL_MARCAS)
+            marcas = {linha['tabela']: linha['ultimo_id'] for linha in cursor.fetchall()}
+            pendentes = _variacoes_pendentes(cursor, marcas)
+
+            for consulta in consultas:
+                endereco, id_moeda = '', 0
+                while True:
+                    cursor.execute(consulta, (endereco, endereco, id_moeda, tamanho_pagina))
+                    linhas = cursor.fetchall()
+                    if not linhas:
+                        break
+                    conferidas, novas = _conferir(linhas, pendentes, tolerancia, moedas)
+                    _gravar_conferencia(conferidas, novas)
+                    conferidos += len(linhas)
+                    for divergencia in novas:
+                        divergencias[(divergencia['endereco_carteira'], divergencia['id_moeda'])] = divergencia
+                    endereco, id_moeda = linhas[-1]['endereco_carteira'], linhas[-1]['id_moeda']
+        connection.rollback()
+    finally:
+        connection.close()
+    return conferidos, list(divergencias.values())
+
+
+# EXECUÇÃO
+
+def _travar_execucao():
+    connection = get_connection()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS obtida", (_NOME_TRAVA,))
+        obtida = cursor.fetchone()['obtida']
+    if obtida != 1:
+        connection.close()
+        raise RuntimeError("Outra reconciliação está em andamento")
+    # a trava é da sessão: fechar a conexão a libera
+    return connection
+
+def reconciliar(completa=False, max_movimentos=None):
+    """Soma os movimentos novos de cada tabela e, com a soma em dia, compara os saldos"""
+    trava = _travar_execucao()
+    try:
+        tabelas = {tabela: somar_movimentos(tabela, max_movimentos=max_movimentos) for tabela in TABELAS}
+        em_dia = all(soma['em_dia'] for soma in tabelas.values())
+        conferidos, divergencias = comparar_saldos(completa) if em_dia else (0, [])
+    finally:
+        trava.close()
+    return {
+        'tabelas': tabelas,
+        'comparado': em_dia,
+        'completa': completa,
+        'conferidos': conferidos,
+        'divergencias': divergencias,
+    }
+
+
+def _imprimir(relatorio, saida):
+    for tabela, soma in relatorio['tabelas'].items():
+        print(f"{tabela}: {soma['movimentos']} movimentos somados (marca {soma['marca']})", file=saida)
+    if not relatorio['comparado']:
+        print("comparação adiada: ainda há movimentos por somar (--max-movimentos)", file=saida)
+        return
+    print(f"saldos conferidos: {relatorio['conferidos']}, divergências: {len(relatorio['divergencias'])}", file=saida)
+    for divergencia in relatorio['divergencias']:
+        print(
+            f"  {divergencia['endereco_carteira']} {divergencia['codigo_moeda']}: saldo {divergencia['saldo']}, "
+            f"movimentos {divergencia['esperado']}, diferença {divergencia['diferenca']}",
+            file=saida
+        )
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Reconcilia os saldos das carteiras com os movimentos")
+    parser.add_argument('--completa', action='store_true',
+                        help="compara todos os saldos, não só os alterados desde a última execução")
+    parser.add_argument('--max-movimentos', type=int,
+                        help="movimentos somados por tabela nesta execução (a carga inicial pode ser dividida)")
+    parser.add_argument('--saida', help="arquivo JSON com o relatório")
+    args = parser.parse_args(argumentos)
+    if ARMAZENAMENTO == 'memoria':
+        # o livro em memória não tem saldo desnormalizado separado dos movimentos
+        parser.error("a reconciliação só se aplica a ARMAZENAMENTO=mysql")
+    if args.max_movimentos is not None and args.max_movimentos <= 0:
+        parser.error("--max-movimentos deve ser maior que zero")
+
+    try:
+        relatorio = reconciliar(args.completa, args.max_movimentos)
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(2)
+
+    _imprimir(relatorio, sys.stdout)
+    if args.saida:
+        with open(args.saida, 'w') as arquivo:
+            json.dump(relatorio, arquivo, indent=2, default=str)
+    if relatorio['divergencias']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+Endpoints das operações de carteira na versão assíncrona (API_MODO=async)
+
+Mesmos caminhos, modelos e respostas de app/main.py, com `async def` e serviços
+aguardáveis de ponta a ponta (app/services_async.py).
+"""
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Query, status
+from app.config import EXTRATO_LIMITE_PADRAO, EXTRATO_LIMITE_MAX
+from app.idempotencia import RequisicaoEmAndamentoError, executar_idempotente_async, impressao_requisicao
+from app.models import (
+    CarteiraResponse, SaldosResponse, ExtratoResponse, TipoMovimento, OperacaoResponse, CotacaoConversaoResponse,
+    DepositoRequest, SaqueRequest, ConversaoRequest, CotacaoConversaoRequest, TransferenciaRequest
+)
+from app.perfil import RotaPerfilavel
+from app.services import CarteiraNaoEncontradaError, carteira_guardada
+from app.services_async import (
+    criar_carteira, obter_carteira, obter_saldos, obter_extrato,
+    realizar_deposito, realizar_saque, cotar_conversao, realizar_conversao, realizar_transferencia
+)
+
+rotas = APIRouter(route_class=RotaPerfilavel)
+
+
+# post para criar uma nova carteira
+# retorna o endereço da carteira e a chave privada
+@rotas.post("/carteiras", response_model=CarteiraResponse, status_code=status.HTTP_201_CREATED)
+async def criar_nova_carteira(idempotency_key: Optional[str] = Header(None, max_length=255)):
+    try:
+        resultado = await executar_idempotente_async(
+            idempotency_key, impressao_requisicao('criar_carteira'), criar_carteira, carteira_guardada
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao criar carteira: {str(e)}"
+        )
+
+    # repetição: a carteira já existe e a chave privada, que não é guardada, só saiu na primeira resposta
+    if 'chave_privada' not in resultado:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Carteira {resultado['endereco_carteira']} já criada com esta Idempotency-Key"
+        )
+    return CarteiraResponse(
+        endereco_carteira=resultado['endereco_carteira'],
+        chave_privada=resultado['chave_privada']
+    )
+
+# get para consultar informações de uma carteira (endereço, data de criação e status)
+@rotas.get("/carteiras/{endereco_carteira}", response_model=CarteiraResponse)
+async def consultar_carteira(endereco_carteira: str):
+    carteira = await obter_carteira(endereco_carteira)
+    
+    if not carteira:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Carteira não encontrada"
+        )
+    
+    return CarteiraResponse(
+        endereco_carteira=carteira['endereco_carteira'],
+        data_criacao=carteira['data_criacao'],
+        status=carteira['status']
+    )
+
+# consulta o saldo e retorna lista com o saldo de cada moeda
+@rotas.get("/carteiras/{endereco_carteira}/saldos", response_model=SaldosResponse)
+async def consultar_saldos(endereco_carteira: str):
+    # a existência da carteira é verificada na mesma query dos saldos
+    saldos = await obter_saldos(endereco_carteira)
+    if saldos is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Carteira não encontrada"
+        )
+    
+    return SaldosResponse(
+        endereco_carteira=endereco_carteira,
+        saldos=saldos
+    )
+
+# extrato da carteira: depósitos, saques, conversões e transferências, do mais recente ao mais antigo
+# paginação por cursor: o proximo_cursor da resposta busca a página seguinte
+@rotas.get("/carteiras/{endereco_carteira}/extrato", response_model=ExtratoResponse)
+async def consultar_extrato(
+    endereco_carteira: str,
+    codigo_moeda: Optional[str] = None,
+    tipo: Optional[list[TipoMovimento]] = Query(None),
+    data_inicio: Optional[datetime] = None,
+    data_fim: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limite: int = Query(EXTRATO_LIMITE_PADRAO, ge=1, le=EXTRATO_LIMITE_MAX)
+):
+    try:
+        movimentos, proximo_cursor = await obter_extrato(
+            endereco_carteira, limite, codigo_moeda, tipo, data_inicio, data_fim, cursor
+        )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao consultar extrato: {str(e)}"
+        )
+
+    return ExtratoResponse(
+        endereco_carteira=endereco_carteira,
+        movimentos=movimentos,
+        proximo_cursor=proximo_cursor
+    )
+
+
+# ENDPOINTS DE DEPÓSITOS
+# realiza depósito de um tipo de moeda
+@rotas.post("/carteiras/{endereco_carteira}/depositos", response_model=OperacaoResponse)
+async def depositar(
+    endereco_carteira: str,
+    deposito: DepositoRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    # a existência da carteira é verificada dentro da transação do serviço
+    try:
+        await executar_idempotente_async(
+            idempotency_key,
+            impressao_requisicao('depositar', endereco_carteira, deposito.codigo_moeda, deposito.valor),
+            lambda idempotencia: realizar_deposito(
+                endereco_carteira, deposito.codigo_moeda, deposito.valor, idempotencia
+            )
+        )
+        
+        return OperacaoResponse(
+            sucesso=True,
+            mensagem=f"Depósito de {deposito.valor} {deposito.codigo_moeda} realizado com sucesso",
+            dados={
+                "endereco_carteira": endereco_carteira,
+                "codigo_moeda": deposito.codigo_moeda,
+                "valor": float(deposito.valor)
+            }
+        )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Erro ao realizar depósito: {str(e)}"
+        )
+
+
+# ENDPOINTS DE SAQUES
+
+@rotas.post("/carteiras/{endereco_carteira}/saques", response_model=OperacaoResponse)
+async def sacar(
+    endereco_carteira: str,
+    saque: SaqueRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    """
+    Realiza um saque de uma moeda específica
+    
+    Exige autenticação por chave privada e cobra taxa
+    """
+    # a existência da carteira é verificada dentro da transação do serviço
+    try:
+        await executar_idempotente_async(
+            idempotency_key,
+            impressao_requisicao('sacar', endereco_carteira, saque.codigo_moeda, saque.valor, saque.chave_privada),
+            lambda idempotencia: realizar_saque(
+                endereco_carteira, saque.codigo_moeda, saque.valor, saque.chave_privada, idempotencia
+            )
+        )
+        
+        return OperacaoResponse(
+            sucesso=True,
+            mensagem=f"Saque de {saque.valor} {saque.codigo_moeda} realizado com sucesso",
+            dados={
+                "endereco_carteira": endereco_carteira,
+                "codigo_moeda": saque.codigo_moeda,
+                "valor": float(saque.valor)
+            }
+        )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao realizar saque: {str(e)}"
+        )
+
+
+# ENDPOINTS DE CONVERSÃO
+
+@rotas.post("/carteiras/{endereco_carteira}/conversoes/cotacao", response_model=CotacaoConversaoResponse)
+async def cotar_moeda(endereco_carteira: str, pedido: CotacaoConversaoRequest):
+    """
+    Trava a cotação e a taxa de uma conversão por COTACAO_TRAVADA_TTL segundos
+
+    A conversão que enviar o `id_cotacao` retornado (com as mesmas moedas e valor) usa
+    esses valores, sem consultar o provedor de cotações.
+    """
+    try:
+        resultado = await cotar_conversao(
+            endereco_carteira,
+            pedido.codigo_origem,
+            pedido.codigo_destino,
+            pedido.valor
+        )
+        return CotacaoConversaoResponse(**resultado)
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao cotar conversão: {str(e)}"
+        )
+
+
+@rotas.post("/carteiras/{endereco_carteira}/conversoes", response_model=OperacaoResponse)
+async def converter_moeda(
+    endereco_carteira: str,
+    conversao: ConversaoRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    """
+    Realiza conversão entre duas moedas
+    
+    Usa cotação da API da Coinbase, exige autenticação e cobra taxa. Com `id_cotacao`,
+    usa a cotação e a taxa travadas em POST .../conversoes/cotacao
+    """
+    # a existência da carteira é verificada dentro da transação do serviço
+    try:
+        resultado = await executar_idempotente_async(
+            idempotency_key,
+            impressao_requisicao(
+                'converter', endereco_carteira, conversao.codigo_origem, conversao.codigo_destino, conversao.valor,
+                conversao.chave_privada, conversao.id_cotacao
+            ),
+            lambda idempotencia: realizar_conversao(
+                endereco_carteira,
+                conversao.codigo_origem,
+                conversao.codigo_destino,
+                conversao.valor,
+                conversao.chave_privada,
+                conversao.id_cotacao,
+                idempotencia
+            )
+        )
+        
+        return OperacaoResponse(
+            sucesso=True,
+            mensagem=f"Conversão de {conversao.codigo_origem} para {conversao.codigo_destino} realizada com sucesso",
+            dados=resultado
+        )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao realizar conversão: {str(e)}"
+        )
+
+
+# ENDPOINTS DE TRANSFERÊNCIA
+
+@rotas.post("/carteiras/{endereco_origem}/transferencias", response_model=OperacaoResponse)
+async def transferir(
+    endereco_origem: str,
+    transferencia: TransferenciaRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    """
+    Realiza transferência de valor entre carteiras
+    
+    Exige autenticação da carteira de origem e cobra taxa
+    """
+    # a existência da carteira de origem é verificada dentro da transação do serviço
+    try:
+        await executar_idempotente_async(
+            idempotency_key,
+            impressao_requisicao(
+                'transferir', endereco_origem, transferencia.endereco_destino, transferencia.codigo_moeda,
+                transferencia.valor, transferencia.chave_privada
+            ),
+            lambda idempotencia: realizar_transferencia(
+                endereco_origem,
+                transferencia.endereco_destino,
+                transferencia.codigo_moeda,
+                transferencia.valor,
+                transferencia.chave_privada,
+                idempotencia
+            )
+        )
+        
+        return OperacaoResponse(
+            sucesso=True,
+            mensagem=f"Transferência de {transferencia.valor} {transferencia.codigo_moeda} realizada com sucesso",
+            dados={
+                "endereco_origem": endereco_origem,
+                "endereco_destino": transferencia.endereco_destino,
+                "codigo_moeda": transferencia.codigo_moeda,
+                "valor": float(transferencia.valor)
+            }
+        )
+    except CarteiraNaoEncontradaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except RequisicaoEmAndamentoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao realizar transferência: {str(e)}"
+        )
@@ -1,300 +1,1197 @@
-from decimal import Decimal
-from app.database import execute_query, execute_transaction
-from app.utils import gerar_chave_publica, gerar_chave_privada, hash_chave_privada, validar_chave_privada
-from app.config import TAXA_SAQUE_PERCENTUAL, TAXA_CONVERSAO_PERCENTUAL, TAXA_TRANSFERENCIA_PERCENTUAL
-import requests
+import random
+import threading
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP, localcontext
+from app.cache import AUSENTE, CacheLRU
+from app.commit_agrupado import CommitAgrupado
+from app.database import execute_query, execute_leitura, fixar_no_primario, transacao, repetir_em_conflito
+from app.metricas import registro
+from app.moedas import obter_catalogo, recarregar_catalogo
+from app.utils import (
+    gerar_chave_publica, gerar_chave_privada, gerar_chaves_em_lote, hash_chave_privada, validar_chave_privada
+)
+from app.config import (
+    TAXA_SAQUE_PERCENTUAL, TAXA_CONVERSAO_PERCENTUAL, TAXA_TRANSFERENCIA_PERCENTUAL, LOTE_CARTEIRAS_BLOCO,
+    CACHE_CARTEIRAS_MAX, CACHE_CARTEIRAS_TTL, CACHE_CARTEIRAS_TTL_NEGATIVO, CACHE_SALDOS_MAX, CACHE_SALDOS_TTL,
+    DEPOSITO_COMMIT_AGRUPADO, COMMIT_AGRUPADO_JANELA_MS, COMMIT_AGRUPADO_MAX_OPERACOES,
+    SALDOS_PARTICIONADOS, CARTEIRAS_QUENTES, SALDO_SLOTS, EVENTOS_SALDO
+)
+from app.cotacoes import obter_cotacao
+from app.cotacoes_travadas import gastar_cotacao, obter_cotacoes_travadas
+from app.extrato import sql_extrato, decodificar_cursor, montar_extrato
+from app.idempotencia import SQL_DESCARTAR_IDEMPOTENCIA, SQL_GRAVAR_IDEMPOTENCIA, gravar_idempotencia
 
-# CARTEIRAS 
 
-def criar_carteira():
+class CarteiraNaoEncontradaError(Exception):
+    """A carteira informada não existe"""
+
+
+# QUERIES
+# compartilhadas com a versão assíncrona dos serviços (app/services_async.py)
+
+SQL_INSERIR_CARTEIRA = """
+    INSERT /* inserir_carteira */ INTO CARTEIRA (endereco_carteira, hash_chave_privada, status)
+    VALUES (%s, %s, 'ATIVA')
+"""
+
+# só placeholders em VALUES: o executemany do pymysql vira um único INSERT multi-linha
+# (status 'ATIVA' e saldo 0 vêm do DEFAULT das colunas)
+SQL_INSERIR_CARTEIRAS = """
+    INSERT /* inserir_carteiras */ INTO CARTEIRA (endereco_carteira, hash_chave_privada)
+    VALUES (%s, %s)
+"""
+
+SQL_INSERIR_SALDO_ZERADO = """
+    INSERT /* inserir_saldo_zerado */ INTO SALDO_CARTEIRA (endereco_carteira, id_moeda)
+    VALUES (%s, %s)
+"""
+
+SQL_OBTER_CARTEIRA = """
+    SELECT /* obter_carteira */ endereco_carteira, data_criacao, status
+    FROM CARTEIRA
+    WHERE endereco_carteira = %s
+"""
+
+# linha completa da carteira, guardada no cache de carteiras
+SQL_OBTER_DADOS_CARTEIRA = """
+    SELECT /* obter_dados_carteira */ endereco_carteira, data_criacao, status, hash_chave_privada
+    FROM CARTEIRA
+    WHERE endereco_carteira = %s
+"""
+
+SQL_ALTERAR_STATUS = """
+    UPDATE /* alterar_status */ CARTEIRA
+    SET status = %s
+    WHERE endereco_carteira = %s
+"""
+
+# a existência da carteira vem na mesma query dos saldos
+SQL_OBTER_SALDOS = """
+    SELECT /* obter_saldos */ sc.id_moeda, sc.saldo
+    FROM CARTEIRA c
+    LEFT JOIN SALDO_CARTEIRA sc ON sc.endereco_carteira = c.endereco_carteira
+    WHERE c.endereco_carteira = %s
+"""
+
+SQL_CREDITAR = """
+    UPDATE /* creditar */ SALDO_CARTEIRA
+    SET saldo = saldo + %s
+    WHERE endereco_carteira = %s AND id_moeda = %s
+"""
+
+SQL_DEBITAR = """
+    UPDATE /* debitar */ SALDO_CARTEIRA
+    SET saldo = saldo - %s
+    WHERE endereco_carteira = %s AND id_moeda = %s
+"""
+
+SQL_INSERIR_DEPOSITO = """
+    INSERT /* inserir_deposito */ INTO DEPOSITO_SAQUE (endereco_carteira, id_moeda, valor, tipo, taxa_valor)
+    VALUES (%s, %s, %s, 'DEPOSITO', 0.00000000)
+"""
+
+SQL_INSERIR_SAQUE = """
+    INSERT /* inserir_saque */ INTO DEPOSITO_SAQUE (endereco_carteira, id_moeda, valor, tipo, taxa_valor)
+    VALUES (%s, %s, %s, 'SAQUE', %s)
+"""
+
+SQL_INSERIR_CONVERSAO = """
+    INSERT /* inserir_conversao */ INTO CONVERSAO (endereco_carteira, id_moeda_origem, id_moeda_destino,
+                           valor_origem, valor_destino, taxa_percentual, taxa_valor, cotacao_utilizada)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+SQL_INSERIR_TRANSFERENCIA = """
+    INSERT /* inserir_transferencia */ INTO TRANSFERENCIA (endereco_origem, endereco_destino, id_moeda, valor, taxa_valor)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+# movimento genérico de DEPOSITO_SAQUE, tipo e taxa como parâmetros
+# (só placeholders em VALUES: o executemany vira um único INSERT multi-linha)
+SQL_INSERIR_MOVIMENTO = """
+    INSERT /* inserir_movimento */ INTO DEPOSITO_SAQUE (endereco_carteira, id_moeda, valor, tipo, taxa_valor)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+# eventos de saldo (outbox lido por app/eventos.py), gravados na transação que altera o saldo
+# (só placeholders em VALUES: o executemany vira um único INSERT multi-linha)
+SQL_INSERIR_EVENTOS = """
+    INSERT /* inserir_eventos */ INTO EVENTO_SALDO (endereco_carteira, id_moeda, tipo, variacao)
+    VALUES (%s, %s, %s, %s)
+"""
+
+# grava saldos já calculados sobre linhas travadas; todas as linhas existem,
+# então o executemany é um único INSERT multi-linha que só cai no UPDATE
+SQL_GRAVAR_SALDOS = """
+    INSERT /* gravar_saldos */ INTO SALDO_CARTEIRA (endereco_carteira, id_moeda, saldo)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE saldo = VALUES(saldo)
+"""
+
+# lê as carteiras e o saldo da moeda em uma única query
+# com bloquear=True o saldo fica travado (SELECT ... FOR UPDATE) até o commit; as linhas são
+# lidas (e travadas) em ordem de endereço, então transferências A→B e B→A travam na mesma ordem
+def sql_carteira_e_saldo(quantidade, bloquear=False):
+    marcadores = ", ".join(["%s"] * quantidade)
+    query = f"""
+        SELECT /* carteira_e_saldo */ c.endereco_carteira, c.hash_chave_privada, sc.saldo
+        FROM CARTEIRA c
+        LEFT JOIN SALDO_CARTEIRA sc
+            ON sc.endereco_carteira = c.endereco_carteira AND sc.id_moeda = %s
+        WHERE c.endereco_carteira IN ({marcadores})
+        ORDER BY c.endereco_carteira
+    """
+    if bloquear:
+        query += " FOR UPDATE OF sc"
+    return query
+
+def sql_hashes_carteiras(quantidade):
+    marcadores = ", ".join(["%s"] * quantidade)
+    return f"""
+        SELECT /* hashes_carteiras */ endereco_carteira, hash_chave_privada
+        FROM CARTEIRA
+        WHERE endereco_carteira IN ({marcadores})
+    """
+
+# trava vários saldos (endereco, id_moeda) de uma vez, na ordem da chave primária,
+# para que lotes concorrentes travem as linhas sempre na mesma ordem
+def sql_travar_saldos(quantidade):
+    pares = ", ".join(["(%s, %s)"] * quantidade)
+    return f"""
+        SELECT /* travar_saldos */ endereco_carteira, id_moeda, saldo
+        FROM SALDO_CARTEIRA
+        WHERE (endereco_carteira, id_moeda) IN ({pares})
+        ORDER BY endereco_carteira, id_moeda
+        FOR UPDATE
+    """
+
+# saldos particionados (carteiras quentes): o saldo é a linha de SALDO_CARTEIRA (de onde saem
+# os débitos) mais os slots de SALDO_CARTEIRA_SLOT (onde caem os créditos, cada um em um slot sorteado)
+
+# soma dos slots na mesma leitura: um único SELECT vê os slots e a linha principal no mesmo instante
+SQL_OBTER_SALDOS_PARTICIONADOS = """
+    SELECT /* obter_saldos_particionados */ sc.id_moeda, sc.saldo + COALESCE(SUM(ss.saldo), 0) AS saldo
+    FROM CARTEIRA c
+    LEFT JOIN SALDO_CARTEIRA sc ON sc.endereco_carteira = c.endereco_carteira
+    LEFT JOIN SALDO_CARTEIRA_SLOT ss
+        ON ss.endereco_carteira = sc.endereco_carteira AND ss.id_moeda = sc.id_moeda
+    WHERE c.endereco_carteira = %s
+    GROUP BY sc.id_moeda, sc.saldo
+"""
+
+SQL_OBTER_SALDO_MOEDA_PARTICIONADO = """
+    SELECT /* obter_saldo_moeda_particionado */ sc.saldo + COALESCE(SUM(ss.saldo), 0) AS saldo
+    FROM SALDO_CARTEIRA sc
+    LEFT JOIN SALDO_CARTEIRA_SLOT ss
+        ON ss.endereco_carteira = sc.endereco_carteira AND ss.id_moeda = sc.id_moeda
+    WHERE sc.endereco_carteira = %s AND sc.id_moeda = %s
+    GROUP BY sc.saldo
+"""
+
+# só trava o slot sorteado: créditos concorrentes em slots diferentes não esperam uns pelos outros
+SQL_CREDITAR_SLOT = """
+    UPDATE /* creditar_slot */ SALDO_CARTEIRA_SLOT
+    SET saldo = saldo + %s
+    WHERE endereco_carteira = %s AND id_moeda = %s AND slot = %s
+"""
+
+SQL_TRAVAR_SLOTS = """
+    SELECT /* travar_slots */ slot, saldo
+    FROM SALDO_CARTEIRA_SLOT
+    WHERE endereco_carteira = %s AND id_moeda = %s
+    ORDER BY slot
+    FOR UPDATE
+"""
+
+SQL_ZERAR_SLOTS = """
+    UPDATE /* zerar_slots */ SALDO_CARTEIRA_SLOT
+    SET saldo = 0
+    WHERE endereco_carteira = %s AND id_moeda = %s
+"""
+
+# slots zerados para os saldos já existentes das carteiras (INSERT IGNORE: os que já existem ficam como estão)
+def sql_criar_slots(quantidade):
+    marcadores = ", ".join(["%s"] * quantidade)
+    return f"""
+        INSERT /* criar_slots */ IGNORE INTO SALDO_CARTEIRA_SLOT (endereco_carteira, id_moeda, slot)
+        SELECT endereco_carteira, id_moeda, %s
+        FROM SALDO_CARTEIRA
+        WHERE endereco_carteira IN ({marcadores})
+    """
+
+# slots das carteiras que não estão entre as `quantidade` informadas (0: todos os slots)
+def _filtro_fora_da_lista(quantidade):
+    if not quantidade:
+        return ""
+    marcadores = ", ".join(["%s"] * quantidade)
+    return f"WHERE endereco_carteira NOT IN ({marcadores})"
+
+def sql_travar_slots_fora_da_lista(quantidade):
+    return f"""
+        SELECT /* travar_slots_fora_da_lista */ endereco_carteira, id_moeda, slot, saldo
+        FROM SALDO_CARTEIRA_SLOT
+        {_filtro_fora_da_lista(quantidade)}
+        ORDER BY endereco_carteira, id_moeda, slot
+        FOR UPDATE
+    """
+
+def sql_remover_slots_fora_da_lista(quantidade):
+    return f"DELETE /* remover_slots_fora_da_lista */ FROM SALDO_CARTEIRA_SLOT {_filtro_fora_da_lista(quantidade)}"
+
+
+# REGRAS
+# cálculos e validações sem acesso ao banco, usados pelas duas versões dos serviços
+
+def autenticar(linha, chave_privada):
+    if not validar_chave_privada(chave_privada, linha['hash_chave_privada']):
+        raise ValueError("Chave privada inválida")
+
+def saldo_da_linha(linha):
+    if not linha or linha['saldo'] is None:
+        return None
+    return Decimal(str(linha['saldo']))
+
+# taxa e valor total debitado (valor + taxa)
+def calcular_taxa(valor, percentual):
+    taxa_valor = Decimal(str(valor)) * Decimal(str(percentual))
+    return taxa_valor, Decimal(str(valor)) + taxa_valor
+
+def verificar_saldo(saldo_atual, valor_total):
+    if saldo_atual is None or saldo_atual < valor_total:
+        raise ValueError(f"Saldo insuficiente. Necessário: {valor_total}, Disponível: {saldo_atual}")
+
+# ids das moedas de origem e destino de uma conversão
+def moedas_da_conversao(codigo_origem, codigo_destino):
+    moedas = obter_catalogo()
+    moeda_origem = moedas.obter(codigo_origem)
+    moeda_destino = moedas.obter(codigo_destino)
+    if not moeda_origem or not moeda_destino:
+        raise ValueError("Moeda não encontrada")
+    return moeda_origem.id_moeda, moeda_destino.id_moeda
+
+# valor creditado no destino e taxa de uma conversão
+def calcular_conversao(valor, cotacao):
+    valor_convertido_bruto = Decimal(str(valor)) * cotacao
+    taxa_valor = valor_convertido_bruto * Decimal(str(TAXA_CONVERSAO_PERCENTUAL))
+    valor_destino = valor_convertido_bruto - taxa_valor
+    return valor_destino, taxa_valor
+
+def resultado_conversao(valor, codigo_origem, codigo_destino, valor_destino, cotacao, taxa_valor,
+                        taxa_percentual=TAXA_CONVERSAO_PERCENTUAL):
+    return {
+        'valor_origem': float(valor),
+        'moeda_origem': codigo_origem,
+        'valor_destino': float(valor_destino),
+        'moeda_destino': codigo_destino,
+        'cotacao': float(cotacao),
+        'taxa_percentual': float(taxa_percentual),
+        'taxa_valor': float(taxa_valor)
+    }
+
+# emite a cotação travada de uma conversão (POST .../conversoes/cotacao)
+def travar_cotacao(endereco_carteira, id_moeda_origem, id_moeda_destino, valor, cotacao):
+    valor_destino, taxa_valor = calcular_conversao(valor, cotacao)
+    travada = obter_cotacoes_travadas().emitir(
+        endereco_carteira, id_moeda_origem, id_moeda_destino, valor, cotacao, valor_destino,
+        TAXA_CONVERSAO_PERCENTUAL, taxa_valor
+    )
+    moedas = obter_catalogo()
+    return {
+        'id_cotacao': travada.id_cotacao,
+        'codigo_origem': moedas.por_id(id_moeda_origem).codigo,
+        'codigo_destino': moedas.por_id(id_moeda_destino).codigo,
+        'valor': travada.valor,
+        'cotacao': travada.cotacao,
+        'taxa_percentual': travada.taxa_percentual,
+        'taxa_valor': travada.taxa_valor,
+        'valor_destino': travada.valor_destino,
+        'expira_em': datetime.fromtimestamp(travada.expira_em)
+    }
+
+# dados públicos da carteira (sem o hash da chave)
+def carteira_publica(dados):
+    return {
+        'endereco_carteira': dados['endereco_carteira'],
+        'data_criacao': dados['data_criacao'],
+        'status': dados['status']
+    }
+
+# saldos compactos de uma carteira: (catálogo, tupla de saldos na ordem do catálogo)
+# cada saldo é um inteiro em unidades de 1e-8 (escala de DECIMAL(20, 8)); None se não houver linha
+_ESCALA_SALDO = 8
+
+# converte as linhas (id_moeda, saldo) de SQL_OBTER_SALDOS para a forma compacta
+def compactar_saldos(linhas):
+    moedas = obter_catalogo()
+    if any(linha['id_moeda'] is not None and moedas.posicao(linha['id_moeda']) is None for linha in linhas):
+        # moeda cadastrada depois da carga do catálogo
+        moedas = recarregar_catalogo()
+
+    saldos = [None] * len(moedas)
+    for linha in linhas:
+        if linha['id_moeda'] is None:
+            continue
+        saldos[moedas.posicao(linha['id_moeda'])] = int(Decimal(str(linha['saldo'])).scaleb(_ESCALA_SALDO))
+    return moedas, tuple(saldos)
+
+# converte os saldos compactos para a resposta, com código e nome do catálogo (já em ordem de código)
+def montar_saldos(compactos):
+    moedas, saldos = compactos
+    return [
+        {'codigo': moeda.codigo, 'string': moeda.string, 'saldo': Decimal(saldo).scaleb(-_ESCALA_SALDO)}
+        for moeda, saldo in zip(moedas, saldos) if saldo is not None
+    ]
+
+# função para CacheLRU.aplicar que soma variações (id_moeda, valor) aos saldos compactos
+def somar_saldos(variacoes):
+    def somar(compactos):
+        moedas, saldos = compactos
+        saldos = list(saldos)
+        with localcontext() as contexto:
+            contexto.prec = 50
+            for id_moeda, variacao in variacoes:
+                posicao = moedas.posicao(id_moeda)
+                if posicao is None or saldos[posicao] is None:
+                    return AUSENTE
+                # mesmo arredondamento do MySQL ao gravar em DECIMAL(20, 8): metade para longe do zero
+                novo = saldos[posicao] + Decimal(str(variacao)).scaleb(_ESCALA_SALDO)
+                saldos[posicao] = int(novo.to_integral_value(ROUND_HALF_UP))
+        return moedas, tuple(saldos)
+    return somar
+
+
+# CACHE DE CARTEIRAS
+# linhas de CARTEIRA (existência, status e hash da chave) por endereço, compartilhadas pelas
+# duas versões dos serviços; endereços inexistentes também ficam em cache, por menos tempo
+
+_cache_carteiras = CacheLRU(CACHE_CARTEIRAS_MAX, CACHE_CARTEIRAS_TTL, CACHE_CARTEIRAS_TTL_NEGATIVO)
+
+def obter_cache_carteiras():
+    return _cache_carteiras
+
+def estatisticas_cache_carteiras():
+    return _cache_carteiras.estatisticas()
+
+# chamar sempre que a linha da carteira mudar (status, criação), neste ou em outro processo
+def invalidar_carteira(endereco_carteira):
+    _cache_carteiras.invalidar(endereco_carteira)
+    fixar_no_primario(endereco_carteira)
+
+# linha da carteira pelo cache; None se a carteira não existir
+def dados_carteira(endereco_carteira):
+    dados = _cache_carteiras.obter(endereco_carteira)
+    if dados is AUSENTE:
+        geracao = _cache_carteiras.geracao(endereco_carteira)
+        # na réplica, "não existe" é conferido no primário (carteira recém-criada em outro worker)
+        resultado = execute_leitura(SQL_OBTER_DADOS_CARTEIRA, (endereco_carteira,), endereco_carteira, confirmar_vazio=True)
+        dados = resultado[0] if resultado else None
+        _cache_carteiras.guardar(endereco_carteira, dados, geracao)
+    return dados
+
+
+# CACHE DE SALDOS
+# saldos compactos por carteira, atualizados pelos serviços que movimentam saldo só depois do commit
+# (marcar_saldos antes da transação, aplicar_saldos depois); também usado pela versão assíncrona
+
+_cache_saldos = CacheLRU(CACHE_SALDOS_MAX, CACHE_SALDOS_TTL)
+
+def obter_cache_saldos():
+    return _cache_saldos
+
+def estatisticas_cache_saldos():
+    return _cache_saldos.estatisticas()
+
+# saldos em cache da carteira, ou AUSENTE (também se o catálogo mudou desde a carga)
+def saldos_em_cache(endereco_carteira):
+    compactos = _cache_saldos.obter(endereco_carteira)
+    if compactos is AUSENTE or compactos[0] is not obter_catalogo():
+        return AUSENTE
+    return compactos
+
+def marcar_saldos(*enderecos):
+    return {endereco: _cache_saldos.marcar(endereco) for endereco in dict.fromkeys(enderecos)}
+
+# variacoes: lista de (endereco_carteira, id_moeda, valor somado ao saldo)
+def aplicar_saldos(marcas, variacoes):
+    por_carteira = {}
+    for endereco, id_moeda, variacao in variacoes:
+        por_carteira.setdefault(endereco, []).append((id_moeda, variacao))
+    for endereco, marca in marcas.items():
+        _cache_saldos.aplicar(endereco, somar_saldos(por_carteira.get(endereco, [])), marca)
+    # as réplicas ainda podem não ter a escrita: leituras dessas carteiras vão ao primário por um tempo
+    fixar_no_primario(*marcas)
+
+
+# SALDOS PARTICIONADOS
+# carteiras quentes (CARTEIRAS_QUENTES, com SALDOS_PARTICIONADOS ligado) recebem créditos em um de
+# SALDO_SLOTS slots sorteados; débitos saem da linha principal, que recolhe os slots quando não basta
+
+_carteiras_quentes = CARTEIRAS_QUENTES if SALDOS_PARTICIONADOS else frozenset()
+
+def particionada(endereco_carteira):
+    return endereco_carteira in _carteiras_quentes
+
+def sortear_slot():
+    return random.randrange(SALDO_SLOTS)
+
+def sql_obter_saldos(endereco_carteira):
+    return SQL_OBTER_SALDOS_PARTICIONADOS if particionada(endereco_carteira) else SQL_OBTER_SALDOS
+
+@repetir_em_conflito
+def preparar_carteiras_quentes():
+    """
+    Sincroniza SALDO_CARTEIRA_SLOT com a configuração (chamado na subida da aplicação)
+
+    Devolve à linha principal os slots das carteiras que saíram de CARTEIRAS_QUENTES e cria os
+    slots que faltam para as carteiras da lista. Slots além de SALDO_SLOTS (a quantidade diminuiu)
+    continuam somando no saldo e são recolhidos no próximo débito que precisar deles.
+    """
+    if not SALDOS_PARTICIONADOS:
+        return
+
+    quentes = sorted(_carteiras_quentes)
+    with transacao() as cursor:
+        cursor.execute(sql_travar_slots_fora_da_lista(len(quentes)), quentes)
+        devolvidos = {}
+        for linha in cursor.fetchall():
+            chave = (linha['endereco_carteira'], linha['id_moeda'])
+            devolvidos[chave] = devolvidos.get(chave, Decimal('0')) + Decimal(str(linha['saldo']))
+        for (endereco, id_moeda), saldo in sorted(devolvidos.items()):
+            if saldo:
+                cursor.execute(SQL_CREDITAR, (saldo, endereco, id_moeda))
+        if devolvidos:
+            cursor.execute(sql_remover_slots_fora_da_lista(len(quentes)), quentes)
+
+        if quentes:
+            cursor.executemany(sql_criar_slots(len(quentes)), [(slot, *quentes) for slot in range(SALDO_SLOTS)])
+    for endereco, _ in devolvidos:
+        _cache_saldos.invalidar(endereco)
+
+
+# CARTEIRAS
+
+# parte da carteira criada guardada pela Idempotency-Key: a chave privada só sai na primeira resposta
+def carteira_guardada(resultado):
+    return {'endereco_carteira': resultado['endereco_carteira']}
+
+def criar_carteira(idempotencia=None):
     """
     Cria uma nova carteira com chave pública e privada
-    
+
     Returns:
         Dicionário com endereco_carteira e chave_privada
     """
     endereco_carteira = gerar_chave_publica()
     chave_privada = gerar_chave_privada()
     hash_chave = hash_chave_privada(chave_privada)
-    
-    # inserir carteira no banco
-    query = """
-        INSERT INTO CARTEIRA (endereco_carteira, hash_chave_privada, status)
-        VALUES (%s, %s, 'ATIVA')
-    """
-    execute_query(query, (endereco_carteira, hash_chave), fetch=False)
-    
-    # iniciliza saldos zerados para todas as moedas
-    moedas = execute_query("SELECT id_moeda FROM MOEDA")
-    for moeda in moedas:
-        query_saldo = """
-            INSERT INTO SALDO_CARTEIRA (endereco_carteira, id_moeda, saldo)
-            VALUES (%s, %s, 0.00000000)
-        """
-        execute_query(query_saldo, (endereco_carteira, moeda['id_moeda']), fetch=False)
-    
-    return {
+    resultado = {
         'endereco_carteira': endereco_carteira,
         'chave_privada': chave_privada
     }
 
-# consulta a carteira
-def obter_carteira(endereco_carteira):
-    query = """
-        SELECT endereco_carteira, data_criacao, status
-        FROM CARTEIRA
-        WHERE endereco_carteira = %s
+    # ids das moedas vêm do catálogo em memória, sem reler a tabela MOEDA
+    moedas = obter_catalogo()
+
+    # insere a carteira e inicializa saldos zerados para todas as moedas na mesma transação
+    with transacao() as cursor:
+        gravar_idempotencia(cursor, idempotencia, carteira_guardada(resultado))
+        cursor.execute(SQL_INSERIR_CARTEIRA, (endereco_carteira, hash_chave))
+        cursor.executemany(
+            SQL_INSERIR_SALDO_ZERADO, [(endereco_carteira, moeda.id_moeda) for moeda in moedas]
+        )
+    # descarta um eventual "não existe" em cache para o endereço
+    invalidar_carteira(endereco_carteira)
+
+    return resultado
+
+def criar_carteiras_em_lote(quantidade, tamanho_bloco=LOTE_CARTEIRAS_BLOCO):
     """
-    resultado = execute_query(query, (endereco_carteira,))
-    
-    if resultado:
-        return resultado[0]
+    Cria `quantidade` carteiras em uma única transação, em blocos de INSERT multi-linha
+
+    Gerador: a cada bloco inserido devolve a lista de (endereco_carteira, chave_privada)
+    do bloco, para que o chamador repasse as chaves sem acumular o lote inteiro em memória.
+    As carteiras só passam a existir quando o gerador termina (commit). Se ele for
+    interrompido ou falhar, nada é gravado.
+    """
+    moedas = obter_catalogo()
+
+    with transacao() as cursor:
+        for inicio in range(0, quantidade, tamanho_bloco):
+            chaves = gerar_chaves_em_lote(min(tamanho_bloco, quantidade - inicio))
+
+            cursor.executemany(SQL_INSERIR_CARTEIRAS, [
+                (endereco, hash_chave_privada(chave)) for endereco, chave in chaves
+            ])
+            cursor.executemany(SQL_INSERIR_SALDO_ZERADO, [
+                (endereco, moeda.id_moeda) for endereco, _ in chaves for moeda in moedas
+            ])
+
+            yield chaves
+
+    # após o commit e uma vez por lote: endereços recém-sorteados não precisam ser fixados no primário,
+    # e a limpeza descarta um "não existe" guardado por uma consulta feita durante o streaming
+    _cache_carteiras.limpar()
+
+# consulta a carteira (pelo cache de carteiras)
+def obter_carteira(endereco_carteira):
+    dados = dados_carteira(endereco_carteira)
+
+    if dados:
+        return carteira_publica(dados)
     return None
 
-# consulta o saldo da carteira
-def obter_saldos(endereco_carteira):
-    query = """
-        SELECT m.codigo, m.string, sc.saldo
-        FROM SALDO_CARTEIRA sc
-        JOIN MOEDA m ON sc.id_moeda = m.id_moeda
-        WHERE sc.endereco_carteira = %s
-        ORDER BY m.codigo
+def alterar_status_carteira(endereco_carteira, status):
     """
-    return execute_query(query, (endereco_carteira,))
+    Altera o status da carteira (ATIVA ou BLOQUEADA) e invalida o cache da carteira
+    """
+    if status not in ('ATIVA', 'BLOQUEADA'):
+        raise ValueError(f"Status {status} inválido")
+
+    with transacao() as cursor:
+        cursor.execute(SQL_ALTERAR_STATUS, (status, endereco_carteira))
+        # nenhuma linha alterada: carteira inexistente ou já com esse status
+        if cursor.rowcount == 0:
+            cursor.execute(SQL_OBTER_CARTEIRA, (endereco_carteira,))
+            if not cursor.fetchone():
+                raise CarteiraNaoEncontradaError("Carteira não encontrada")
+    invalidar_carteira(endereco_carteira)
+
+    return True
 
-# consulta o código da moeda
+# consulta o saldo da carteira (pelo cache de saldos)
+# retorna None se a carteira não existir
+def obter_saldos(endereco_carteira):
+    compactos = saldos_em_cache(endereco_carteira)
+    if compactos is AUSENTE:
+        geracao = _cache_saldos.geracao(endereco_carteira)
+        resultado = execute_leitura(
+            sql_obter_saldos(endereco_carteira), (endereco_carteira,), endereco_carteira, confirmar_vazio=True
+        )
+
+        if not resultado:
+            return None
+        compactos = compactar_saldos(resultado)
+        _cache_saldos.guardar(endereco_carteira, compactos, geracao)
+    return montar_saldos(compactos)
+
+# extrato paginado da carteira (depósitos, saques, conversões e transferências)
+# retorna (movimentos, proximo_cursor)
+def obter_extrato(endereco_carteira, limite, codigo_moeda=None, tipos=None,
+                  data_inicio=None, data_fim=None, cursor=None):
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda if codigo_moeda else None
+    query, params = sql_extrato(
+        endereco_carteira, limite, id_moeda, tipos, data_inicio, data_fim,
+        decodificar_cursor(cursor) if cursor else None
+    )
+    linhas = execute_leitura(query, params, endereco_carteira)
+
+    # página vazia: só então confere se a carteira existe
+    if not linhas and not dados_carteira(endereco_carteira):
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+    return montar_extrato(linhas, limite)
+
+# consulta o id da moeda no catálogo em memória
 def obter_id_moeda(codigo):
-    query = """
-        SELECT id_moeda
-        FROM MOEDA
-        WHERE codigo = %s
-    """
-    resultado = execute_query(query, (codigo,))
-    
-    if resultado:
-        return resultado[0]['id_moeda']
+    moeda = obter_catalogo().obter(codigo)
+
+    if moeda:
+        return moeda.id_moeda
     return None
 
-# consulta o saldo da carteira 
+# consulta o saldo da carteira
 def obter_saldo_moeda(endereco_carteira, codigo_moeda):
+    id_moeda = obter_id_moeda(codigo_moeda)
+    if not id_moeda:
+        return None
+
     query = """
-        SELECT sc.saldo
-        FROM SALDO_CARTEIRA sc
-        JOIN MOEDA m ON sc.id_moeda = m.id_moeda
-        WHERE sc.endereco_carteira = %s AND m.codigo = %s
+        SELECT /* obter_saldo_moeda */ saldo
+        FROM SALDO_CARTEIRA
+        WHERE endereco_carteira = %s AND id_moeda = %s
     """
-    resultado = execute_query(query, (endereco_carteira, codigo_moeda))
-    
+    if particionada(endereco_carteira):
+        query = SQL_OBTER_SALDO_MOEDA_PARTICIONADO
+    resultado = execute_query(query, (endereco_carteira, id_moeda))
+
     if resultado:
         return Decimal(str(resultado[0]['saldo']))
     return None
 
-# consulta a chave privada pelo endereço da carteira
+# consulta a chave privada pelo endereço da carteira (pelo cache de carteiras)
 def verificar_chave_privada(endereco_carteira, chave_privada):
-    query = """
-        SELECT hash_chave_privada
-        FROM CARTEIRA
-        WHERE endereco_carteira = %s
-    """
-    resultado = execute_query(query, (endereco_carteira,))
-    
-    if resultado:
-        hash_armazenado = resultado[0]['hash_chave_privada']
-        return validar_chave_privada(chave_privada, hash_armazenado)
+    dados = dados_carteira(endereco_carteira)
+
+    if dados:
+        return validar_chave_privada(chave_privada, dados['hash_chave_privada'])
     return False
 
 
+# UNIDADE DE TRABALHO
+# os serviços que movimentam saldo travam as linhas em ordem canônica (endereço, moeda) e são
+# repetidos do início em deadlock ou espera de trava esgotada (@repetir_em_conflito)
+
+def _carteira_e_saldo(cursor, enderecos, id_moeda, bloquear=False):
+    cursor.execute(sql_carteira_e_saldo(len(enderecos), bloquear), (id_moeda, *enderecos))
+    return {linha['endereco_carteira']: linha for linha in cursor.fetchall()}
+
+# trava os saldos (endereco, id_moeda) em uma query, na ordem da chave primária; retorna {chave: saldo}
+def _travar_saldos(cursor, chaves):
+    chaves = sorted(set(chaves))
+    cursor.execute(sql_travar_saldos(len(chaves)), [valor for chave in chaves for valor in chave])
+    return {
+        (linha['endereco_carteira'], linha['id_moeda']): Decimal(str(linha['saldo']))
+        for linha in cursor.fetchall()
+    }
+
+# credita o saldo; em carteira quente o crédito cai em um slot sorteado, sem travar a linha principal
+# (sem o slot, ex. moeda cadastrada depois, cai na linha principal)
+# retorna False se não houver saldo da moeda para a carteira (carteira inexistente)
+def _creditar(cursor, endereco_carteira, id_moeda, valor):
+    if particionada(endereco_carteira):
+        cursor.execute(SQL_CREDITAR_SLOT, (valor, endereco_carteira, id_moeda, sortear_slot()))
+        if cursor.rowcount:
+            return True
+    cursor.execute(SQL_CREDITAR, (valor, endereco_carteira, id_moeda))
+    return cursor.rowcount > 0
+
+# trava os slots do saldo (até o commit) e retorna a soma deles
+def _travar_slots(cursor, endereco_carteira, id_moeda):
+    cursor.execute(SQL_TRAVAR_SLOTS, (endereco_carteira, id_moeda))
+    return sum((Decimal(str(linha['saldo'])) for linha in cursor.fetchall()), Decimal('0'))
+
+# saldo disponível para um débito, com a linha principal já travada
+# carteira quente: se a linha principal não bastar, recolhe os slots para ela antes de verificar
+def _saldo_para_debito(cursor, endereco_carteira, id_moeda, saldo, valor_total):
+    if saldo is None or saldo >= valor_total or not particionada(endereco_carteira):
+        return saldo
+    soma = _travar_slots(cursor, endereco_carteira, id_moeda)
+    if soma:
+        cursor.execute(SQL_ZERAR_SLOTS, (endereco_carteira, id_moeda))
+        cursor.execute(SQL_CREDITAR, (soma, endereco_carteira, id_moeda))
+    return saldo + soma
+
+# grava os eventos (endereco, id_moeda, tipo, variacao) das alterações de saldo da transação
+# (EVENTOS_SALDO); por último, para que a linha do outbox fique pouco tempo sem commit
+def _registrar_eventos(cursor, eventos):
+    if EVENTOS_SALDO and eventos:
+        cursor.executemany(SQL_INSERIR_EVENTOS, eventos)
+
+# eventos dos movimentos e transferências de um lote, como gravados por _executar_lote
+def _eventos_do_lote(movimentos, transferencias):
+    eventos = []
+    for endereco, id_moeda, valor, tipo, taxa_valor in movimentos:
+        eventos.append((endereco, id_moeda, tipo, valor if tipo == 'DEPOSITO' else -(valor + taxa_valor)))
+    for endereco_origem, endereco_destino, id_moeda, valor, taxa_valor in transferencias:
+        eventos.append((endereco_origem, id_moeda, 'TRANSFERENCIA_ENVIADA', -(valor + taxa_valor)))
+        eventos.append((endereco_destino, id_moeda, 'TRANSFERENCIA_RECEBIDA', valor))
+    return eventos
+
+
 # DEPÓSITOS
 
-def realizar_deposito(endereco_carteira, codigo_moeda, valor):
-    # obter id_moeda, chama a função
-    id_moeda = obter_id_moeda(codigo_moeda)
-    if not id_moeda:
-        raise ValueError(f"Moeda {codigo_moeda} não encontrada")
-    
-    queries = [
-        # insere o depósito na carteira
-        ("""
-            INSERT INTO DEPOSITO_SAQUE (endereco_carteira, id_moeda, valor, tipo, taxa_valor)
-            VALUES (%s, %s, %s, 'DEPOSITO', 0.00000000)
-        """, (endereco_carteira, id_moeda, valor)),
-        
+def realizar_deposito(endereco_carteira, codigo_moeda, valor, idempotencia=None):
+    # moeda validada no catálogo antes de qualquer acesso ao banco
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda
+
+    if DEPOSITO_COMMIT_AGRUPADO:
+        # espera o commit do lote em que o depósito entrou
+        return obter_commit_depositos().enviar((endereco_carteira, id_moeda, valor, idempotencia)).result()
+    return _depositar((endereco_carteira, id_moeda, valor, idempotencia))
+
+@repetir_em_conflito
+def _depositar(deposito):
+    endereco_carteira, id_moeda, valor, idempotencia = deposito
+    marcas = marcar_saldos(endereco_carteira)
+
+    with transacao() as cursor:
+        gravar_idempotencia(cursor, idempotencia, True)
         # faz um update e atualiza para o novo saldo
-        ("""
-            UPDATE SALDO_CARTEIRA
-            SET saldo = saldo + %s
-            WHERE endereco_carteira = %s AND id_moeda = %s
-        """, (valor, endereco_carteira, id_moeda))
-    ]
-    
-    execute_transaction(queries)
+        # nenhuma linha afetada significa que a carteira não existe
+        if not _creditar(cursor, endereco_carteira, id_moeda, valor):
+            raise CarteiraNaoEncontradaError("Carteira não encontrada")
+
+        # insere o depósito na carteira
+        cursor.execute(SQL_INSERIR_DEPOSITO, (endereco_carteira, id_moeda, valor))
+        _registrar_eventos(cursor, [(endereco_carteira, id_moeda, 'DEPOSITO', valor)])
+    aplicar_saldos(marcas, [(endereco_carteira, id_moeda, valor)])
+
     return True
 
+# grava um lote de depósitos (endereco, id_moeda, valor, idempotencia) em uma transação
+# retorna um resultado por depósito: True ou a exceção para quem o enviou
+@repetir_em_conflito
+def _depositar_lote(depositos):
+    # cada valor arredondado como o MySQL faria ao somá-lo sozinho ao saldo
+    valores = [Decimal(str(valor)).quantize(Decimal('1E-8'), ROUND_HALF_UP) for _, _, valor, _ in depositos]
+    totais = {}
+    for (endereco, id_moeda, _, _), valor in zip(depositos, valores):
+        totais[(endereco, id_moeda)] = totais.get((endereco, id_moeda), Decimal('0')) + valor
+
+    marcas = marcar_saldos(*(endereco for endereco, _ in totais))
+    encontradas = set()
+    pedidos = sorted(
+        ((idempotencia, (endereco, id_moeda)) for endereco, id_moeda, _, idempotencia in depositos if idempotencia is not None),
+        key=lambda pedido: pedido[0].chave
+    )
+    with transacao() as cursor:
+        # Idempotency-Keys antes de travar saldos, como nos depósitos avulsos; uma chave já gravada
+        # derruba o lote e o depósito refeito sozinho recebe o erro
+        if pedidos:
+            cursor.executemany(SQL_GRAVAR_IDEMPOTENCIA, [idempotencia.linha(True) for idempotencia, _ in pedidos])
+
+        # um UPDATE por saldo, em ordem fixa para não travar linhas em ordens diferentes
+        for endereco, id_moeda in sorted(totais):
+            if _creditar(cursor, endereco, id_moeda, totais[(endereco, id_moeda)]):
+                encontradas.add((endereco, id_moeda))
+
+        # carteira inexistente: o depósito falha e a chave não fica gravada
+        descartadas = [(idempotencia.chave,) for idempotencia, saldo in pedidos if saldo not in encontradas]
+        if descartadas:
+            cursor.executemany(SQL_DESCARTAR_IDEMPOTENCIA, descartadas)
+
+        movimentos = [
+            (endereco, id_moeda, valor, 'DEPOSITO', Decimal('0'))
+            for (endereco, id_moeda, _, _), valor in zip(depositos, valores) if (endereco, id_moeda) in encontradas
+        ]
+        if movimentos:
+            cursor.executemany(SQL_INSERIR_MOVIMENTO, movimentos)
+        _registrar_eventos(cursor, _eventos_do_lote(movimentos, []))
+    aplicar_saldos(marcas, [(endereco, id_moeda, totais[(endereco, id_moeda)]) for endereco, id_moeda in encontradas])
+
+    return [
+        True if (endereco, id_moeda) in encontradas else CarteiraNaoEncontradaError("Carteira não encontrada")
+        for endereco, id_moeda, _, _ in depositos
+    ]
+
+# committer dos depósitos (DEPOSITO_COMMIT_AGRUPADO), criado na primeira utilização
+_commit_depositos = None
+_commit_depositos_lock = threading.Lock()
+
+def obter_commit_depositos():
+    global _commit_depositos
+    if _commit_depositos is None:
+        with _commit_depositos_lock:
+            if _commit_depositos is None:
+                _commit_depositos = CommitAgrupado(
+                    _depositar_lote, _depositar,
+                    janela=COMMIT_AGRUPADO_JANELA_MS / 1000,
+                    maximo=COMMIT_AGRUPADO_MAX_OPERACOES,
+                    nome='commit-depositos'
+                )
+    return _commit_depositos
+
+def fechar_commit_depositos():
+    global _commit_depositos
+    with _commit_depositos_lock:
+        if _commit_depositos is not None:
+            _commit_depositos.fechar()
+            _commit_depositos = None
+
+def estatisticas_commit_depositos():
+    if _commit_depositos is None:
+        return None
+    return _commit_depositos.estatisticas()
+
+# caches e commit agrupado em GET /metrics
+@registro.coletor
+def _coletar_metricas():
+    entradas, consultas, eventos = [], [], []
+    for nome, cache in (('carteiras', _cache_carteiras), ('saldos', _cache_saldos)):
+        estatisticas = cache.estatisticas()
+        entradas.append(({'cache': nome}, estatisticas['tamanho']))
+        for resultado, chave in (('acerto', 'acertos'), ('acerto_negativo', 'acertos_negativos'), ('falta', 'faltas')):
+            consultas.append(({'cache': nome, 'resultado': resultado}, estatisticas[chave]))
+        for evento in ('expiradas', 'removidas', 'invalidacoes', 'atualizacoes', 'descartadas'):
+            eventos.append(({'cache': nome, 'evento': evento}, estatisticas[evento]))
+    metricas = [
+        ('carteira_cache_entradas', 'gauge', "Entradas em cache", entradas),
+        ('carteira_cache_consultas_total', 'counter', "Consultas ao cache por resultado", consultas),
+        ('carteira_cache_eventos_total', 'counter', "Entradas expiradas, removidas, invalidadas, atualizadas ou descartadas", eventos),
+    ]
+
+    committer = _commit_depositos
+    if committer is not None:
+        estatisticas = committer.estatisticas()
+        metricas += [
+            ('carteira_commit_agrupado_fila', 'gauge', "Depósitos aguardando lote", [({}, estatisticas['fila'])]),
+            ('carteira_commit_agrupado_lotes_total', 'counter', "Lotes gravados", [({}, estatisticas['lotes'])]),
+            ('carteira_commit_agrupado_lotes_com_falha_total', 'counter', "Lotes refeitos operação a operação",
+             [({}, estatisticas['lotes_com_falha'])]),
+            ('carteira_commit_agrupado_tamanho_lote', 'histogram', "Depósitos por lote",
+             [({}, estatisticas['tamanho_lote'])]),
+            ('carteira_commit_agrupado_espera_segundos', 'histogram', "Espera na fila até o lote",
+             [({}, estatisticas['espera_fila'])]),
+            ('carteira_commit_agrupado_duracao_segundos', 'histogram', "Duração da gravação de cada lote",
+             [({}, estatisticas['duracao_lote'])]),
+        ]
+    return metricas
+
 
 # SAQUES
 
-def realizar_saque(endereco_carteira, codigo_moeda, valor, chave_privada):
-    # validar chave privada
-    if not verificar_chave_privada(endereco_carteira, chave_privada):
-        raise ValueError("Chave privada inválida")
-    
-    # obter id_moeda
-    id_moeda = obter_id_moeda(codigo_moeda)
-    if not id_moeda:
-        raise ValueError(f"Moeda {codigo_moeda} não encontrada")
-    
-    # calcular taxa
-    taxa_valor = Decimal(str(valor)) * Decimal(str(TAXA_SAQUE_PERCENTUAL))
-    valor_total = Decimal(str(valor)) + taxa_valor
-    
-    # verificar saldo
-    saldo_atual = obter_saldo_moeda(endereco_carteira, codigo_moeda)
-    if saldo_atual is None or saldo_atual < valor_total:
-        raise ValueError(f"Saldo insuficiente. Necessário: {valor_total}, Disponível: {saldo_atual}")
-    
-    queries = [
+@repetir_em_conflito
+def realizar_saque(endereco_carteira, codigo_moeda, valor, chave_privada, idempotencia=None):
+    # moeda validada no catálogo antes de qualquer acesso ao banco
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda
+    marcas = marcar_saldos(endereco_carteira)
+
+    with transacao() as cursor:
+        # primeiro, para que uma repetição em outro worker espere aqui, antes de travar saldos
+        gravar_idempotencia(cursor, idempotencia, True)
+
+        # autenticação e saldo travado em uma só ida ao banco
+        carteiras = _carteira_e_saldo(cursor, [endereco_carteira], id_moeda, bloquear=True)
+        carteira = carteiras.get(endereco_carteira)
+        if not carteira:
+            raise CarteiraNaoEncontradaError("Carteira não encontrada")
+
+        # validar chave privada
+        autenticar(carteira, chave_privada)
+
+        # calcular taxa
+        taxa_valor, valor_total = calcular_taxa(valor, TAXA_SAQUE_PERCENTUAL)
+
+        # verificar saldo (a linha continua travada até o commit, sem janela entre checar e debitar)
+        saldo = _saldo_para_debito(cursor, endereco_carteira, id_moeda, saldo_da_linha(carteira), valor_total)
+        verificar_saldo(saldo, valor_total)
+
         # Registrar o saque
-        ("""
-            INSERT INTO DEPOSITO_SAQUE (endereco_carteira, id_moeda, valor, tipo, taxa_valor)
-            VALUES (%s, %s, %s, 'SAQUE', %s)
-        """, (endereco_carteira, id_moeda, valor, taxa_valor)),
-        
+        cursor.execute(SQL_INSERIR_SAQUE, (endereco_carteira, id_moeda, valor, taxa_valor))
+
         # Atualizar saldo (debitar valor + taxa)
-        ("""
-            UPDATE SALDO_CARTEIRA
-            SET saldo = saldo - %s
-            WHERE endereco_carteira = %s AND id_moeda = %s
-        """, (valor_total, endereco_carteira, id_moeda))
-    ]
-    
-    execute_transaction(queries)
+        cursor.execute(SQL_DEBITAR, (valor_total, endereco_carteira, id_moeda))
+        _registrar_eventos(cursor, [(endereco_carteira, id_moeda, 'SAQUE', -valor_total)])
+    aplicar_saldos(marcas, [(endereco_carteira, id_moeda, -valor_total)])
+
     return True
 
 
-# CONVERSÃO 
+# CONVERSÃO
 
+# cotação servida pelo cache de cotações (app/cotacoes.py), na frente da API da Coinbase
 def obter_cotacao_coinbase(codigo_origem, codigo_destino):
-    url = f"https://api.coinbase.com/v2/prices/{codigo_origem}-{codigo_destino}/spot" # utilizando API da coinbase para cotação
-    
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        cotacao = Decimal(data['data']['amount'])
-        return cotacao
-    except Exception as e:
-        raise ValueError(f"Erro ao obter cotação: {str(e)}")
-
-
-def realizar_conversao(endereco_carteira, codigo_origem, codigo_destino, valor, chave_privada):
-    # chama a função de verificação de chave privada para ver se ela existe
-    if not verificar_chave_privada(endereco_carteira, chave_privada):
-        raise ValueError("Chave privada inválida")
-    
-    # Obter ids das moedas
-    id_moeda_origem = obter_id_moeda(codigo_origem)
-    id_moeda_destino = obter_id_moeda(codigo_destino)
-    
-    if not id_moeda_origem or not id_moeda_destino:
-        raise ValueError("Moeda não encontrada")
-    
-    # Verificar saldo
-    saldo_origem = obter_saldo_moeda(endereco_carteira, codigo_origem)
-    if saldo_origem is None or saldo_origem < Decimal(str(valor)):
-        raise ValueError(f"Saldo insuficiente na moeda de origem")
-    
-    # Obter cotação
+    return obter_cotacao(codigo_origem, codigo_destino)
+
+
+# trava a cotação atual para uma conversão; a conversão com o id não consulta o provedor
+def cotar_conversao(endereco_carteira, codigo_origem, codigo_destino, valor):
+    id_moeda_origem, id_moeda_destino = moedas_da_conversao(codigo_origem, codigo_destino)
+    if not dados_carteira(endereco_carteira):
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+
     cotacao = obter_cotacao_coinbase(codigo_origem, codigo_destino)
-    
-    # Calcular valores
-    valor_convertido_bruto = Decimal(str(valor)) * cotacao
-    taxa_valor = valor_convertido_bruto * Decimal(str(TAXA_CONVERSAO_PERCENTUAL))
-    valor_destino = valor_convertido_bruto - taxa_valor
-    
-    queries = [
+    return travar_cotacao(endereco_carteira, id_moeda_origem, id_moeda_destino, valor, cotacao)
+
+
+@repetir_em_conflito
+def realizar_conversao(endereco_carteira, codigo_origem, codigo_destino, valor, chave_privada, id_cotacao=None,
+                       idempotencia=None):
+    # Obter ids das moedas no catálogo, antes de qualquer acesso ao banco
+    id_moeda_origem, id_moeda_destino = moedas_da_conversao(codigo_origem, codigo_destino)
+
+    # autentica antes da chamada externa, sem segurar conexão durante a cotação
+    # (hash da chave pelo cache de carteiras)
+    carteira = dados_carteira(endereco_carteira)
+    if not carteira:
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+
+    # chama a função de verificação de chave privada para ver se ela existe
+    autenticar(carteira, chave_privada)
+
+    if id_cotacao is None:
+        # Obter cotação
+        cotacao = obter_cotacao_coinbase(codigo_origem, codigo_destino)
+
+        # Calcular valores
+        valor_destino, taxa_valor = calcular_conversao(valor, cotacao)
+        resultado = resultado_conversao(valor, codigo_origem, codigo_destino, valor_destino, cotacao, taxa_valor)
+        _converter(
+            endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino, cotacao,
+            TAXA_CONVERSAO_PERCENTUAL, taxa_valor, idempotencia, resultado
+        )
+        return resultado
+
+    # cotação travada: valores da emissão, nenhuma chamada externa
+    with obter_cotacoes_travadas().usar(id_cotacao, endereco_carteira, id_moeda_origem, id_moeda_destino, valor) as travada:
+        resultado = resultado_conversao(
+            valor, codigo_origem, codigo_destino, travada.valor_destino, travada.cotacao, travada.taxa_valor,
+            travada.taxa_percentual
+        )
+        _converter(
+            endereco_carteira, id_moeda_origem, id_moeda_destino, valor, travada.valor_destino, travada.cotacao,
+            travada.taxa_percentual, travada.taxa_valor, idempotencia, resultado, travada
+        )
+    return resultado
+
+def _converter(endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino, cotacao,
+               taxa_percentual, taxa_valor, idempotencia=None, resultado=None, travada=None):
+    marcas = marcar_saldos(endereco_carteira)
+
+    with transacao() as cursor:
+        gravar_idempotencia(cursor, idempotencia, resultado)
+        # cotação travada: o segundo uso, em qualquer worker, é recusado pela chave primária
+        gastar_cotacao(cursor, travada)
+
+        # trava os saldos de origem e de destino juntos, na ordem da chave primária, e verifica dentro
+        # da transação que vai debitar (carteira quente recebe o destino em um slot, sem travá-lo)
+        chaves = [(endereco_carteira, id_moeda_origem)]
+        if not particionada(endereco_carteira):
+            chaves.append((endereco_carteira, id_moeda_destino))
+        saldos = _travar_saldos(cursor, chaves)
+        saldo_origem = _saldo_para_debito(
+            cursor, endereco_carteira, id_moeda_origem, saldos.get((endereco_carteira, id_moeda_origem)),
+            Decimal(str(valor))
+        )
+        if saldo_origem is None or saldo_origem < Decimal(str(valor)):
+            raise ValueError(f"Saldo insuficiente na moeda de origem")
+
         # Registrar conversão
-        ("""
-            INSERT INTO CONVERSAO (endereco_carteira, id_moeda_origem, id_moeda_destino, 
-                                   valor_origem, valor_destino, taxa_percentual, taxa_valor, cotacao_utilizada)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino, 
-              TAXA_CONVERSAO_PERCENTUAL, taxa_valor, cotacao)),
-        
+        cursor.execute(SQL_INSERIR_CONVERSAO, (
+            endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino,
+            taxa_percentual, taxa_valor, cotacao
+        ))
+
         # Debitar moeda de origem
-        ("""
-            UPDATE SALDO_CARTEIRA
-            SET saldo = saldo - %s
-            WHERE endereco_carteira = %s AND id_moeda = %s
-        """, (valor, endereco_carteira, id_moeda_origem)),
-        
+        cursor.execute(SQL_DEBITAR, (valor, endereco_carteira, id_moeda_origem))
+
         # Creditar moeda de destino
-        ("""
-            UPDATE SALDO_CARTEIRA
-            SET saldo = saldo + %s
-            WHERE endereco_carteira = %s AND id_moeda = %s
-        """, (valor_destino, endereco_carteira, id_moeda_destino))
-    ]
-    
-    execute_transaction(queries)
-    
-    return {
-        'valor_origem': float(valor),
-        'moeda_origem': codigo_origem,
-        'valor_destino': float(valor_destino),
-        'moeda_destino': codigo_destino,
-        'cotacao': float(cotacao),
-        'taxa_percentual': float(TAXA_CONVERSAO_PERCENTUAL),
-        'taxa_valor': float(taxa_valor)
-    }
+        _creditar(cursor, endereco_carteira, id_moeda_destino, valor_destino)
+        _registrar_eventos(cursor, [
+            (endereco_carteira, id_moeda_origem, 'CONVERSAO', -Decimal(str(valor))),
+            (endereco_carteira, id_moeda_destino, 'CONVERSAO', valor_destino)
+        ])
+    aplicar_saldos(marcas, [
+        (endereco_carteira, id_moeda_origem, -Decimal(str(valor))),
+        (endereco_carteira, id_moeda_destino, valor_destino)
+    ])
 
 
 # TRANSFERÊNCIA
 
-def realizar_transferencia(endereco_origem, endereco_destino, codigo_moeda, valor, chave_privada):
-    # Validar chave privada
-    if not verificar_chave_privada(endereco_origem, chave_privada):
-        raise ValueError("Chave privada inválida")
-    
-    # Verificar se carteira destino existe
-    carteira_destino = obter_carteira(endereco_destino)
-    if not carteira_destino:
-        raise ValueError("Carteira de destino não encontrada")
-    
-    # Obter id_moeda
-    id_moeda = obter_id_moeda(codigo_moeda)
-    if not id_moeda:
-        raise ValueError(f"Moeda {codigo_moeda} não encontrada")
-    
-    # Calcular taxa
-    taxa_valor = Decimal(str(valor)) * Decimal(str(TAXA_TRANSFERENCIA_PERCENTUAL))
-    valor_total = Decimal(str(valor)) + taxa_valor
-    
-    # Verificar saldo
-    saldo_origem = obter_saldo_moeda(endereco_origem, codigo_moeda)
-    if saldo_origem is None or saldo_origem < valor_total:
-        raise ValueError(f"Saldo insuficiente. Necessário: {valor_total}, Disponível: {saldo_origem}")
-    
-    queries = [
+@repetir_em_conflito
+def realizar_transferencia(endereco_origem, endereco_destino, codigo_moeda, valor, chave_privada, idempotencia=None):
+    # moeda validada no catálogo antes de qualquer acesso ao banco
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda
+    marcas = marcar_saldos(endereco_origem, endereco_destino)
+    # destino quente recebe em um slot: a linha principal dele não é travada
+    destino_quente = particionada(endereco_destino)
+
+    with transacao() as cursor:
+        gravar_idempotencia(cursor, idempotencia, True)
+
+        # origem e destino e os dois saldos travados em uma só query
+        carteiras = _carteira_e_saldo(
+            cursor, [endereco_origem] if destino_quente else [endereco_origem, endereco_destino],
+            id_moeda, bloquear=True
+        )
+        carteira_origem = carteiras.get(endereco_origem)
+        if not carteira_origem:
+            raise CarteiraNaoEncontradaError("Carteira de origem não encontrada")
+
+        # Validar chave privada
+        autenticar(carteira_origem, chave_privada)
+
+        # Verificar se carteira destino existe (destino quente: verificado pelo crédito no slot)
+        if not destino_quente and endereco_destino not in carteiras:
+            raise ValueError("Carteira de destino não encontrada")
+
+        # Calcular taxa
+        taxa_valor, valor_total = calcular_taxa(valor, TAXA_TRANSFERENCIA_PERCENTUAL)
+
+        # Verificar saldo
+        saldo = _saldo_para_debito(cursor, endereco_origem, id_moeda, saldo_da_linha(carteira_origem), valor_total)
+        verificar_saldo(saldo, valor_total)
+
         # Registrar transferência
-        ("""
-            INSERT INTO TRANSFERENCIA (endereco_origem, endereco_destino, id_moeda, valor, taxa_valor)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (endereco_origem, endereco_destino, id_moeda, valor, taxa_valor)),
-        
+        cursor.execute(SQL_INSERIR_TRANSFERENCIA, (endereco_origem, endereco_destino, id_moeda, valor, taxa_valor))
+
         # Debitar origem (valor + taxa)
-        ("""
-            UPDATE SALDO_CARTEIRA
-            SET saldo = saldo - %s
-            WHERE endereco_carteira = %s AND id_moeda = %s
-        """, (valor_total, endereco_origem, id_moeda)),
-        
+        cursor.execute(SQL_DEBITAR, (valor_total, endereco_origem, id_moeda))
+
         # Creditar destino (apenas valor, sem taxa)
-        ("""
-            UPDATE SALDO_CARTEIRA
-            SET saldo = saldo + %s
-            WHERE endereco_carteira = %s AND id_moeda = %s
-        """, (valor, endereco_destino, id_moeda))
-    ]
-    
-    execute_transaction(queries)
+        if not _creditar(cursor, endereco_destino, id_moeda, valor):
+            raise ValueError("Carteira de destino não encontrada")
+        _registrar_eventos(cursor, [
+            (endereco_origem, id_moeda, 'TRANSFERENCIA_ENVIADA', -valor_total),
+            (endereco_destino, id_moeda, 'TRANSFERENCIA_RECEBIDA', valor)
+        ])
+    aplicar_saldos(marcas, [(endereco_origem, id_moeda, -valor_total), (endereco_destino, id_moeda, valor)])
+
     return True
+
+
+# OPERAÇÕES EM LOTE
+
+_MENSAGENS_OPERACAO = {
+    'DEPOSITO': "Depósito de {valor} {codigo_moeda} realizado com sucesso",
+    'SAQUE': "Saque de {valor} {codigo_moeda} realizado com sucesso",
+    'TRANSFERENCIA': "Transferência de {valor} {codigo_moeda} realizada com sucesso",
+}
+
+def _resultado_lote(indice, sucesso, mensagem):
+    return {'indice': indice, 'sucesso': sucesso, 'mensagem': mensagem}
+
+# validações que não dependem do banco; retorna o id da moeda
+def _validar_operacao(operacao, moedas):
+    id_moeda = moedas.validar(operacao['codigo_moeda']).id_moeda
+    if operacao['tipo'] != 'DEPOSITO' and not operacao.get('chave_privada'):
+        raise ValueError("Chave privada obrigatória para saques e transferências")
+    if operacao['tipo'] == 'TRANSFERENCIA' and not operacao.get('endereco_destino'):
+        raise ValueError("Carteira de destino obrigatória para transferências")
+    return id_moeda
+
+# aplica uma operação sobre os saldos travados em memória
+# só altera `saldos` depois de todas as verificações passarem
+def _aplicar_operacao(operacao, id_moeda, saldos, movimentos, transferencias):
+    tipo = operacao['tipo']
+    endereco = operacao['endereco_carteira']
+    valor = Decimal(str(operacao['valor']))
+    origem = (endereco, id_moeda)
+
+    if origem not in saldos:
+        raise CarteiraNaoEncontradaError(
+            "Carteira de origem não encontrada" if tipo == 'TRANSFERENCIA' else "Carteira não encontrada"
+        )
+
+    if tipo == 'DEPOSITO':
+        saldos[origem] += valor
+        movimentos.append((endereco, id_moeda, valor, 'DEPOSITO', Decimal('0')))
+        return
+
+    if tipo == 'SAQUE':
+        taxa_valor, valor_total = calcular_taxa(valor, TAXA_SAQUE_PERCENTUAL)
+        verificar_saldo(saldos[origem], valor_total)
+        saldos[origem] -= valor_total
+        movimentos.append((endereco, id_moeda, valor, 'SAQUE', taxa_valor))
+        return
+
+    destino = (operacao['endereco_destino'], id_moeda)
+    if destino not in saldos:
+        raise ValueError("Carteira de destino não encontrada")
+    taxa_valor, valor_total = calcular_taxa(valor, TAXA_TRANSFERENCIA_PERCENTUAL)
+    verificar_saldo(saldos[origem], valor_total)
+    saldos[origem] -= valor_total
+    saldos[destino] += valor
+    transferencias.append((endereco, operacao['endereco_destino'], id_moeda, valor, taxa_valor))
+
+def _executar_lote(cursor, pendentes, resultados, atomico):
+    # autenticação: hashes de todas as carteiras de origem em uma query, antes de travar saldos
+    origens = sorted({op['endereco_carteira'] for _, op, _ in pendentes if op['tipo'] != 'DEPOSITO'})
+    hashes = {}
+    if origens:
+        cursor.execute(sql_hashes_carteiras(len(origens)), origens)
+        hashes = {linha['endereco_carteira']: linha for linha in cursor.fetchall()}
+
+    autenticadas = []
+    for indice, operacao, id_moeda in pendentes:
+        try:
+            if operacao['tipo'] != 'DEPOSITO':
+                carteira = hashes.get(operacao['endereco_carteira'])
+                if not carteira:
+                    raise CarteiraNaoEncontradaError("Carteira não encontrada")
+                autenticar(carteira, operacao['chave_privada'])
+            autenticadas.append((indice, operacao, id_moeda))
+        except (ValueError, CarteiraNaoEncontradaError) as e:
+            resultados[indice] = _resultado_lote(indice, False, str(e))
+
+    if not autenticadas or (atomico and len(autenticadas) < len(pendentes)):
+        return [], []
+
+    # trava todos os saldos afetados de uma vez, em ordem determinística
+    chaves = []
+    for _, operacao, id_moeda in autenticadas:
+        chaves.append((operacao['endereco_carteira'], id_moeda))
+        if operacao['tipo'] == 'TRANSFERENCIA':
+            chaves.append((operacao['endereco_destino'], id_moeda))
+    saldos = _travar_saldos(cursor, chaves)
+    # carteiras quentes: os slots travados entram no saldo; se o lote for gravado, são zerados
+    # e a linha principal recebe o total
+    recolhidos = set()
+    for chave in sorted(saldos):
+        if particionada(chave[0]):
+            soma = _travar_slots(cursor, *chave)
+            if soma:
+                saldos[chave] += soma
+                recolhidos.add(chave)
+    saldos_iniciais = dict(saldos)
+
+    # valida e aplica na ordem do lote, sobre o mesmo retrato dos saldos
+    movimentos, transferencias, aplicadas = [], [], []
+    for indice, operacao, id_moeda in autenticadas:
+        try:
+            _aplicar_operacao(operacao, id_moeda, saldos, movimentos, transferencias)
+            aplicadas.append(indice)
+        except (ValueError, CarteiraNaoEncontradaError) as e:
+            resultados[indice] = _resultado_lote(indice, False, str(e))
+            if atomico:
+                return [], []
+
+    # grava tudo em INSERTs multi-linha: movimentos, transferências e saldos finais
+    if movimentos:
+        cursor.executemany(SQL_INSERIR_MOVIMENTO, movimentos)
+    if transferencias:
+        cursor.executemany(SQL_INSERIR_TRANSFERENCIA, transferencias)
+    alterados = [
+        (endereco, id_moeda, saldo) for (endereco, id_moeda), saldo in saldos.items()
+        if saldo != saldos_iniciais[(endereco, id_moeda)] or (endereco, id_moeda) in recolhidos
+    ]
+    for endereco, id_moeda in sorted(recolhidos):
+        cursor.execute(SQL_ZERAR_SLOTS, (endereco, id_moeda))
+    if alterados:
+        cursor.executemany(SQL_GRAVAR_SALDOS, alterados)
+    _registrar_eventos(cursor, _eventos_do_lote(movimentos, transferencias))
+
+    variacoes = [
+        (endereco, id_moeda, saldo - saldos_iniciais[(endereco, id_moeda)])
+        for endereco, id_moeda, saldo in alterados if saldo != saldos_iniciais[(endereco, id_moeda)]
+    ]
+    return aplicadas, variacoes
+
+@repetir_em_conflito
+def realizar_operacoes_em_lote(operacoes, atomico=True):
+    """
+    Aplica uma lista de depósitos, saques e transferências em uma única transação
+
+    Args:
+        operacoes: lista de dicionários com tipo, endereco_carteira, endereco_destino,
+            codigo_moeda, valor e chave_privada
+        atomico: True aplica tudo ou nada; False aplica as operações válidas e
+            rejeita as demais
+
+    Returns:
+        Dicionário com sucesso, aplicadas e resultados (um por operação, na ordem recebida)
+    """
+    moedas = obter_catalogo()
+    resultados = [None] * len(operacoes)
+
+    pendentes = []
+    for indice, operacao in enumerate(operacoes):
+        try:
+            pendentes.append((indice, operacao, _validar_operacao(operacao, moedas)))
+        except ValueError as e:
+            resultados[indice] = _resultado_lote(indice, False, str(e))
+
+    aplicadas = []
+    if pendentes and not (atomico and len(pendentes) < len(operacoes)):
+        marcas = marcar_saldos(*(
+            endereco for _, operacao, _ in pendentes
+            for endereco in (operacao['endereco_carteira'], operacao.get('endereco_destino')) if endereco
+        ))
+        with transacao() as cursor:
+            aplicadas, variacoes = _executar_lote(cursor, pendentes, resultados, atomico)
+        aplicar_saldos(marcas, variacoes)
+
+    for indice in aplicadas:
+        operacao = operacoes[indice]
+        mensagem = _MENSAGENS_OPERACAO[operacao['tipo']].format(**operacao)
+        resultados[indice] = _resultado_lote(indice, True, mensagem)
+    # modo atômico: uma operação inválida rejeita o lote inteiro
+    for indice, resultado in enumerate(resultados):
+        if resultado is None:
+            resultados[indice] = _resultado_lote(indice, False, "Não aplicada: lote rejeitado (modo atômico)")
+
+    return {
+        'sucesso': len(aplicadas) == len(operacoes),
+        'aplicadas': len(aplicadas),
+        'resultados': resultados
+    }
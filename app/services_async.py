@@ -0,0 +1,320 @@
+"""
+Versão assíncrona dos serviços (modo API_MODO=async)
+
+Mesmas regras de app/services.py, com aiomysql e cotação via httpx, para que os
+endpoints `async def` não ocupem threads do pool do FastAPI enquanto esperam I/O.
+As queries e os cálculos são compartilhados com a versão síncrona.
+"""
+import asyncio
+from decimal import Decimal
+from app.cache import AUSENTE
+from app.database_async import execute_leitura_async, transacao_async, repetir_em_conflito_async
+from app.moedas import obter_catalogo
+from app.utils import gerar_chave_publica, gerar_chave_privada, hash_chave_privada
+from app.config import (
+    TAXA_SAQUE_PERCENTUAL, TAXA_CONVERSAO_PERCENTUAL, TAXA_TRANSFERENCIA_PERCENTUAL, DEPOSITO_COMMIT_AGRUPADO,
+    EVENTOS_SALDO
+)
+from app.cotacoes import obter_cotacao_async
+from app.cotacoes_travadas import gastar_cotacao_async, obter_cotacoes_travadas
+from app.extrato import sql_extrato, decodificar_cursor, montar_extrato
+from app.idempotencia import gravar_idempotencia_async
+from app.services import (
+    CarteiraNaoEncontradaError, carteira_guardada,
+    SQL_INSERIR_CARTEIRA, SQL_INSERIR_SALDO_ZERADO, SQL_OBTER_DADOS_CARTEIRA,
+    SQL_CREDITAR, SQL_DEBITAR, SQL_INSERIR_DEPOSITO,
+    SQL_INSERIR_SAQUE, SQL_INSERIR_CONVERSAO, SQL_INSERIR_TRANSFERENCIA, sql_carteira_e_saldo, sql_travar_saldos,
+    SQL_CREDITAR_SLOT, SQL_TRAVAR_SLOTS, SQL_ZERAR_SLOTS, SQL_INSERIR_EVENTOS, sql_obter_saldos, particionada, sortear_slot,
+    autenticar, saldo_da_linha, calcular_taxa, verificar_saldo, moedas_da_conversao,
+    calcular_conversao, resultado_conversao, travar_cotacao, montar_saldos, compactar_saldos, carteira_publica,
+    obter_cache_carteiras, invalidar_carteira, obter_cache_saldos, saldos_em_cache, marcar_saldos, aplicar_saldos,
+    obter_commit_depositos
+)
+
+
+# CACHE DE CARTEIRAS
+# mesmo cache da versão síncrona; só a leitura do banco na falta muda
+
+async def dados_carteira(endereco_carteira):
+    cache = obter_cache_carteiras()
+    dados = cache.obter(endereco_carteira)
+    if dados is AUSENTE:
+        geracao = cache.geracao(endereco_carteira)
+        resultado = await execute_leitura_async(
+            SQL_OBTER_DADOS_CARTEIRA, (endereco_carteira,), endereco_carteira, confirmar_vazio=True
+        )
+        dados = resultado[0] if resultado else None
+        cache.guardar(endereco_carteira, dados, geracao)
+    return dados
+
+
+# CARTEIRAS
+
+async def criar_carteira(idempotencia=None):
+    endereco_carteira = gerar_chave_publica()
+    chave_privada = gerar_chave_privada()
+    hash_chave = hash_chave_privada(chave_privada)
+    resultado = {
+        'endereco_carteira': endereco_carteira,
+        'chave_privada': chave_privada
+    }
+    moedas = obter_catalogo()
+
+    async with transacao_async() as cursor:
+        await gravar_idempotencia_async(cursor, idempotencia, carteira_guardada(resultado))
+        await cursor.execute(SQL_INSERIR_CARTEIRA, (endereco_carteira, hash_chave))
+        await cursor.executemany(
+            SQL_INSERIR_SALDO_ZERADO, [(endereco_carteira, moeda.id_moeda) for moeda in moedas]
+        )
+    invalidar_carteira(endereco_carteira)
+
+    return resultado
+
+async def obter_carteira(endereco_carteira):
+    dados = await dados_carteira(endereco_carteira)
+
+    if dados:
+        return carteira_publica(dados)
+    return None
+
+# retorna None se a carteira não existir
+async def obter_saldos(endereco_carteira):
+    compactos = saldos_em_cache(endereco_carteira)
+    if compactos is AUSENTE:
+        geracao = obter_cache_saldos().geracao(endereco_carteira)
+        resultado = await execute_leitura_async(
+            sql_obter_saldos(endereco_carteira), (endereco_carteira,), endereco_carteira, confirmar_vazio=True
+        )
+
+        if not resultado:
+            return None
+        compactos = compactar_saldos(resultado)
+        obter_cache_saldos().guardar(endereco_carteira, compactos, geracao)
+    return montar_saldos(compactos)
+
+async def obter_extrato(endereco_carteira, limite, codigo_moeda=None, tipos=None,
+                        data_inicio=None, data_fim=None, cursor=None):
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda if codigo_moeda else None
+    query, params = sql_extrato(
+        endereco_carteira, limite, id_moeda, tipos, data_inicio, data_fim,
+        decodificar_cursor(cursor) if cursor else None
+    )
+    linhas = await execute_leitura_async(query, params, endereco_carteira)
+
+    if not linhas and not await dados_carteira(endereco_carteira):
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+    return montar_extrato(linhas, limite)
+
+
+async def _carteira_e_saldo(cursor, enderecos, id_moeda, bloquear=False):
+    await cursor.execute(sql_carteira_e_saldo(len(enderecos), bloquear), (id_moeda, *enderecos))
+    return {linha['endereco_carteira']: linha for linha in await cursor.fetchall()}
+
+async def _travar_saldos(cursor, chaves):
+    chaves = sorted(set(chaves))
+    await cursor.execute(sql_travar_saldos(len(chaves)), [valor for chave in chaves for valor in chave])
+    return {
+        (linha['endereco_carteira'], linha['id_moeda']): Decimal(str(linha['saldo']))
+        for linha in await cursor.fetchall()
+    }
+
+# crédito em slot sorteado para carteiras quentes (ver _creditar em app/services.py)
+async def _creditar(cursor, endereco_carteira, id_moeda, valor):
+    if particionada(endereco_carteira):
+        await cursor.execute(SQL_CREDITAR_SLOT, (valor, endereco_carteira, id_moeda, sortear_slot()))
+        if cursor.rowcount:
+            return True
+    await cursor.execute(SQL_CREDITAR, (valor, endereco_carteira, id_moeda))
+    return cursor.rowcount > 0
+
+async def _saldo_para_debito(cursor, endereco_carteira, id_moeda, saldo, valor_total):
+    if saldo is None or saldo >= valor_total or not particionada(endereco_carteira):
+        return saldo
+    await cursor.execute(SQL_TRAVAR_SLOTS, (endereco_carteira, id_moeda))
+    soma = sum((Decimal(str(linha['saldo'])) for linha in await cursor.fetchall()), Decimal('0'))
+    if soma:
+        await cursor.execute(SQL_ZERAR_SLOTS, (endereco_carteira, id_moeda))
+        await cursor.execute(SQL_CREDITAR, (soma, endereco_carteira, id_moeda))
+    return saldo + soma
+
+# eventos de saldo na mesma transação (ver _registrar_eventos em app/services.py)
+async def _registrar_eventos(cursor, eventos):
+    if EVENTOS_SALDO and eventos:
+        await cursor.executemany(SQL_INSERIR_EVENTOS, eventos)
+
+
+# DEPÓSITOS
+
+async def realizar_deposito(endereco_carteira, codigo_moeda, valor, idempotencia=None):
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda
+
+    if DEPOSITO_COMMIT_AGRUPADO:
+        # mesmo committer da versão síncrona; a espera pelo commit do lote não ocupa o event loop
+        return await asyncio.wrap_future(
+            obter_commit_depositos().enviar((endereco_carteira, id_moeda, valor, idempotencia))
+        )
+    return await _depositar(endereco_carteira, id_moeda, valor, idempotencia)
+
+@repetir_em_conflito_async
+async def _depositar(endereco_carteira, id_moeda, valor, idempotencia=None):
+    marcas = marcar_saldos(endereco_carteira)
+
+    async with transacao_async() as cursor:
+        await gravar_idempotencia_async(cursor, idempotencia, True)
+        if not await _creditar(cursor, endereco_carteira, id_moeda, valor):
+            raise CarteiraNaoEncontradaError("Carteira não encontrada")
+
+        await cursor.execute(SQL_INSERIR_DEPOSITO, (endereco_carteira, id_moeda, valor))
+        await _registrar_eventos(cursor, [(endereco_carteira, id_moeda, 'DEPOSITO', valor)])
+    aplicar_saldos(marcas, [(endereco_carteira, id_moeda, valor)])
+
+    return True
+
+
+# SAQUES
+
+@repetir_em_conflito_async
+async def realizar_saque(endereco_carteira, codigo_moeda, valor, chave_privada, idempotencia=None):
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda
+    marcas = marcar_saldos(endereco_carteira)
+
+    async with transacao_async() as cursor:
+        await gravar_idempotencia_async(cursor, idempotencia, True)
+        carteiras = await _carteira_e_saldo(cursor, [endereco_carteira], id_moeda, bloquear=True)
+        carteira = carteiras.get(endereco_carteira)
+        if not carteira:
+            raise CarteiraNaoEncontradaError("Carteira não encontrada")
+
+        autenticar(carteira, chave_privada)
+
+        taxa_valor, valor_total = calcular_taxa(valor, TAXA_SAQUE_PERCENTUAL)
+        saldo = await _saldo_para_debito(cursor, endereco_carteira, id_moeda, saldo_da_linha(carteira), valor_total)
+        verificar_saldo(saldo, valor_total)
+
+        await cursor.execute(SQL_INSERIR_SAQUE, (endereco_carteira, id_moeda, valor, taxa_valor))
+        await cursor.execute(SQL_DEBITAR, (valor_total, endereco_carteira, id_moeda))
+        await _registrar_eventos(cursor, [(endereco_carteira, id_moeda, 'SAQUE', -valor_total)])
+    aplicar_saldos(marcas, [(endereco_carteira, id_moeda, -valor_total)])
+
+    return True
+
+
+# CONVERSÃO
+
+async def cotar_conversao(endereco_carteira, codigo_origem, codigo_destino, valor):
+    id_moeda_origem, id_moeda_destino = moedas_da_conversao(codigo_origem, codigo_destino)
+    if not await dados_carteira(endereco_carteira):
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+
+    cotacao = await obter_cotacao_async(codigo_origem, codigo_destino)
+    return travar_cotacao(endereco_carteira, id_moeda_origem, id_moeda_destino, valor, cotacao)
+
+
+@repetir_em_conflito_async
+async def realizar_conversao(endereco_carteira, codigo_origem, codigo_destino, valor, chave_privada, id_cotacao=None,
+                             idempotencia=None):
+    id_moeda_origem, id_moeda_destino = moedas_da_conversao(codigo_origem, codigo_destino)
+
+    carteira = await dados_carteira(endereco_carteira)
+    if not carteira:
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+    autenticar(carteira, chave_privada)
+
+    if id_cotacao is None:
+        # a espera pela cotação não segura conexão nem thread
+        cotacao = await obter_cotacao_async(codigo_origem, codigo_destino)
+        valor_destino, taxa_valor = calcular_conversao(valor, cotacao)
+        resultado = resultado_conversao(valor, codigo_origem, codigo_destino, valor_destino, cotacao, taxa_valor)
+        await _converter(
+            endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino, cotacao,
+            TAXA_CONVERSAO_PERCENTUAL, taxa_valor, idempotencia, resultado
+        )
+        return resultado
+
+    with obter_cotacoes_travadas().usar(id_cotacao, endereco_carteira, id_moeda_origem, id_moeda_destino, valor) as travada:
+        resultado = resultado_conversao(
+            valor, codigo_origem, codigo_destino, travada.valor_destino, travada.cotacao, travada.taxa_valor,
+            travada.taxa_percentual
+        )
+        await _converter(
+            endereco_carteira, id_moeda_origem, id_moeda_destino, valor, travada.valor_destino, travada.cotacao,
+            travada.taxa_percentual, travada.taxa_valor, idempotencia, resultado, travada
+        )
+    return resultado
+
+async def _converter(endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino, cotacao,
+                     taxa_percentual, taxa_valor, idempotencia=None, resultado=None, travada=None):
+    marcas = marcar_saldos(endereco_carteira)
+
+    async with transacao_async() as cursor:
+        await gravar_idempotencia_async(cursor, idempotencia, resultado)
+        # cotação travada: o segundo uso, em qualquer worker, é recusado pela chave primária
+        await gastar_cotacao_async(cursor, travada)
+        chaves = [(endereco_carteira, id_moeda_origem)]
+        if not particionada(endereco_carteira):
+            chaves.append((endereco_carteira, id_moeda_destino))
+        saldos = await _travar_saldos(cursor, chaves)
+        saldo_origem = await _saldo_para_debito(
+            cursor, endereco_carteira, id_moeda_origem, saldos.get((endereco_carteira, id_moeda_origem)),
+            Decimal(str(valor))
+        )
+        if saldo_origem is None or saldo_origem < Decimal(str(valor)):
+            raise ValueError("Saldo insuficiente na moeda de origem")
+
+        await cursor.execute(SQL_INSERIR_CONVERSAO, (
+            endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino,
+            taxa_percentual, taxa_valor, cotacao
+        ))
+        await cursor.execute(SQL_DEBITAR, (valor, endereco_carteira, id_moeda_origem))
+        await _creditar(cursor, endereco_carteira, id_moeda_destino, valor_destino)
+        await _registrar_eventos(cursor, [
+            (endereco_carteira, id_moeda_origem, 'CONVERSAO', -Decimal(str(valor))),
+            (endereco_carteira, id_moeda_destino, 'CONVERSAO', valor_destino)
+        ])
+    aplicar_saldos(marcas, [
+        (endereco_carteira, id_moeda_origem, -Decimal(str(valor))),
+        (endereco_carteira, id_moeda_destino, valor_destino)
+    ])
+
+
+# TRANSFERÊNCIA
+
+@repetir_em_conflito_async
+async def realizar_transferencia(endereco_origem, endereco_destino, codigo_moeda, valor, chave_privada,
+                                 idempotencia=None):
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda
+    marcas = marcar_saldos(endereco_origem, endereco_destino)
+    destino_quente = particionada(endereco_destino)
+
+    async with transacao_async() as cursor:
+        await gravar_idempotencia_async(cursor, idempotencia, True)
+        carteiras = await _carteira_e_saldo(
+            cursor, [endereco_origem] if destino_quente else [endereco_origem, endereco_destino],
+            id_moeda, bloquear=True
+        )
+        carteira_origem = carteiras.get(endereco_origem)
+        if not carteira_origem:
+            raise CarteiraNaoEncontradaError("Carteira de origem não encontrada")
+
+        autenticar(carteira_origem, chave_privada)
+
+        if not destino_quente and endereco_destino not in carteiras:
+            raise ValueError("Carteira de destino não encontrada")
+
+        taxa_valor, valor_total = calcular_taxa(valor, TAXA_TRANSFERENCIA_PERCENTUAL)
+        saldo = await _saldo_para_debito(
+            cursor, endereco_origem, id_moeda, saldo_da_linha(carteira_origem), valor_total
+        )
+        verificar_saldo(saldo, valor_total)
+
+        await cursor.execute(SQL_INSERIR_TRANSFERENCIA, (endereco_origem, endereco_destino, id_moeda, valor, taxa_valor))
+        await cursor.execute(SQL_DEBITAR, (valor_total, endereco_origem, id_moeda))
+        if not await _creditar(cursor, endereco_destino, id_moeda, valor):
+            raise ValueError("Carteira de destino não encontrada")
+        await _registrar_eventos(cursor, [
+            (endereco_origem, id_moeda, 'TRANSFERENCIA_ENVIADA', -valor_total),
+            (endereco_destino, id_moeda, 'TRANSFERENCIA_RECEBIDA', valor)
+        ])
+    aplicar_saldos(marcas, [(endereco_origem, id_moeda, -valor_total), (endereco_destino, id_moeda, valor)])
+
+    return True
@@ -0,0 +1,307 @@
+"""
+Serviços da carteira sobre o livro-razão em memória (ARMAZENAMENTO=memoria)
+
+Mesmas funções, argumentos, retornos e erros de app/services.py, sem MySQL: cada operação
+é uma transação do livro (app/livro.py), gravada no log antes de responder. O livro não guarda
+o resultado das operações com Idempotency-Key (`idempotencia`): ele fica só no LRU de
+app/idempotencia.py e não sobrevive a um reinício.
+"""
+from decimal import Decimal
+from app.config import (
+    TAXA_SAQUE_PERCENTUAL, TAXA_CONVERSAO_PERCENTUAL, TAXA_TRANSFERENCIA_PERCENTUAL, LOTE_CARTEIRAS_BLOCO
+)
+from app.cotacoes_travadas import obter_cotacoes_travadas
+from app.extrato import TIPOS_MOVIMENTO, decodificar_cursor, montar_extrato
+from app.livro import obter_livro
+from app.moedas import obter_catalogo
+from app.services import (
+    CarteiraNaoEncontradaError, autenticar, calcular_taxa, verificar_saldo, moedas_da_conversao,
+    calcular_conversao, resultado_conversao, travar_cotacao, carteira_publica, montar_saldos, obter_cotacao_coinbase,
+    _MENSAGENS_OPERACAO, _resultado_lote, _validar_operacao, _aplicar_operacao
+)
+from app.utils import (
+    gerar_chave_publica, gerar_chave_privada, gerar_chaves_em_lote, hash_chave_privada, validar_chave_privada
+)
+
+
+# CARTEIRAS
+
+def criar_carteira(idempotencia=None):
+    endereco_carteira = gerar_chave_publica()
+    chave_privada = gerar_chave_privada()
+
+    with obter_livro().transacao() as t:
+        t.criar_carteira(endereco_carteira, hash_chave_privada(chave_privada))
+
+    return {
+        'endereco_carteira': endereco_carteira,
+        'chave_privada': chave_privada
+    }
+
+def criar_carteiras_em_lote(quantidade, tamanho_bloco=LOTE_CARTEIRAS_BLOCO):
+    """
+    Cria `quantidade` carteiras em uma única transação do livro
+
+    Gerador, como em app/services.py: devolve as chaves bloco a bloco e as carteiras só passam
+    a existir quando ele termina (uma linha no log com o lote inteiro).
+    """
+    novas = []
+    for inicio in range(0, quantidade, tamanho_bloco):
+        chaves = gerar_chaves_em_lote(min(tamanho_bloco, quantidade - inicio))
+        novas.extend((endereco, hash_chave_privada(chave)) for endereco, chave in chaves)
+        yield chaves
+
+    with obter_livro().transacao() as t:
+        for endereco, hash_chave in novas:
+            t.criar_carteira(endereco, hash_chave)
+
+def obter_carteira(endereco_carteira):
+    dados = obter_livro().dados_carteira(endereco_carteira)
+
+    if dados:
+        return carteira_publica(dados)
+    return None
+
+def alterar_status_carteira(endereco_carteira, status):
+    if status not in ('ATIVA', 'BLOQUEADA'):
+        raise ValueError(f"Status {status} inválido")
+
+    with obter_livro().transacao() as t:
+        if not t.carteira(endereco_carteira):
+            raise CarteiraNaoEncontradaError("Carteira não encontrada")
+        t.alterar_status(endereco_carteira, status)
+
+    return True
+
+def obter_saldos(endereco_carteira):
+    saldos = obter_livro().saldos(endereco_carteira)
+
+    if saldos is None:
+        return None
+    return montar_saldos((obter_catalogo(), saldos))
+
+def obter_extrato(endereco_carteira, limite, codigo_moeda=None, tipos=None,
+                  data_inicio=None, data_fim=None, cursor=None):
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda if codigo_moeda else None
+    if tipos and not any(tipo in TIPOS_MOVIMENTO for tipo in tipos):
+        raise ValueError("Nenhum tipo de movimento válido informado")
+
+    livro = obter_livro()
+    linhas = livro.extrato(
+        endereco_carteira, limite, id_moeda, tipos, data_inicio, data_fim,
+        decodificar_cursor(cursor) if cursor else None
+    )
+    if not linhas and not livro.dados_carteira(endereco_carteira):
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+    return montar_extrato(linhas, limite)
+
+def obter_id_moeda(codigo):
+    moeda = obter_catalogo().obter(codigo)
+
+    if moeda:
+        return moeda.id_moeda
+    return None
+
+def obter_saldo_moeda(endereco_carteira, codigo_moeda):
+    id_moeda = obter_id_moeda(codigo_moeda)
+    if not id_moeda:
+        return None
+
+    with obter_livro().transacao() as t:
+        return t.saldo(endereco_carteira, id_moeda)
+
+def verificar_chave_privada(endereco_carteira, chave_privada):
+    dados = obter_livro().dados_carteira(endereco_carteira)
+
+    if dados:
+        return validar_chave_privada(chave_privada, dados['hash_chave_privada'])
+    return False
+
+
+# DEPÓSITOS
+
+def realizar_deposito(endereco_carteira, codigo_moeda, valor, idempotencia=None):
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda
+
+    with obter_livro().transacao() as t:
+        if not t.somar(endereco_carteira, id_moeda, valor):
+            raise CarteiraNaoEncontradaError("Carteira não encontrada")
+        t.deposito_saque(endereco_carteira, id_moeda, valor, 'DEPOSITO', Decimal('0'))
+
+    return True
+
+
+# SAQUES
+
+def realizar_saque(endereco_carteira, codigo_moeda, valor, chave_privada, idempotencia=None):
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda
+
+    with obter_livro().transacao() as t:
+        carteira = t.carteira(endereco_carteira)
+        if not carteira:
+            raise CarteiraNaoEncontradaError("Carteira não encontrada")
+        autenticar(carteira, chave_privada)
+
+        taxa_valor, valor_total = calcular_taxa(valor, TAXA_SAQUE_PERCENTUAL)
+        verificar_saldo(t.saldo(endereco_carteira, id_moeda), valor_total)
+
+        t.deposito_saque(endereco_carteira, id_moeda, valor, 'SAQUE', taxa_valor)
+        t.somar(endereco_carteira, id_moeda, -valor_total)
+
+    return True
+
+
+# CONVERSÃO
+
+def cotar_conversao(endereco_carteira, codigo_origem, codigo_destino, valor):
+    id_moeda_origem, id_moeda_destino = moedas_da_conversao(codigo_origem, codigo_destino)
+    if not obter_livro().dados_carteira(endereco_carteira):
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+
+    cotacao = obter_cotacao_coinbase(codigo_origem, codigo_destino)
+    return travar_cotacao(endereco_carteira, id_moeda_origem, id_moeda_destino, valor, cotacao)
+
+def realizar_conversao(endereco_carteira, codigo_origem, codigo_destino, valor, chave_privada, id_cotacao=None,
+                       idempotencia=None):
+    id_moeda_origem, id_moeda_destino = moedas_da_conversao(codigo_origem, codigo_destino)
+
+    # autentica e busca a cotação fora da trava do livro
+    carteira = obter_livro().dados_carteira(endereco_carteira)
+    if not carteira:
+        raise CarteiraNaoEncontradaError("Carteira não encontrada")
+    autenticar(carteira, chave_privada)
+
+    if id_cotacao is None:
+        cotacao = obter_cotacao_coinbase(codigo_origem, codigo_destino)
+        valor_destino, taxa_valor = calcular_conversao(valor, cotacao)
+        _converter(
+            endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino, cotacao,
+            TAXA_CONVERSAO_PERCENTUAL, taxa_valor
+        )
+        return resultado_conversao(valor, codigo_origem, codigo_destino, valor_destino, cotacao, taxa_valor)
+
+    with obter_cotacoes_travadas().usar(id_cotacao, endereco_carteira, id_moeda_origem, id_moeda_destino, valor) as travada:
+        _converter(
+            endereco_carteira, id_moeda_origem, id_moeda_destino, valor, travada.valor_destino, travada.cotacao,
+            travada.taxa_percentual, travada.taxa_valor
+        )
+    return resultado_conversao(
+        valor, codigo_origem, codigo_destino, travada.valor_destino, travada.cotacao, travada.taxa_valor,
+        travada.taxa_percentual
+    )
+
+def _converter(endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino, cotacao,
+               taxa_percentual, taxa_valor):
+    with obter_livro().transacao() as t:
+        saldo_origem = t.saldo(endereco_carteira, id_moeda_origem)
+        if saldo_origem is None or saldo_origem < Decimal(str(valor)):
+            raise ValueError("Saldo insuficiente na moeda de origem")
+
+        t.conversao(
+            endereco_carteira, id_moeda_origem, id_moeda_destino, valor, valor_destino,
+            taxa_percentual, taxa_valor, cotacao
+        )
+        t.somar(endereco_carteira, id_moeda_origem, -Decimal(str(valor)))
+        t.somar(endereco_carteira, id_moeda_destino, valor_destino)
+
+
+# TRANSFERÊNCIA
+
+def realizar_transferencia(endereco_origem, endereco_destino, codigo_moeda, valor, chave_privada, idempotencia=None):
+    id_moeda = obter_catalogo().validar(codigo_moeda).id_moeda
+
+    with obter_livro().transacao() as t:
+        carteira_origem = t.carteira(endereco_origem)
+        if not carteira_origem:
+            raise CarteiraNaoEncontradaError("Carteira de origem não encontrada")
+        autenticar(carteira_origem, chave_privada)
+
+        if not t.carteira(endereco_destino):
+            raise ValueError("Carteira de destino não encontrada")
+
+        taxa_valor, valor_total = calcular_taxa(valor, TAXA_TRANSFERENCIA_PERCENTUAL)
+        verificar_saldo(t.saldo(endereco_origem, id_moeda), valor_total)
+
+        t.transferencia(endereco_origem, endereco_destino, id_moeda, valor, taxa_valor)
+        t.somar(endereco_origem, id_moeda, -valor_total)
+        t.somar(endereco_destino, id_moeda, valor)
+
+    return True
+
+
+# OPERAÇÕES EM LOTE
+
+def _executar_lote(t, pendentes, resultados, atomico):
+    autenticadas = []
+    for indice, operacao, id_moeda in pendentes:
+        try:
+            if operacao['tipo'] != 'DEPOSITO':
+                carteira = t.carteira(operacao['endereco_carteira'])
+                if not carteira:
+                    raise CarteiraNaoEncontradaError("Carteira não encontrada")
+                autenticar(carteira, operacao['chave_privada'])
+            autenticadas.append((indice, operacao, id_moeda))
+        except (ValueError, CarteiraNaoEncontradaError) as e:
+            resultados[indice] = _resultado_lote(indice, False, str(e))
+
+    if not autenticadas or (atomico and len(autenticadas) < len(pendentes)):
+        return []
+
+    # saldos existentes das carteiras envolvidas, como o retrato travado da versão MySQL
+    saldos = {}
+    for _, operacao, id_moeda in autenticadas:
+        for endereco in (operacao['endereco_carteira'], operacao.get('endereco_destino')):
+            if endereco and (endereco, id_moeda) not in saldos:
+                saldo = t.saldo(endereco, id_moeda)
+                if saldo is not None:
+                    saldos[(endereco, id_moeda)] = saldo
+    saldos_iniciais = dict(saldos)
+
+    movimentos, transferencias, aplicadas = [], [], []
+    for indice, operacao, id_moeda in autenticadas:
+        try:
+            _aplicar_operacao(operacao, id_moeda, saldos, movimentos, transferencias)
+            aplicadas.append(indice)
+        except (ValueError, CarteiraNaoEncontradaError) as e:
+            resultados[indice] = _resultado_lote(indice, False, str(e))
+            if atomico:
+                return []
+
+    for endereco, id_moeda, valor, tipo, taxa_valor in movimentos:
+        t.deposito_saque(endereco, id_moeda, valor, tipo, taxa_valor)
+    for transferencia in transferencias:
+        t.transferencia(*transferencia)
+    for (endereco, id_moeda), saldo in saldos.items():
+        if saldo != saldos_iniciais[(endereco, id_moeda)]:
+            t.gravar_saldo(endereco, id_moeda, saldo)
+    return aplicadas
+
+def realizar_operacoes_em_lote(operacoes, atomico=True):
+    moedas = obter_catalogo()
+    resultados = [None] * len(operacoes)
+
+    pendentes = []
+    for indice, operacao in enumerate(operacoes):
+        try:
+            pendentes.append((indice, operacao, _validar_operacao(operacao, moedas)))
+        except ValueError as e:
+            resultados[indice] = _resultado_lote(indice, False, str(e))
+
+    aplicadas = []
+    if pendentes and not (atomico and len(pendentes) < len(operacoes)):
+        with obter_livro().transacao() as t:
+            aplicadas = _executar_lote(t, pendentes, resultados, atomico)
+
+    for indice in aplicadas:
+        operacao = operacoes[indice]
+        mensagem = _MENSAGENS_OPERACAO[operacao['tipo']].format(**operacao)
+        resultados[indice] = _resultado_lote(indice, True, mensagem)
+    for indice, resultado in enumerate(resultados):
+        if resultado is None:
+            resultados[indice] = _resultado_lote(indice, False, "Não aplicada: lote rejeitado (modo atômico)")
+
+    return {
+        'sucesso': len(aplicadas) == len(operacoes),
+        'aplicadas': len(aplicadas),
+        'resultados': resultados
+    }
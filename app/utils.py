@@ -23,6 +23,27 @@ def gerar_chave_privada():
     return secrets.token_hex(PRIVATE_KEY_SIZE)
 
 
+def gerar_chaves_em_lote(quantidade):
+    """
+    Gera pares (chave pública, chave privada) em lote, com uma única leitura do gerador seguro
+
+    Args:
+        quantidade: Número de pares a gerar
+
+    Returns:
+        Lista de tuplas (endereco_carteira, chave_privada) em hexadecimal
+    """
+    tamanho = PUBLIC_KEY_SIZE + PRIVATE_KEY_SIZE
+    bloco = secrets.token_bytes(tamanho * quantidade)
+    chaves = []
+    for i in range(0, len(bloco), tamanho):
+        chaves.append((
+            bloco[i:i + PUBLIC_KEY_SIZE].hex(),
+            bloco[i + PUBLIC_KEY_SIZE:i + tamanho].hex()
+        ))
+    return chaves
+
+
 def hash_chave_privada(chave_privada):
     """
     Gera o hash SHA-256 de uma chave privada
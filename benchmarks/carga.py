@@ -0,0 +1,321 @@
+"""
+Teste de Carga da API
+Sobe a API com o provedor de cotações fixo, cria carteiras e mede vazão e latência de uma
+mistura de consultas de saldo, depósitos, saques, conversões e transferências disputadas
+
+Uso (banco de homologação configurado no .env):
+    python -m benchmarks.carga [--modo sync|async] [--armazenamento mysql|memoria]
+                               [--carteiras 1000] [--concorrencia 64] [--duracao 30]
+                               [--mistura saldos=50,deposito=20,saque=10,conversao=10,transferencia=10]
+                               [--disputadas 10] [--saida resultados.json]
+
+Com --url o teste usa uma API já em execução (que deve usar COTACAO_PROVEDOR=fixo para não
+depender da Coinbase). As transferências acontecem só entre as --disputadas primeiras carteiras,
+nos dois sentidos, para medir a disputa por travas; as demais operações sorteiam entre todas.
+Deadlocks e esperas de trava vêm de GET /metrics (do worker que responder, com --workers > 1).
+Os resultados em JSON podem ser comparados com `python -m benchmarks.comparar`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import httpx
+
+OPERACOES = ('saldos', 'deposito', 'saque', 'conversao', 'transferencia')
+MISTURA_PADRAO = 'saldos=50,deposito=20,saque=10,conversao=10,transferencia=10'
+
+VALOR_DEPOSITO = '1.00'
+VALOR_SAQUE = '0.50'
+VALOR_CONVERSAO = '1.00'
+VALOR_TRANSFERENCIA = '0.10'
+
+
+def percentil(valores, percentual):
+    """Percentil de uma lista já ordenada"""
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * percentual / 100))]
+
+def _mistura(texto):
+    pesos = {}
+    for parte in texto.split(','):
+        operacao, _, peso = parte.partition('=')
+        operacao = operacao.strip()
+        if operacao not in OPERACOES:
+            raise argparse.ArgumentTypeError(f"operação desconhecida na mistura: {operacao}")
+        pesos[operacao] = float(peso)
+    if not any(pesos.values()):
+        raise argparse.ArgumentTypeError("a mistura precisa de ao menos um peso positivo")
+    return pesos
+
+def _versao():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# SERVIDOR
+
+def _porta_livre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def subir_api(modo, workers, concorrencia, armazenamento='mysql'):
+    porta = _porta_livre()
+    ambiente = dict(
+        os.environ,
+        API_MODO=modo,
+        ARMAZENAMENTO=armazenamento,
+        COTACAO_PROVEDOR='fixo',
+        DB_POOL_MAX=os.environ.get('DB_POOL_MAX', str(max(10, concorrencia))),
+    )
+    if armazenamento == 'memoria':
+        # livro novo a cada teste, para não acumular carteiras de execuções anteriores
+        ambiente['LIVRO_DIRETORIO'] = tempfile.mkdtemp(prefix='livro-carga-')
+    processo = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(porta),
+         '--workers', str(workers), '--log-level', 'warning'],
+        env=ambiente
+    )
+    url = f"http://127.0.0.1:{porta}"
+    prazo = time.monotonic() + 30
+    while time.monotonic() < prazo:
+        if processo.poll() is not None:
+            raise RuntimeError(f"a API terminou na subida (código {processo.returncode})")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return processo, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    processo.terminate()
+    raise RuntimeError("a API não respondeu em 30 segundos")
+
+
+# CARTEIRAS
+
+def criar_carteiras(cliente, quantidade, moedas, saldo_inicial):
+    resposta = cliente.post('/carteiras/lote', json={'quantidade': quantidade}, timeout=None)
+    resposta.raise_for_status()
+    linhas = [json.loads(linha) for linha in resposta.text.splitlines() if linha]
+    if linhas[-1].get('status') != 'confirmado':
+        raise RuntimeError(f"criação das carteiras falhou: {linhas[-1]}")
+    carteiras = [(linha['endereco_carteira'], linha['chave_privada']) for linha in linhas[:-1]]
+
+    depositos = [
+        {'tipo': 'DEPOSITO', 'endereco_carteira': endereco, 'codigo_moeda': moeda, 'valor': saldo_inicial}
+        for endereco, _ in carteiras for moeda in moedas
+    ]
+    for inicio in range(0, len(depositos), 1000):
+        resposta = cliente.post('/operacoes/lote', json={'operacoes': depositos[inicio:inicio + 1000]}, timeout=None)
+        resposta.raise_for_status()
+    return carteiras
+
+def _repeticoes(cliente):
+    """Totais de carteira_db_repeticoes_* em GET /metrics (None se a API não expõe métricas)"""
+    try:
+        resposta = cliente.get('/metrics')
+    except httpx.HTTPError:
+        return None
+    if resposta.status_code != 200:
+        return None
+    totais = {}
+    for linha in resposta.text.splitlines():
+        if linha.startswith('carteira_db_repeticoes'):
+            nome, _, valor = linha.rpartition(' ')
+            totais[nome] = float(valor)
+    return totais
+
+
+# CARGA
+
+class Gerador:
+    """Monta as requisições de cada operação, sorteando carteiras e moedas"""
+
+    def __init__(self, carteiras, moedas, disputadas, semente):
+        self.carteiras = carteiras
+        self.disputadas = carteiras[:max(2, disputadas)]
+        self.moedas = moedas
+        self.aleatorio = random.Random(semente)
+
+    def requisicao(self, operacao):
+        endereco, chave = self.aleatorio.choice(self.carteiras)
+        moeda = self.aleatorio.choice(self.moedas)
+        if operacao == 'saldos':
+            return 'GET', f'/carteiras/{endereco}/saldos', None
+        if operacao == 'deposito':
+            return 'POST', f'/carteiras/{endereco}/depositos', {'codigo_moeda': moeda, 'valor': VALOR_DEPOSITO}
+        if operacao == 'saque':
+            return 'POST', f'/carteiras/{endereco}/saques', {
+                'codigo_moeda': moeda, 'valor': VALOR_SAQUE, 'chave_privada': chave
+            }
+        if operacao == 'conversao':
+            origem, destino = self.aleatorio.sample(self.moedas, 2)
+            return 'POST', f'/carteiras/{endereco}/conversoes', {
+                'codigo_origem': origem, 'codigo_destino': destino, 'valor': VALOR_CONVERSAO, 'chave_privada': chave
+            }
+        (endereco, chave), (destino, _) = self.aleatorio.sample(self.disputadas, 2)
+        return 'POST', f'/carteiras/{endereco}/transferencias', {
+            'endereco_destino': destino, 'codigo_moeda': moeda, 'valor': VALOR_TRANSFERENCIA, 'chave_privada': chave
+        }
+
+
+async def _trabalhar(cliente, gerador, operacoes, pesos, inicio_medicao, prazo, medidas):
+    while time.monotonic() < prazo:
+        operacao = gerador.aleatorio.choices(operacoes, pesos)[0]
+        metodo, caminho, corpo = gerador.requisicao(operacao)
+        inicio = time.monotonic()
+        try:
+            resposta = await cliente.request(metodo, caminho, json=corpo)
+            resultado = 'ok' if resposta.status_code < 400 else 'rejeitada' if resposta.status_code < 500 else 'erro'
+        except httpx.HTTPError:
+            resultado = 'erro'
+        fim = time.monotonic()
+        if inicio >= inicio_medicao:
+            medida = medidas[operacao]
+            medida[resultado] += 1
+            if resultado != 'erro':
+                medida['latencias'].append(fim - inicio)
+
+async def executar_carga(url, carteiras, moedas, mistura, concorrencia, duracao, aquecimento, disputadas, semente):
+    operacoes = [operacao for operacao in OPERACOES if mistura.get(operacao, 0) > 0]
+    pesos = [mistura[operacao] for operacao in operacoes]
+    medidas = {operacao: {'ok': 0, 'rejeitada': 0, 'erro': 0, 'latencias': []} for operacao in operacoes}
+
+    limites = httpx.Limits(max_connections=concorrencia, max_keepalive_connections=concorrencia)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=30) as cliente:
+        inicio_medicao = time.monotonic() + aquecimento
+        prazo = inicio_medicao + duracao
+        await asyncio.gather(*(
+            _trabalhar(cliente, Gerador(carteiras, moedas, disputadas, semente + indice),
+                       operacoes, pesos, inicio_medicao, prazo, medidas)
+            for indice in range(concorrencia)
+        ))
+    return medidas
+
+
+# RESULTADOS
+
+def resumir(medidas, duracao):
+    resumo = {}
+    for operacao, medida in medidas.items():
+        latencias = sorted(medida['latencias'])
+        total = medida['ok'] + medida['rejeitada'] + medida['erro']
+        resumo[operacao] = {
+            'requisicoes': total,
+            'ok': medida['ok'],
+            'rejeitadas': medida['rejeitada'],
+            'erros': medida['erro'],
+            'taxa_erro': medida['erro'] / total if total else 0.0,
+            'operacoes_por_segundo': medida['ok'] / duracao,
+            'p50_ms': percentil(latencias, 50) * 1000,
+            'p95_ms': percentil(latencias, 95) * 1000,
+            'p99_ms': percentil(latencias, 99) * 1000,
+        }
+    todas = sorted(latencia for medida in medidas.values() for latencia in medida['latencias'])
+    requisicoes = sum(item['requisicoes'] for item in resumo.values())
+    erros = sum(item['erros'] for item in resumo.values())
+    resumo['total'] = {
+        'requisicoes': requisicoes,
+        'ok': sum(item['ok'] for item in resumo.values()),
+        'rejeitadas': sum(item['rejeitadas'] for item in resumo.values()),
+        'erros': erros,
+        'taxa_erro': erros / requisicoes if requisicoes else 0.0,
+        'operacoes_por_segundo': sum(item['operacoes_por_segundo'] for item in resumo.values()),
+        'p50_ms': percentil(todas, 50) * 1000,
+        'p95_ms': percentil(todas, 95) * 1000,
+        'p99_ms': percentil(todas, 99) * 1000,
+    }
+    return resumo
+
+def imprimir(resumo, repeticoes):
+    print(f"{'operação':<14} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rejeit.':>8} {'erros':>7}")
+    for operacao, item in resumo.items():
+        print(f"{operacao:<14} {item['operacoes_por_segundo']:>9.1f} {item['p50_ms']:>8.2f} {item['p95_ms']:>8.2f} "
+              f"{item['p99_ms']:>8.2f} {item['rejeitadas']:>8} {item['erros']:>7}")
+    if repeticoes is not None:
+        print("repetições no banco: " + ", ".join(f"{nome} {valor:g}" for nome, valor in repeticoes.items()))
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Teste de carga dos endpoints de carteira")
+    parser.add_argument('--url', help="API já em execução; sem ela o teste sobe a API com uvicorn")
+    parser.add_argument('--modo', choices=('sync', 'async'), default='sync', help="API_MODO da API iniciada")
+    parser.add_argument('--armazenamento', choices=('mysql', 'memoria'), default='mysql',
+                        help="ARMAZENAMENTO da API iniciada (memoria: livro em diretório temporário)")
+    parser.add_argument('--workers', type=int, default=1, help="workers do uvicorn da API iniciada")
+    parser.add_argument('--carteiras', type=int, default=1000, help="carteiras criadas para o teste")
+    parser.add_argument('--moedas', default='USD,BRL', help="moedas usadas, separadas por vírgula (ao menos duas)")
+    parser.add_argument('--saldo-inicial', default='100000', help="saldo inicial de cada moeda em cada carteira")
+    parser.add_argument('--concorrencia', type=int, default=64, help="requisições simultâneas")
+    parser.add_argument('--duracao', type=float, default=30, help="segundos de medição")
+    parser.add_argument('--aquecimento', type=float, default=3, help="segundos de carga antes de medir")
+    parser.add_argument('--mistura', type=_mistura, default=_mistura(MISTURA_PADRAO),
+                        help=f"pesos das operações (padrão: {MISTURA_PADRAO})")
+    parser.add_argument('--disputadas', type=int, default=10, help="carteiras entre as quais ocorrem as transferências")
+    parser.add_argument('--semente', type=int, default=1, help="semente dos sorteios")
+    parser.add_argument('--saida', help="arquivo JSON com os resultados")
+    args = parser.parse_args(argumentos)
+
+    moedas = [moeda.strip() for moeda in args.moedas.split(',') if moeda.strip()]
+    if len(moedas) < 2:
+        parser.error("--moedas precisa de ao menos duas moedas (conversões)")
+    if args.armazenamento == 'memoria' and args.workers > 1 and args.url is None:
+        parser.error("--armazenamento memoria aceita um único worker")
+
+    processo = None
+    url = args.url
+    if url is None:
+        processo, url = subir_api(args.modo, args.workers, args.concorrencia, args.armazenamento)
+    try:
+        with httpx.Client(base_url=url, timeout=30) as cliente:
+            carteiras = criar_carteiras(cliente, args.carteiras, moedas, args.saldo_inicial)
+            antes = _repeticoes(cliente)
+            medidas = asyncio.run(executar_carga(
+                url, carteiras, moedas, args.mistura, args.concorrencia, args.duracao,
+                args.aquecimento, args.disputadas, args.semente
+            ))
+            depois = _repeticoes(cliente)
+    finally:
+        if processo is not None:
+            processo.terminate()
+            processo.wait()
+
+    resumo = resumir(medidas, args.duracao)
+    repeticoes = None
+    if antes is not None and depois is not None:
+        # inclui o período de aquecimento
+        repeticoes = {nome: valor - antes.get(nome, 0) for nome, valor in depois.items()}
+    imprimir(resumo, repeticoes)
+
+    if args.saida:
+        resultado = {
+            'versao': _versao(),
+            'data': datetime.now(timezone.utc).isoformat(),
+            'parametros': {
+                'url': args.url, 'modo': None if args.url else args.modo, 'workers': None if args.url else args.workers,
+                'armazenamento': None if args.url else args.armazenamento,
+                'carteiras': args.carteiras, 'moedas': moedas, 'concorrencia': args.concorrencia,
+                'duracao': args.duracao, 'aquecimento': args.aquecimento, 'mistura': args.mistura,
+                'disputadas': args.disputadas, 'semente': args.semente,
+            },
+            'operacoes': resumo,
+            'repeticoes': repeticoes,
+        }
+        with open(args.saida, 'w') as arquivo:
+            json.dump(resultado, arquivo, indent=2)
+
+
+if __name__ == '__main__':
+    main()
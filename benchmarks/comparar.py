@@ -0,0 +1,74 @@
+"""
+Comparação de Resultados do Teste de Carga
+Compara dois JSON gerados por `python -m benchmarks.carga --saida` e aponta regressões
+
+Uso:
+    python -m benchmarks.comparar base.json novo.json [--tolerancia 10]
+
+Há regressão quando, em alguma operação, ops/s cai ou o p99 sobe mais que a tolerância
+(em %), ou quando a taxa de erro sobe mais de 0,1 ponto percentual. Sai com código 1 se
+houver regressão, para uso em CI.
+"""
+import argparse
+import json
+import sys
+
+
+def _variacao(base, novo):
+    if not base:
+        return 0.0
+    return (novo - base) / base * 100
+
+def comparar(base, novo, tolerancia):
+    """Retorna as linhas da comparação e as regressões encontradas"""
+    linhas = []
+    regressoes = []
+    for operacao, item_novo in novo['operacoes'].items():
+        item_base = base['operacoes'].get(operacao)
+        if item_base is None:
+            continue
+        vazao = _variacao(item_base['operacoes_por_segundo'], item_novo['operacoes_por_segundo'])
+        p99 = _variacao(item_base['p99_ms'], item_novo['p99_ms'])
+        linhas.append(
+            f"{operacao:<14} {item_base['operacoes_por_segundo']:>11.1f} {item_novo['operacoes_por_segundo']:>11.1f} {vazao:>+7.1f}% "
+            f"{item_base['p99_ms']:>11.2f} {item_novo['p99_ms']:>11.2f} {p99:>+7.1f}%"
+        )
+        if vazao < -tolerancia:
+            regressoes.append(f"{operacao}: ops/s {vazao:+.1f}%")
+        if p99 > tolerancia:
+            regressoes.append(f"{operacao}: p99 {p99:+.1f}%")
+        if item_novo['taxa_erro'] > item_base['taxa_erro'] + 0.001:
+            regressoes.append(
+                f"{operacao}: taxa de erro {item_base['taxa_erro']:.2%} -> {item_novo['taxa_erro']:.2%}"
+            )
+    return linhas, regressoes
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Compara dois resultados do teste de carga")
+    parser.add_argument('base', help="resultado de referência")
+    parser.add_argument('novo', help="resultado a comparar")
+    parser.add_argument('--tolerancia', type=float, default=10, help="variação aceita em %% (padrão 10)")
+    args = parser.parse_args(argumentos)
+
+    with open(args.base) as arquivo:
+        base = json.load(arquivo)
+    with open(args.novo) as arquivo:
+        novo = json.load(arquivo)
+    if base['parametros'] != novo['parametros']:
+        print("aviso: os parâmetros dos dois testes são diferentes", file=sys.stderr)
+
+    linhas, regressoes = comparar(base, novo, args.tolerancia)
+    print(f"base: {base.get('versao')} ({base['data']})  novo: {novo.get('versao')} ({novo['data']})")
+    print(f"{'operação':<14} {'ops/s base':>11} {'ops/s novo':>11} {'':>8} {'p99 ms base':>11} {'p99 ms novo':>11}")
+    print("\n".join(linhas))
+    if regressoes:
+        print("\nregressões:")
+        for regressao in regressoes:
+            print(f"  {regressao}")
+        sys.exit(1)
+    print("\nsem regressões")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Benchmark dos Saldos Particionados
+Mede operações por segundo sobre uma única carteira quente para cada quantidade de slots
+
+Uso (banco de homologação configurado no .env, com a tabela SALDO_CARTEIRA_SLOT criada):
+    python -m benchmarks.saldos_particionados [--slots 0,1,2,4,8,16,32] [--threads 32] [--duracao 10] [--saques 0.05]
+
+Cada quantidade de slots roda em um processo próprio, porque a configuração é lida na importação;
+0 é a carteira fora de CARTEIRAS_QUENTES (todos os créditos na mesma linha; os slots de rodadas
+anteriores voltam para a linha principal na subida da rodada). Ao final de cada rodada o saldo é
+relido do banco e comparado com a soma das operações confirmadas.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from decimal import Decimal
+
+VALOR_DEPOSITO = Decimal('1.00000000')
+VALOR_SAQUE = Decimal('0.50000000')
+
+
+def _percentil(valores, percentual):
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * percentual / 100))]
+
+
+# RODADA
+# executada no processo filho, com a configuração de slots no ambiente
+
+def _saldo_no_banco(services, endereco, codigo_moeda):
+    services.obter_cache_saldos().limpar()
+    saldos = services.obter_saldos(endereco)
+    return next(saldo['saldo'] for saldo in saldos if saldo['codigo'] == codigo_moeda)
+
+def rodada(endereco, chave_privada, codigo_moeda, threads, duracao, proporcao_saques):
+    from app import services
+    from app.config import TAXA_SAQUE_PERCENTUAL, SALDO_SLOTS
+    from app.moedas import recarregar_catalogo
+
+    recarregar_catalogo()
+    services.preparar_carteiras_quentes()
+    saldo_inicial = _saldo_no_banco(services, endereco, codigo_moeda)
+    _, total_saque = services.calcular_taxa(VALOR_SAQUE, TAXA_SAQUE_PERCENTUAL)
+
+    latencias = []
+    contagem = {'depositos': 0, 'saques': 0, 'saldo_insuficiente': 0, 'erros': 0}
+    lock = threading.Lock()
+    prazo = time.monotonic() + duracao
+
+    def trabalhar():
+        minhas_latencias = []
+        minha_contagem = dict.fromkeys(contagem, 0)
+        while time.monotonic() < prazo:
+            inicio = time.monotonic()
+            try:
+                if random.random() < proporcao_saques:
+                    services.realizar_saque(endereco, codigo_moeda, VALOR_SAQUE, chave_privada)
+                    minha_contagem['saques'] += 1
+                else:
+                    services.realizar_deposito(endereco, codigo_moeda, VALOR_DEPOSITO)
+                    minha_contagem['depositos'] += 1
+            except ValueError:
+                minha_contagem['saldo_insuficiente'] += 1
+            except Exception:
+                minha_contagem['erros'] += 1
+            minhas_latencias.append(time.monotonic() - inicio)
+        with lock:
+            latencias.extend(minhas_latencias)
+            for chave, valor in minha_contagem.items():
+                contagem[chave] += valor
+
+    inicio = time.monotonic()
+    trabalhadores = [threading.Thread(target=trabalhar) for _ in range(threads)]
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    decorrido = time.monotonic() - inicio
+
+    esperado = saldo_inicial + contagem['depositos'] * VALOR_DEPOSITO - contagem['saques'] * total_saque
+    saldo_final = _saldo_no_banco(services, endereco, codigo_moeda)
+    latencias.sort()
+    confirmadas = contagem['depositos'] + contagem['saques']
+    return {
+        'slots': SALDO_SLOTS if services.particionada(endereco) else 0,
+        **contagem,
+        'operacoes_por_segundo': confirmadas / decorrido,
+        'p50_ms': _percentil(latencias, 50) * 1000,
+        'p99_ms': _percentil(latencias, 99) * 1000,
+        'saldo_final': str(saldo_final),
+        'saldo_consistente': saldo_final == esperado and saldo_final >= 0,
+    }
+
+
+# COORDENAÇÃO
+
+def _executar_rodada(slots, endereco, chave_privada, args):
+    ambiente = dict(
+        os.environ,
+        SALDOS_PARTICIONADOS='true',
+        CARTEIRAS_QUENTES=endereco if slots else '',
+        SALDO_SLOTS=str(slots or 1),
+        DB_POOL_MAX=str(args.threads),
+        DEPOSITO_COMMIT_AGRUPADO='false',
+    )
+    comando = [
+        sys.executable, '-m', 'benchmarks.saldos_particionados', '--rodada',
+        '--endereco', endereco, '--chave-privada', chave_privada, '--moeda', args.moeda,
+        '--threads', str(args.threads), '--duracao', str(args.duracao), '--saques', str(args.saques),
+    ]
+    saida = subprocess.run(comando, env=ambiente, capture_output=True, text=True, check=True).stdout
+    return json.loads(saida.strip().splitlines()[-1])
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Vazão de uma carteira quente por quantidade de slots")
+    parser.add_argument('--slots', default='0,1,2,4,8,16,32',
+                        help="quantidades de slots separadas por vírgula (0: sem particionamento)")
+    parser.add_argument('--threads', type=int, default=32, help="operações simultâneas")
+    parser.add_argument('--duracao', type=float, default=10, help="segundos por rodada")
+    parser.add_argument('--saques', type=float, default=0.05, help="proporção de saques (0 a 1)")
+    parser.add_argument('--moeda', default='USD')
+    parser.add_argument('--rodada', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--endereco', help=argparse.SUPPRESS)
+    parser.add_argument('--chave-privada', help=argparse.SUPPRESS)
+    args = parser.parse_args(argumentos)
+
+    if args.rodada:
+        resultado = rodada(args.endereco, args.chave_privada, args.moeda, args.threads, args.duracao, args.saques)
+        print(json.dumps(resultado))
+        return
+
+    from app.services import criar_carteira, realizar_deposito
+
+    # carteira nova, com saldo para os primeiros saques
+    carteira = criar_carteira()
+    realizar_deposito(carteira['endereco_carteira'], args.moeda, Decimal('1000'))
+
+    resultados = []
+    print(f"{'slots':>6} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'ganho':>7}  consistente")
+    for slots in (int(valor) for valor in args.slots.split(',')):
+        resultado = _executar_rodada(slots, carteira['endereco_carteira'], carteira['chave_privada'], args)
+        resultados.append(resultado)
+        ganho = resultado['operacoes_por_segundo'] / resultados[0]['operacoes_por_segundo']
+        print(f"{slots or 'sem':>6} {resultado['operacoes_por_segundo']:>10.1f} {resultado['p50_ms']:>8.2f} "
+              f"{resultado['p99_ms']:>8.2f} {ganho:>6.2f}x  {'sim' if resultado['saldo_consistente'] else 'NÃO'}")
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == '__main__':
+    main()
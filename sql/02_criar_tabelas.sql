@@ -23,6 +23,19 @@ CREATE TABLE IF NOT EXISTS SALDO_CARTEIRA (
     FOREIGN KEY (id_moeda) REFERENCES MOEDA(id_moeda)
 );
 
+-- slots de crédito das carteiras quentes (SALDOS_PARTICIONADOS): o saldo da carteira é o de
+-- SALDO_CARTEIRA mais a soma dos slots
+CREATE TABLE IF NOT EXISTS SALDO_CARTEIRA_SLOT (
+    endereco_carteira VARCHAR(64) NOT NULL,
+    id_moeda SMALLINT NOT NULL,
+    slot SMALLINT NOT NULL,
+    saldo DECIMAL(20, 8) NOT NULL DEFAULT 0.00000000,
+    
+    PRIMARY KEY (endereco_carteira, id_moeda, slot),
+    
+    FOREIGN KEY (endereco_carteira, id_moeda) REFERENCES SALDO_CARTEIRA(endereco_carteira, id_moeda)
+);
+
 CREATE TABLE IF NOT EXISTS DEPOSITO_SAQUE (
     id_movimento INT AUTO_INCREMENT PRIMARY KEY,
     endereco_carteira VARCHAR(64) NOT NULL,
@@ -34,6 +47,11 @@ CREATE TABLE IF NOT EXISTS DEPOSITO_SAQUE (
     taxa_valor DECIMAL(20, 8) DEFAULT 0.00000000,
     data_hora DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     
+    -- extrato da carteira em ordem de data (GET /carteiras/{endereco}/extrato)
+    INDEX idx_deposito_saque_extrato (endereco_carteira, data_hora, id_movimento),
+    -- exportação por período (python -m app.exportacao / GET /exportacoes/movimentos)
+    INDEX idx_deposito_saque_data (data_hora),
+    
     FOREIGN KEY (endereco_carteira) REFERENCES CARTEIRA(endereco_carteira),
     FOREIGN KEY (id_moeda) REFERENCES MOEDA(id_moeda)
 );
@@ -49,6 +67,8 @@ CREATE TABLE IF NOT EXISTS CONVERSAO (
     taxa_valor DECIMAL(20, 8) NOT NULL DEFAULT 0.00000000,
     cotacao_utilizada DECIMAL(20, 8) NOT NULL,
     data_hora DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_conversao_extrato (endereco_carteira, data_hora, id_conversao),
+    INDEX idx_conversao_data (data_hora),
     FOREIGN KEY (endereco_carteira) REFERENCES CARTEIRA(endereco_carteira),
     FOREIGN KEY (id_moeda_origem) REFERENCES MOEDA(id_moeda),
     FOREIGN KEY (id_moeda_destino) REFERENCES MOEDA(id_moeda)
@@ -65,7 +85,74 @@ CREATE TABLE IF NOT EXISTS TRANSFERENCIA (
     taxa_valor DECIMAL(20, 8) NOT NULL,
     data_hora DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     
+    -- extrato das transferências enviadas e recebidas
+    INDEX idx_transferencia_origem_extrato (endereco_origem, data_hora, id_transferencia),
+    INDEX idx_transferencia_destino_extrato (endereco_destino, data_hora, id_transferencia),
+    INDEX idx_transferencia_data (data_hora),
+    
     FOREIGN KEY (endereco_origem) REFERENCES CARTEIRA(endereco_carteira),
     FOREIGN KEY (endereco_destino) REFERENCES CARTEIRA(endereco_carteira),
     FOREIGN KEY (id_moeda) REFERENCES MOEDA(id_moeda)
-);
\ No newline at end of file
+);
+
+-- reconciliação de saldos (python -m app.reconciliacao): último id somado de cada tabela de movimentos
+CREATE TABLE IF NOT EXISTS RECONCILIACAO_MARCA (
+    tabela VARCHAR(32) PRIMARY KEY,
+    ultimo_id BIGINT NOT NULL DEFAULT 0,
+    atualizado_em DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- soma dos movimentos até as marcas, por carteira e moeda; `pendente` marca os totais alterados
+-- (ou divergentes) que a próxima comparação com SALDO_CARTEIRA precisa conferir
+CREATE TABLE IF NOT EXISTS RECONCILIACAO_TOTAL (
+    endereco_carteira VARCHAR(64) NOT NULL,
+    id_moeda SMALLINT NOT NULL,
+    total DECIMAL(30, 8) NOT NULL DEFAULT 0.00000000,
+    pendente BOOLEAN NOT NULL DEFAULT TRUE,
+    
+    PRIMARY KEY (endereco_carteira, id_moeda),
+    INDEX idx_reconciliacao_pendente (pendente, endereco_carteira, id_moeda)
+);
+
+-- eventos de saldo (EVENTOS_SALDO=true): gravados na mesma transação que altera o saldo e lidos em
+-- ordem de id pelo despachante (app/eventos.py); sem chaves estrangeiras para não travar CARTEIRA
+-- nas gravações, e apagados após EVENTOS_RETENCAO_HORAS
+CREATE TABLE IF NOT EXISTS EVENTO_SALDO (
+    id_evento BIGINT AUTO_INCREMENT PRIMARY KEY,
+    endereco_carteira VARCHAR(64) NOT NULL,
+    id_moeda SMALLINT NOT NULL,
+    tipo ENUM('DEPOSITO', 'SAQUE', 'CONVERSAO', 'TRANSFERENCIA_ENVIADA', 'TRANSFERENCIA_RECEBIDA') NOT NULL,
+    variacao DECIMAL(20, 8) NOT NULL,
+    data_hora DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    
+    -- leitura de quem retoma com um cursor antigo
+    INDEX idx_evento_saldo_carteira (endereco_carteira, id_evento)
+);
+
+-- pulso de replicação (DB_REPLICAS): o primário regrava a linha a cada DB_REPLICA_VERIFICACAO segundos e
+-- o atraso de cada réplica é a diferença entre o instante gravado e o lido nela (app/database.py)
+CREATE TABLE IF NOT EXISTS REPLICACAO_PULSO (
+    id TINYINT PRIMARY KEY,
+    instante DATETIME(6) NOT NULL
+);
+
+-- resultados das operações com Idempotency-Key (app/idempotencia.py): gravados na mesma transação da
+-- operação, antes de travar saldos, para que uma repetição em outro worker espere a original na chave
+-- primária; apagados após IDEMPOTENCIA_RETENCAO_HORAS
+CREATE TABLE IF NOT EXISTS IDEMPOTENCIA (
+    chave VARCHAR(255) PRIMARY KEY,
+    impressao CHAR(64) NOT NULL,
+    resultado TEXT NOT NULL,
+    criada_em DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    
+    INDEX idx_idempotencia_criada_em (criada_em)
+);
+
+-- cotações travadas já gastas (app/cotacoes_travadas.py): sha256 do id, gravado na transação da
+-- conversão para que o segundo uso seja recusado em qualquer worker; apagadas depois de expirarem
+CREATE TABLE IF NOT EXISTS COTACAO_USADA (
+    id_cotacao CHAR(64) PRIMARY KEY,
+    expira_em DATETIME NOT NULL,
+    
+    INDEX idx_cotacao_usada_expira_em (expira_em)
+);
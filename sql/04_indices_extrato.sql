@@ -0,0 +1,13 @@
+USE wallet_homolog;
+
+-- índices do extrato para bancos criados antes de eles entrarem em 02_criar_tabelas.sql
+-- (em bancos novos o script 02 já os cria)
+ALTER TABLE DEPOSITO_SAQUE
+    ADD INDEX idx_deposito_saque_extrato (endereco_carteira, data_hora, id_movimento);
+
+ALTER TABLE CONVERSAO
+    ADD INDEX idx_conversao_extrato (endereco_carteira, data_hora, id_conversao);
+
+ALTER TABLE TRANSFERENCIA
+    ADD INDEX idx_transferencia_origem_extrato (endereco_origem, data_hora, id_transferencia),
+    ADD INDEX idx_transferencia_destino_extrato (endereco_destino, data_hora, id_transferencia);
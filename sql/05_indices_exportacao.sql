@@ -0,0 +1,9 @@
+USE wallet_homolog;
+
+-- índices por período da exportação, para bancos criados antes de eles entrarem em 02_criar_tabelas.sql
+-- (o id da chave primária faz parte do índice, então ORDER BY data_hora, id não ordena no servidor)
+ALTER TABLE DEPOSITO_SAQUE ADD INDEX idx_deposito_saque_data (data_hora);
+
+ALTER TABLE CONVERSAO ADD INDEX idx_conversao_data (data_hora);
+
+ALTER TABLE TRANSFERENCIA ADD INDEX idx_transferencia_data (data_hora);
@@ -0,0 +1,14 @@
+USE wallet_homolog;
+
+-- slots de crédito das carteiras quentes, para bancos criados antes de a tabela entrar em 02_criar_tabelas.sql
+-- os slots de cada carteira são criados pela aplicação na subida (CARTEIRAS_QUENTES, SALDO_SLOTS)
+CREATE TABLE IF NOT EXISTS SALDO_CARTEIRA_SLOT (
+    endereco_carteira VARCHAR(64) NOT NULL,
+    id_moeda SMALLINT NOT NULL,
+    slot SMALLINT NOT NULL,
+    saldo DECIMAL(20, 8) NOT NULL DEFAULT 0.00000000,
+    
+    PRIMARY KEY (endereco_carteira, id_moeda, slot),
+    
+    FOREIGN KEY (endereco_carteira, id_moeda) REFERENCES SALDO_CARTEIRA(endereco_carteira, id_moeda)
+);
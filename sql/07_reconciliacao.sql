@@ -0,0 +1,19 @@
+USE wallet_homolog;
+
+-- tabelas da reconciliação de saldos, para bancos criados antes de elas entrarem em 02_criar_tabelas.sql
+-- a primeira execução de `python -m app.reconciliacao` soma todo o histórico, em blocos
+CREATE TABLE IF NOT EXISTS RECONCILIACAO_MARCA (
+    tabela VARCHAR(32) PRIMARY KEY,
+    ultimo_id BIGINT NOT NULL DEFAULT 0,
+    atualizado_em DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS RECONCILIACAO_TOTAL (
+    endereco_carteira VARCHAR(64) NOT NULL,
+    id_moeda SMALLINT NOT NULL,
+    total DECIMAL(30, 8) NOT NULL DEFAULT 0.00000000,
+    pendente BOOLEAN NOT NULL DEFAULT TRUE,
+    
+    PRIMARY KEY (endereco_carteira, id_moeda),
+    INDEX idx_reconciliacao_pendente (pendente, endereco_carteira, id_moeda)
+);
@@ -0,0 +1,14 @@
+USE wallet_homolog;
+
+-- outbox dos eventos de saldo, para bancos criados antes dela entrar em 02_criar_tabelas.sql
+-- só é gravada com EVENTOS_SALDO=true
+CREATE TABLE IF NOT EXISTS EVENTO_SALDO (
+    id_evento BIGINT AUTO_INCREMENT PRIMARY KEY,
+    endereco_carteira VARCHAR(64) NOT NULL,
+    id_moeda SMALLINT NOT NULL,
+    tipo ENUM('DEPOSITO', 'SAQUE', 'CONVERSAO', 'TRANSFERENCIA_ENVIADA', 'TRANSFERENCIA_RECEBIDA') NOT NULL,
+    variacao DECIMAL(20, 8) NOT NULL,
+    data_hora DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    
+    INDEX idx_evento_saldo_carteira (endereco_carteira, id_evento)
+);
@@ -0,0 +1,8 @@
+USE wallet_homolog;
+
+-- pulso das réplicas de leitura, para bancos criados antes dele entrar em 02_criar_tabelas.sql
+-- só é gravado com DB_REPLICAS configurado
+CREATE TABLE IF NOT EXISTS REPLICACAO_PULSO (
+    id TINYINT PRIMARY KEY,
+    instante DATETIME(6) NOT NULL
+);
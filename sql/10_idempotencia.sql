@@ -0,0 +1,12 @@
+USE wallet_homolog;
+
+-- resultados das operações com Idempotency-Key, para bancos criados antes dela entrar em
+-- 02_criar_tabelas.sql
+CREATE TABLE IF NOT EXISTS IDEMPOTENCIA (
+    chave VARCHAR(255) PRIMARY KEY,
+    impressao CHAR(64) NOT NULL,
+    resultado TEXT NOT NULL,
+    criada_em DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    
+    INDEX idx_idempotencia_criada_em (criada_em)
+);
@@ -0,0 +1,9 @@
+USE wallet_homolog;
+
+-- cotações travadas já gastas, para bancos criados antes delas entrarem em 02_criar_tabelas.sql
+CREATE TABLE IF NOT EXISTS COTACAO_USADA (
+    id_cotacao CHAR(64) PRIMARY KEY,
+    expira_em DATETIME NOT NULL,
+    
+    INDEX idx_cotacao_usada_expira_em (expira_em)
+);